@@ -0,0 +1,207 @@
+"""Benchmark hors ligne de toutes les routes de server.py, avec le faux client pronotepy de fake_pronote.py.
+
+Le serveur est lancé dans un sous-processus (127.0.0.1, sans réseau), puis chaque route est appelée --requests fois
+par --concurrency connexions en parallèle, réparties entre --users comptes. Pour chaque route sont affichés
+les latences p50/p95/p99 et le débit. Les variables d'environnement du serveur (RESPONSE_CACHE_MAX_BYTES, JSON_ENCODER...)
+sont transmises au sous-processus. Avec --workers N (N > 1), le serveur tourne dans N processus et nécessite SESSION_BACKEND=redis, comme server.py.
+
+Utilisation : python bench.py [--users 10] [--concurrency 16] [--requests 200] [--latency 0.02] [--workers 1] [--routes /grades,/news] [--json resultats.json]
+"""
+
+import argparse, base64, http.client, json, os, secrets, socket, subprocess, sys, threading, time, urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+PRONOTE_URL = 'https://fake.index-education.net/pronote/eleve.html'
+
+def fake_app():
+    import fake_pronote, server
+    fake_pronote.install(server.pronotepy)
+    return server.app
+
+def serve(port: int, workers: int):
+    if workers == 1:
+        fake_app().run(host='127.0.0.1', port=port, single_process=True, access_log=False)
+        return
+
+    # chaque processus du serveur charge l'application avec fake_app, pour installer le faux client pronotepy
+    from sanic import Sanic
+    from sanic.worker.loader import AppLoader
+    loader = AppLoader(factory=fake_app)
+    app = loader.load()
+    app.prepare(host='127.0.0.1', port=port, workers=workers, access_log=False)
+    Sanic.serve(primary=app, app_loader=loader)
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+class Connection(threading.local):
+    """Une connexion HTTP keep-alive par thread."""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.connection = None
+
+    def request(self, method: str, path: str, params: dict, body: bytes|None = None, headers: dict = {}) -> tuple[int, bytes]:
+        url = path + '?' + urllib.parse.urlencode(params) if params else path
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            try:
+                self.connection.request(method, url, body=body, headers=headers)
+                response = self.connection.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                # le serveur a fermé la connexion keep-alive
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+def percentile(latencies: list[float], p: float) -> float:
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] if latencies else 0
+
+def run_route(connection: Connection, name: str, count: int, concurrency: int, make_request) -> dict:
+    """Exécute count fois une route avec concurrency requêtes en parallèle et retourne ses statistiques."""
+    def one(i):
+        method, path, params, body, headers = make_request(i)
+        start = time.perf_counter()
+        try:
+            status, _ = connection.request(method, path, params, body, headers)
+        except Exception:
+            status = 0
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one, range(count)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    statuses = {}
+    for _, status in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        'route': name,
+        'requests': count,
+        'errors': sum(n for status, n in statuses.items() if not 200 <= status < 400),
+        'statuses': statuses,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'throughput': count / elapsed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hors ligne de l'API Papillon")
+    parser.add_argument('--users', type=int, default=10, help='nombre de comptes connectés')
+    parser.add_argument('--concurrency', type=int, default=16, help='nombre de requêtes en parallèle')
+    parser.add_argument('--requests', type=int, default=200, help='nombre de requêtes par route')
+    parser.add_argument('--latency', type=float, default=0.02, help='latence (en sec) de chaque requête du faux Pronote')
+    parser.add_argument('--workers', type=int, default=1, help='nombre de processus du serveur (plus de 1 : SESSION_BACKEND=redis nécessaire)')
+    parser.add_argument('--routes', default='', help='les routes à mesurer, séparées par des virgules (toutes par défaut)')
+    parser.add_argument('--json', help='fichier où écrire les résultats en JSON')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error("--workers doit être supérieur ou égal à 1")
+    if args.workers > 1 and os.environ.get('SESSION_BACKEND', 'memory') != 'redis':
+        parser.error("plusieurs processus nécessitent SESSION_BACKEND=redis")
+    if args.serve:
+        return serve(args.serve, args.workers)
+
+    port = free_port()
+    metricsToken = secrets.token_hex(16)
+    env = dict(os.environ, FAKE_PRONOTE_LATENCY=str(args.latency), METRICS_TOKEN=metricsToken)
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port), '--workers', str(args.workers)], cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    connection = Connection(port)
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                if connection.request('GET', '/infos', {})[0] == 200:
+                    break
+            except OSError:
+                pass
+            if time.time() > deadline or process.poll() is not None:
+                sys.exit('le serveur ne démarre pas')
+            time.sleep(0.2)
+
+        b64 = lambda value: base64.b64encode(value.encode()).decode()
+        def login(i):
+            body = urllib.parse.urlencode({'url': b64(PRONOTE_URL), 'username': b64(f'eleve{i % args.users}'), 'password': b64('motdepasse')}).encode()
+            return 'POST', '/generatetoken', {}, body, {'Content-Type': 'application/x-www-form-urlencoded'}
+
+        # les premières connexions créent les sessions, les suivantes réutilisent celles des mêmes identifiants
+        results = [run_route(connection, '/generatetoken', args.users, args.concurrency, login)]
+        tokens = [json.loads(connection.request(*login(i))[1])['token'] for i in range(args.users)]
+
+        # les identifiants locaux des objets modifiés par les routes POST
+        def get(path, token, **params):
+            return json.loads(connection.request('GET', path, dict(params, token=token))[1])
+        weekFrom, weekTo = '2024-01-08', '2024-01-12'
+        ids = [{
+            'news': [news['local_id'] for news in get('/news', token)],
+            'discussions': [discussion['local_id'] for discussion in get('/discussions', token)],
+            'homework': [homework['local_id'] for homework in get('/homework', token, dateFrom=weekFrom, dateTo=weekTo)],
+            'recipients': [recipient['id'] for recipient in get('/recipients', token) if recipient['with_discussion']],
+        } for token in tokens]
+        days = ['2024-01-08', '2024-01-09', '2024-01-10', '2024-01-11', '2024-01-12', '2024-01-15', '2024-01-16']
+
+        def route(method, path, params=lambda i, user: {}, body=None, headers={}):
+            def make_request(i):
+                user = i % args.users
+                return method, path, dict(params(i, user), token=tokens[user]), body, dict(headers, **{'Content-Type': 'application/json'} if body else {})
+            return method + ' ' + path if method == 'POST' else path, make_request
+
+        routes = [
+            route('GET', '/'),
+            route('GET', '/infos'),
+            route('GET', '/user'),
+            route('GET', '/timetable', lambda i, user: {'dateString': days[i % len(days)]}),
+            route('GET', '/content', lambda i, user: {'dateString': days[i % len(days)]}),
+            route('GET', '/homework', lambda i, user: {'dateFrom': weekFrom, 'dateTo': weekTo}),
+            route('GET', '/grades'),
+            route('GET', '/evaluations'),
+            route('GET', '/absences'),
+            route('GET', '/delays'),
+            route('GET', '/punishments'),
+            route('GET', '/news'),
+            route('GET', '/discussions'),
+            route('GET', '/recipients'),
+            route('GET', '/menu', lambda i, user: {'dateFrom': weekFrom, 'dateTo': weekTo}),
+            route('GET', '/export/ical'),
+            route('GET', '/sync'),
+            route('GET', '/metrics', headers={'Authorization': 'Bearer ' + metricsToken}),
+            route('POST', '/batch', body=json.dumps(['/user', '/grades', f'/homework?dateFrom={weekFrom}&dateTo={weekTo}', '/news']).encode()),
+            route('POST', '/news/markAsRead', lambda i, user: {'newsId': ids[user]['news'][i % len(ids[user]['news'])]}),
+            route('POST', '/discussion/readState', lambda i, user: {'discussionId': ids[user]['discussions'][i % len(ids[user]['discussions'])]}),
+            route('POST', '/discussion/reply', lambda i, user: {'discussionId': ids[user]['discussions'][i % len(ids[user]['discussions'])], 'content': 'Merci !'}),
+            route('POST', '/discussion/delete', lambda i, user: {'discussionId': ids[user]['discussions'][i % len(ids[user]['discussions'])]}),
+            route('POST', '/discussion/create', lambda i, user: {'subject': 'Question', 'content': 'Bonjour', 'recipientsId': json.dumps(ids[user]['recipients'][:2])}),
+            route('POST', '/homework/changeState', lambda i, user: {'dateFrom': weekFrom, 'dateTo': weekTo, 'homeworkId': ids[user]['homework'][i % len(ids[user]['homework'])]}),
+            route('POST', '/changePeriod', lambda i, user: {'periodName': f'Trimestre {i % 3 + 1}'}),
+        ]
+
+        selected = [name.strip() for name in args.routes.split(',') if name.strip()]
+        for name, make_request in routes:
+            if not selected or name in selected or name.split(' ')[-1] in selected:
+                results.append(run_route(connection, name, args.requests, args.concurrency, make_request))
+    finally:
+        process.terminate()
+        process.wait()
+
+    print(f'{args.users} comptes, {args.concurrency} requêtes en parallèle, latence de Pronote {args.latency * 1000:.0f} ms, {args.workers} processus')
+    print(f'{"Route":<28}{"requêtes":>9}{"erreurs":>9}{"p50 (ms)":>10}{"p95 (ms)":>10}{"p99 (ms)":>10}{"req/s":>9}')
+    for result in results:
+        print(f'{result["route"]:<28}{result["requests"]:>9}{result["errors"]:>9}{result["p50"]:>10.1f}{result["p95"]:>10.1f}{result["p99"]:>10.1f}{result["throughput"]:>9.0f}')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf8') as f:
+            json.dump({'users': args.users, 'concurrency': args.concurrency, 'latency': args.latency, 'workers': args.workers, 'results': results}, f, indent=4)
+
+if __name__ == '__main__':
+    main()
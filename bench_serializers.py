@@ -0,0 +1,129 @@
+"""Micro-benchmark de la mise en forme JSON (µs par objet), sans Pronote.
+
+Compare, sur des objets synthétiques, l'ancienne mise en forme (dictionnaires écrits dans chaque endpoint,
+strftime pour chaque date, json de la bibliothèque standard) aux serializers de server.py avec l'encodeur choisi par JSON_ENCODER.
+
+Utilisation : python bench_serializers.py [nombre d'objets]
+"""
+
+import datetime, json, sys, timeit
+from types import SimpleNamespace as NS
+
+import server
+
+COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+DATE = datetime.datetime(2023, 9, 4, 8, 0)
+
+def file(i):
+    return NS(id=f'f{i}', name=f'fichier{i}.pdf', url=f'https://exemple.fr/{i}', type=1)
+
+def subject(i):
+    return NS(id=f's{i % 12}', name=f'Matière {i % 12}', groups=False)
+
+def lesson(i):
+    content = NS(title='Chapitre', description='Résumé du cours', category='Cours', files=[file(i)])
+    return NS(id=f'l{i}', num=i % 8, subject=subject(i), teacher_names=['M. Martin'], classrooms=['B12'], group_names=[], memo=None,
+        content=content, virtual_classrooms=[], start=DATE, end=DATE + datetime.timedelta(hours=1), background_color='#2a9d8f',
+        status=None, canceled=False, outing=False, detention=False, exempted=False, test=i % 5 == 0)
+
+def homework(i):
+    return NS(id=f'h{i}', subject=subject(i), description=f'Exercices {i} page 42 du manuel', background_color='#e76f51',
+        done=i % 2 == 0, date=DATE.date(), files=[file(i)])
+
+def grade(i):
+    return NS(id=f'g{i}', subject=subject(i), date=DATE, comment='Contrôle', is_bonus=False, is_optionnal=False, is_out_of_20=True,
+        grade='14,5', out_of='20', coefficient='2', average='11,25', max='19', min='3,5')
+
+def punishment(i):
+    return NS(id=f'p{i}', schedulable=True, schedule=[NS(id=f'sc{i}', start=DATE, duration=60)], given=DATE, giver='M. Martin',
+        exclusion=False, during_lesson=True, homework='Recopier le règlement', homework_documents=[file(i)], reasons=['Bavardages'],
+        circumstances='En classe', circumstance_documents=[], nature='Retenue', duration=60)
+
+# ancienne mise en forme, telle qu'elle était écrite dans chaque endpoint
+def legacy_lesson(lesson):
+    files = []
+    for f in lesson.content.files:
+        files.append({"id": f.id, "name": f.name, "url": f.url, "type": f.type})
+    return {
+        "id": lesson.id, "num": lesson.num,
+        "subject": {"id": lesson.subject.id, "name": lesson.subject.name, "groups": lesson.subject.groups},
+        "teachers": lesson.teacher_names, "rooms": lesson.classrooms, "group_names": lesson.group_names, "memo": lesson.memo,
+        "content": {"title": lesson.content.title, "description": lesson.content.description, "category": lesson.content.category, "files": files},
+        "virtual": lesson.virtual_classrooms,
+        "start": lesson.start.strftime("%Y-%m-%d %H:%M"), "end": lesson.end.strftime("%Y-%m-%d %H:%M"),
+        "background_color": lesson.background_color, "status": lesson.status, "is_cancelled": lesson.canceled,
+        "is_outing": lesson.outing, "is_detention": lesson.detention, "is_exempted": lesson.exempted, "is_test": lesson.test,
+    }
+
+def legacy_homework(homework):
+    files = []
+    for f in homework.files:
+        files.append({"id": f.id, "name": f.name, "url": f.url, "type": f.type})
+    local_id = ""
+    if len(homework.description) > 20:
+        local_id += homework.description[:20]
+    else:
+        local_id += homework.description
+    local_id += homework.subject.name[:2]
+    local_id += homework.date.strftime("%Y-%m-%d_%H:%M")
+    return {
+        "id": homework.id, "local_id": local_id,
+        "subject": {"id": homework.subject.id, "name": homework.subject.name, "groups": homework.subject.groups},
+        "description": homework.description, "background_color": homework.background_color, "done": homework.done,
+        "date": homework.date.strftime("%Y-%m-%d %H:%M"), "files": files,
+    }
+
+def legacy_grade(grade):
+    number, state = server.__transform_to_number, server.__get_grade_state
+    return {
+        "id": grade.id,
+        "subject": {"id": grade.subject.id, "name": grade.subject.name, "groups": grade.subject.groups},
+        "date": grade.date.strftime("%Y-%m-%d %H:%M"), "description": grade.comment,
+        "is_bonus": grade.is_bonus, "is_optional": grade.is_optionnal, "is_out_of_20": grade.is_out_of_20,
+        "grade": {
+            "value": number(state(grade.grade)), "out_of": number(grade.out_of), "coefficient": number(grade.coefficient),
+            "average": number(state(grade.average)), "max": number(state(grade.max)), "min": number(state(grade.min)),
+            "significant": state(grade.grade, True),
+        },
+    }
+
+def legacy_punishment(punishment):
+    homeworkDocs = []
+    for f in punishment.homework_documents:
+        homeworkDocs.append({"id": f.id, "name": f.name, "url": f.url, "type": f.type})
+    circumstanceDocs = []
+    for f in punishment.circumstance_documents:
+        circumstanceDocs.append({"id": f.id, "name": f.name, "url": f.url, "type": f.type})
+    schedules = []
+    for schedule in punishment.schedule:
+        schedules.append({"id": schedule.id, "start": schedule.start.strftime("%Y-%m-%d %H:%M"), "duration": schedule.duration})
+    return {
+        "id": punishment.id, "schedulable": punishment.schedulable, "schedule": schedules,
+        "date": punishment.given.strftime("%Y-%m-%d %H:%M"), "given_by": punishment.giver, "exclusion": punishment.exclusion,
+        "during_lesson": punishment.during_lesson,
+        "homework": {"text": punishment.homework, "documents": homeworkDocs},
+        "reason": {"text": punishment.reasons, "circumstances": punishment.circumstances, "documents": circumstanceDocs},
+        "nature": punishment.nature, "duration": punishment.duration,
+    }
+
+legacy_dumps = lambda obj: json.dumps(obj, separators=(",", ":")).encode()
+
+CASES = [
+    ('Lesson', lesson, legacy_lesson, server.serialize_lesson),
+    ('Homework', homework, legacy_homework, server.serialize_homework),
+    ('Grade', grade, legacy_grade, server.serialize_grade),
+    ('Punishment', punishment, legacy_punishment, server.serialize_punishment),
+]
+
+def per_item(func, objects):
+    runs = timeit.repeat(lambda: func(objects), number=5, repeat=5)
+    return min(runs) / 5 / len(objects) * 1e6
+
+print(f'Mise en forme de {COUNT} objets, encodeur : {server.JSON_ENCODER}')
+print(f'{"Objet":<12}{"avant (µs/objet)":>18}{"après (µs/objet)":>18}{"gain":>8}')
+for name, make, legacy, serializer in CASES:
+    objects = [make(i) for i in range(COUNT)]
+    assert json.loads(legacy_dumps([legacy(o) for o in objects])) == json.loads(server.json_dumps([serializer(o) for o in objects]))
+    before = per_item(lambda objs: legacy_dumps([legacy(o) for o in objs]), objects)
+    after = per_item(lambda objs: server.json_dumps([serializer(o) for o in objs]), objects)
+    print(f'{name:<12}{before:>18.2f}{after:>18.2f}{before / after:>7.1f}x')
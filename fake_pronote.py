@@ -0,0 +1,302 @@
+"""Faux client pronotepy pour les benchmarks, sans réseau ni identifiants.
+
+Les données sont déterministes (générées à partir du nom d'utilisateur) et ont des volumes réalistes :
+des centaines de notes, une année d'absences, de longues discussions...
+Chaque appel qui ferait une requête à Pronote attend FAKE_PRONOTE_LATENCY secondes (0.05 par défaut).
+
+Utilisation : fake_pronote.install(pronotepy) remplace pronotepy.Client et pronotepy.ParentClient.
+"""
+
+import datetime, hashlib, os, random, time
+
+LATENCY = float(os.environ.get('FAKE_PRONOTE_LATENCY', 0.05))
+
+SUBJECTS = ['Mathématiques', 'Français', 'Histoire-Géographie', 'Anglais LV1', 'Espagnol LV2', 'Physique-Chimie',
+    'SVT', 'Technologie', 'Arts plastiques', 'Éducation musicale', 'EPS', 'Enseignement moral et civique']
+TEACHERS = ['M. Martin', 'Mme Bernard', 'M. Dubois', 'Mme Thomas', 'M. Robert', 'Mme Richard', 'M. Petit', 'Mme Durand',
+    'M. Leroy', 'Mme Moreau', 'M. Simon', 'Mme Laurent']
+WORDS = ('le la les un une des devoir exercice chapitre leçon page cours classe contrôle évaluation sortie réunion parents '
+    'cantine projet rendre préparer lire relire apprendre réviser corriger manuel cahier fiche questions texte carte').split()
+
+def network(client):
+    # une requête à Pronote : comme pronotepy, le client avance son numéro de requête
+    client.communication.request_number += 2
+    time.sleep(LATENCY)
+
+def rng(*key) -> random.Random:
+    return random.Random(hashlib.sha256(repr(key).encode()).digest())
+
+def sentence(r: random.Random, words: int) -> str:
+    return ' '.join(r.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+def school_year() -> int:
+    today = datetime.date.today()
+    return today.year if today.month >= 8 else today.year - 1
+
+class Object:
+    """Objet pronotepy générique : ses attributs sont passés au constructeur."""
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+def subject(index: int) -> Object:
+    return Object(id=f'sub{index}', name=SUBJECTS[index], groups=index in (3, 4))
+
+def file(r: random.Random, prefix: str) -> Object:
+    number = r.randrange(10**6)
+    return Object(id=f'{prefix}f{number}', name=f'document{number}.pdf', url=f'https://fake.index-education.net/pronote/FichiersExternes/{number}', type=1)
+
+class Period:
+    def __init__(self, client, index: int, name: str, start: datetime.datetime, end: datetime.datetime):
+        self.client = client
+        self.id = f'per{index}'
+        self.name = name
+        self.start = start
+        self.end = end
+
+    def __dates(self, r: random.Random, count: int) -> list[datetime.datetime]:
+        span = (self.end - self.start).days
+        return sorted(self.start + datetime.timedelta(days=r.randrange(span), hours=r.randrange(8, 17)) for _ in range(count))
+
+    @property
+    def grades(self) -> list:
+        network(self.client)
+        r = rng(self.client.username, self.id, 'grades')
+        grades = []
+        for i, date in enumerate(self.__dates(r, 120)):
+            out_of = r.choice(('20', '20', '10', '5'))
+            grade = r.choice(('Absent', 'Dispense', 'NonRendu')) if r.random() < 0.03 else f'{r.uniform(0, float(out_of)):.2f}'.replace('.', ',')
+            grades.append(Object(id=f'{self.id}g{i}', subject=subject(r.randrange(12)), date=date, comment=sentence(r, 4),
+                is_bonus=False, is_optionnal=r.random() < 0.05, is_out_of_20=out_of == '20', grade=grade, out_of=out_of,
+                coefficient=r.choice(('1', '1', '2', '0,5')), average=f'{r.uniform(8, 14):.2f}'.replace('.', ','),
+                max=out_of, min=f'{r.uniform(0, 4):.2f}'.replace('.', ',')))
+        return grades
+
+    @property
+    def averages(self) -> list:
+        network(self.client)
+        r = rng(self.client.username, self.id, 'averages')
+        return [Object(subject=subject(i), student=f'{r.uniform(6, 19):.2f}'.replace('.', ','), class_average=f'{r.uniform(9, 13):.2f}'.replace('.', ','),
+            max=f'{r.uniform(16, 20):.2f}'.replace('.', ','), min=f'{r.uniform(1, 6):.2f}'.replace('.', ','), out_of='20', background_color=None)
+            for i in range(12)]
+
+    @property
+    def overall_average(self) -> str:
+        return f'{rng(self.client.username, self.id).uniform(8, 17):.2f}'.replace('.', ',')
+
+    @property
+    def class_overall_average(self) -> str:
+        return '11,42'
+
+    @property
+    def absences(self) -> list:
+        network(self.client)
+        r = rng(self.client.username, self.id, 'absences')
+        return [Object(id=f'{self.id}a{i}', from_date=date, to_date=date + datetime.timedelta(hours=r.choice((1, 2, 4))), justified=r.random() < 0.8,
+            hours=f'{r.choice((1, 2, 4))}h00', reasons=[r.choice(('Maladie', 'Rendez-vous médical', 'Raison familiale'))])
+            for i, date in enumerate(self.__dates(r, 40))]
+
+    @property
+    def delays(self) -> list:
+        network(self.client)
+        r = rng(self.client.username, self.id, 'delays')
+        return [Object(id=f'{self.id}d{i}', date=date, minutes=r.choice((5, 10, 15)), justified=r.random() < 0.5,
+            justification=sentence(r, 3), reasons=['Transport']) for i, date in enumerate(self.__dates(r, 15))]
+
+    @property
+    def punishments(self) -> list:
+        network(self.client)
+        r = rng(self.client.username, self.id, 'punishments')
+        return [Object(id=f'{self.id}p{i}', schedulable=True, schedule=[Object(id=f'{self.id}ps{i}', start=date + datetime.timedelta(days=7), duration=60)],
+            given=date, giver=r.choice(TEACHERS), exclusion=False, during_lesson=True, homework=sentence(r, 8), homework_documents=[file(r, self.id)],
+            reasons=[r.choice(('Bavardages', 'Travail non fait', 'Oubli de matériel'))], circumstances=sentence(r, 12), circumstance_documents=[],
+            nature='Retenue', duration=60) for i, date in enumerate(self.__dates(r, 4))]
+
+    @property
+    def evaluations(self) -> list:
+        network(self.client)
+        r = rng(self.client.username, self.id, 'evaluations')
+        return [Object(id=f'{self.id}e{i}', subject=subject(r.randrange(12)), name=sentence(r, 3), description=sentence(r, 10), teacher=r.choice(TEACHERS),
+            date=date, paliers=[], coefficient='1', acquisitions=[Object(id=f'{self.id}e{i}q{j}', name=sentence(r, 6), coefficient='1',
+                abbreviation=r.choice(('A+', 'A', 'C', 'E')), domain=sentence(r, 4), level=r.choice(('Très bonne maîtrise', 'Maîtrise satisfaisante', 'Maîtrise fragile')))
+                for j in range(4)]) for i, date in enumerate(self.__dates(r, 40))]
+
+class Homework(Object):
+    def set_done(self, status: bool):
+        network(self.client)
+        self.done = status
+
+class Information(Object):
+    def mark_as_read(self, status: bool):
+        network(self.client)
+        self.read = status
+
+class Discussion(Object):
+    """Comme dans pronotepy, chaque lecture de messages est une requête, date est lue dans le premier message (puis gardée)
+    et mark_as ne met pas unread à jour."""
+
+    @property
+    def messages(self) -> list:
+        network(self.client)
+        return list(self._messages)
+
+    @property
+    def date(self) -> datetime.datetime:
+        if '_date' not in self.__dict__:
+            self._date = self.messages[0].date
+        return self._date
+
+    def participants(self) -> list[str]:
+        network(self.client)
+        return [self.creator, self.client.info.name]
+
+    def mark_as(self, read: bool):
+        network(self.client)
+
+    def reply(self, content: str):
+        network(self.client)
+
+    def delete(self):
+        # la discussion reste dans la liste pour que /discussion/delete puisse être mesuré plusieurs fois
+        network(self.client)
+
+class Client:
+    """Faux pronotepy.Client : le constructeur attend la latence d'une connexion (4 requêtes)."""
+
+    def __init__(self, pronote_url: str, username: str = '', password: str = '', ent=None, **kwargs):
+        self.communication = Object(request_number=1)
+        for _ in range(4):
+            network(self)
+        self.pronote_url = pronote_url
+        self.username = username
+        self.password = password
+        self.logged_in = True
+
+        year = school_year()
+        self.periods = [
+            Period(self, 0, 'Trimestre 1', datetime.datetime(year, 9, 1), datetime.datetime(year, 11, 30)),
+            Period(self, 1, 'Trimestre 2', datetime.datetime(year, 12, 1), datetime.datetime(year + 1, 3, 15)),
+            Period(self, 2, 'Trimestre 3', datetime.datetime(year + 1, 3, 16), datetime.datetime(year + 1, 7, 5)),
+        ]
+        now = datetime.datetime.now()
+        self.current_period = next((period for period in self.periods if period.start <= now <= period.end), self.periods[0])
+        self.info = Object(name=f'Élève {username}', class_name='3e B', establishment='Collège Fictif', phone='0600000000', email=f'{username}@example.com',
+            address=['1 rue de l\'École', '75000 Paris'], ine_number='000000000AA', profile_picture=None, delegue=[])
+
+        r = rng(username, 'news')
+        self.__news = [Information(client=self, id=f'n{i}', title=sentence(r, 5), creation_date=datetime.datetime(year, 9, 1) + datetime.timedelta(days=i * 5, hours=9),
+            category=r.choice(('Vie scolaire', 'Information', 'Sortie')), read=r.random() < 0.7, survey=r.random() < 0.1, anonymous_response=False,
+            author=r.choice(TEACHERS), content=sentence(r, 60), attachments=[file(r, 'n')] if r.random() < 0.3 else [], _raw_content='<p>' + sentence(r, 60) + '</p>')
+            for i in range(60)]
+
+        r = rng(username, 'discussions')
+        self.__discussions = []
+        for i in range(40):
+            date = datetime.datetime(year, 9, 2) + datetime.timedelta(days=i * 4, hours=r.randrange(8, 18), minutes=r.randrange(60))
+            creator = r.choice(TEACHERS)
+            messages = [Object(id=f'm{i}_{j}', content=sentence(r, r.randrange(20, 80)), author=r.choice((creator, self.info.name)),
+                date=date + datetime.timedelta(hours=j), seen=True) for j in range(r.randrange(10, 60))]
+            self.__discussions.append(Discussion(client=self, subject=sentence(r, 4), creator=creator, unread=int(r.random() < 0.2),
+                close=False, replyable=True, _messages=messages))
+
+        r = rng(username, 'recipients')
+        self.__recipients = [Object(id=f'r{i}', name=f'{r.choice(("M.", "Mme"))} {r.choice(WORDS).capitalize()}', type=r.choice(('teacher', 'personal')),
+            email=None, functions=[SUBJECTS[i % 12]], with_discussion=r.random() < 0.9) for i in range(150)]
+
+        self.__homework = {}
+
+    @classmethod
+    def qrcode_login(cls, qr_code: dict, pin: str, uuid: str):
+        return cls(qr_code['url'], qr_code['login'], 'qrcode-password')
+
+    @classmethod
+    def token_login(cls, pronote_url: str, username: str, password: str, uuid: str):
+        return cls(pronote_url, username, password)
+
+    def session_check(self) -> bool:
+        network(self)
+        return False
+
+    def lessons(self, date_from: datetime.date, date_to: datetime.date|None = None) -> list:
+        network(self)
+        # mêmes bornes que pronotepy.Client.lessons : une date (datetime compris) devient minuit, sans date_to on va jusqu'à la fin de date_from
+        if isinstance(date_from, datetime.date):
+            date_from = datetime.datetime.combine(date_from, datetime.datetime.min.time())
+        if isinstance(date_to, datetime.date):
+            date_to = datetime.datetime.combine(date_to, datetime.datetime.min.time())
+        if not date_to:
+            date_to = datetime.datetime.combine(date_from, datetime.datetime.max.time())
+
+        lessons = []
+        day = date_from.date()
+        while day <= date_to.date():
+            if day.weekday() < 5:
+                r = rng(self.username, 'lessons', day)
+                for slot in range(8):
+                    start = datetime.datetime.combine(day, datetime.time(8 + slot + (slot >= 4)))
+                    index = (day.weekday() * 3 + slot) % 12
+                    content = Object(title=sentence(r, 4), description=sentence(r, 25), category='Cours', files=[file(r, 'l')]) if r.random() < 0.4 else None
+                    lessons.append(Object(id=f'l{day.isoformat()}_{slot}', num=slot, subject=subject(index), teacher_names=[TEACHERS[index]],
+                        classrooms=[f'B{100 + index}'], group_names=[], memo=None, content=content, virtual_classrooms=[], start=start,
+                        end=start + datetime.timedelta(minutes=55), background_color='#2a9d8f', status='Cours annulé' if r.random() < 0.03 else None,
+                        canceled=False, outing=False, detention=False, exempted=False, test=r.random() < 0.05))
+            day += datetime.timedelta(days=1)
+        return [lesson for lesson in lessons if date_from <= lesson.start <= date_to]
+
+    def homework(self, date_from: datetime.date, date_to: datetime.date|None = None) -> list:
+        network(self)
+        date_to = date_to or date_from + datetime.timedelta(days=30)
+        homeworks = []
+        day = date_from
+        while day <= date_to:
+            if day.weekday() < 5:
+                if day not in self.__homework:
+                    r = rng(self.username, 'homework', day)
+                    self.__homework[day] = [Homework(client=self, id=f'h{day.isoformat()}_{i}', subject=subject(r.randrange(12)), description=sentence(r, r.randrange(5, 40)),
+                        background_color='#e76f51', done=False, date=day, files=[file(r, 'h')] if r.random() < 0.2 else []) for i in range(2)]
+                homeworks += self.__homework[day]
+            day += datetime.timedelta(days=1)
+        return homeworks
+
+    def information_and_surveys(self) -> list:
+        network(self)
+        return list(self.__news)
+
+    def discussions(self) -> list:
+        network(self)
+        return list(self.__discussions)
+
+    def get_recipients(self) -> list:
+        network(self)
+        return list(self.__recipients)
+
+    def new_discussion(self, subject: str, content: str, recipients: list):
+        network(self)
+
+    def menus(self, date_from: datetime.date, date_to: datetime.date|None = None) -> list:
+        network(self)
+        date_to = date_to or date_from
+        menus = []
+        day = date_from
+        while day <= date_to:
+            if day.weekday() < 5:
+                r = rng(self.pronote_url, 'menus', day)
+                food = lambda: [Object(name=sentence(r, 3), labels=[Object(id='bio', name='Bio', color='#3a7d44')] if r.random() < 0.3 else []) for _ in range(2)]
+                menus.append(Object(id=f'menu{day.isoformat()}', name='Déjeuner', date=day, is_lunch=True, is_dinner=False,
+                    first_meal=food(), main_meal=food(), side_meal=food(), other_meal=None, cheese=food(), dessert=food()))
+            day += datetime.timedelta(days=1)
+        return menus
+
+    def export_ical(self, timezone_shift: int = 0) -> str:
+        network(self)
+        return f'{self.pronote_url.rsplit("/", 1)[0]}/ical/Edt.ics?icalsecurise={hashlib.sha1(self.username.encode()).hexdigest()}'
+
+class ParentClient(Client):
+    @property
+    def children(self):
+        return Object(to_dict=lambda: [{'name': f'Enfant de {self.username}', 'class': '6e A'}])
+
+def install(pronotepy):
+    """Remplace les clients de pronotepy par les faux clients."""
+    pronotepy.Client = Client
+    pronotepy.ParentClient = ParentClient
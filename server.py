@@ -9,10 +9,33 @@ import json
 import socket
 import base64
 import pickle
+import redis.asyncio
+import redis.exceptions
+import asyncio
+import functools
+import contextlib
+import collections
+import argparse
+import random
+import bisect
+import threading
+import cProfile
+import pstats
+import io
+import os
+import sys
+import hashlib
+import gzip
+import hmac
+import types
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from sanic import Sanic
 from sanic.response import json as rjson
 from sanic.response import text
-from sanic.exceptions import ServerError, NotFound, BadRequest, Forbidden
+from sanic.response import raw
+from sanic.exceptions import SanicException, ServerError, NotFound, BadRequest, Forbidden, ServiceUnavailable
+from sanic.request import Request, RequestParameters
 
 
 import sentry_sdk
@@ -48,7 +71,123 @@ except Exception as e:
 	print("WARN: Couldn't init Sentry")
 	print(e)
 
-app = Sanic("PapillonRest")
+# métriques Prometheus
+# les métriques sont propres à chaque processus : avec plusieurs workers, /metrics répond pour le worker qui reçoit la requête
+METRICS_TOKEN = environ.get('METRICS_TOKEN', '') # le jeton demandé par /metrics dans l'en-tête Authorization: Bearer (vide : seul l'en-tête X-Papillon-Admin y donne accès)
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30) # les bornes (en sec) des histogrammes de durée
+
+def format_labels(labelnames: tuple, labels: tuple) -> str:
+	pairs = []
+	for name, value in zip(labelnames, labels):
+		value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+		pairs.append(f'{name}="{value}"')
+	return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def render_metric(name: str, type: str, help: str, labelnames: tuple, samples: dict) -> list[str]:
+	"""Met en forme une métrique au format texte de Prometheus.
+
+	Args:
+		name (str): le nom de la métrique.
+		type (str): 'counter' ou 'gauge'.
+		help (str): la description de la métrique.
+		labelnames (tuple): les noms des labels.
+		samples (dict): les valeurs, par tuple de valeurs des labels.
+
+	Returns:
+		list[str]: les lignes de la métrique.
+	"""
+	lines = [f'# HELP {name} {help}', f'# TYPE {name} {type}']
+	for labels, value in samples.items():
+		lines.append(f'{name}{format_labels(labelnames, labels)} {value}')
+	return lines
+
+class MetricCounter:
+	"""Compteur Prometheus, incrémenté depuis la boucle d'évènements."""
+
+	def __init__(self, name: str, help: str, labelnames: tuple = ()):
+		self.name = name
+		self.help = help
+		self.labelnames = labelnames
+		self.values = collections.Counter()
+
+	def inc(self, *labels, amount: float = 1):
+		self.values[labels] += amount
+
+	def render(self) -> list[str]:
+		return render_metric(self.name, 'counter', self.help, self.labelnames, self.values)
+
+class MetricHistogram:
+	"""Histogramme Prometheus, observable depuis n'importe quel thread (le pool pronotepy compris)."""
+
+	def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = METRICS_BUCKETS):
+		self.name = name
+		self.help = help
+		self.labelnames = labelnames
+		self.buckets = buckets
+		self.lock = threading.Lock()
+		self.values = {} # labels -> [nombre par intervalle..., nombre au-delà de la dernière borne, somme, nombre]
+
+	def observe(self, value: float, *labels):
+		with self.lock:
+			entry = self.values.get(labels)
+			if entry is None:
+				entry = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+			entry[bisect.bisect_left(self.buckets, value)] += 1
+			entry[-2] += value
+			entry[-1] += 1
+
+	def render(self) -> list[str]:
+		lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+		with self.lock:
+			values = {labels: list(entry) for labels, entry in self.values.items()}
+		for labels, entry in values.items():
+			cumulative = 0
+			for bound, count in zip(self.buckets + ('+Inf',), entry):
+				cumulative += count
+				lines.append(f'{self.name}_bucket{format_labels(self.labelnames + ("le",), labels + (bound,))} {cumulative}')
+			lines.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {entry[-2]}')
+			lines.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {entry[-1]}')
+		return lines
+
+REQUESTS = MetricCounter('papillon_requests_total', 'Requêtes HTTP traitées, par route, méthode et statut', ('route', 'method', 'status'))
+REQUEST_DURATION = MetricHistogram('papillon_request_duration_seconds', 'Durée de traitement des requêtes HTTP, par route', ('route',))
+UPSTREAM_DURATION = MetricHistogram('papillon_upstream_duration_seconds', 'Durée des appels exécutés dans le pool pronotepy (requêtes à Pronote et lecture de leurs objets), par fonction', ('function',))
+SERIALIZATION_DURATION = MetricHistogram('papillon_serialization_duration_seconds', 'Durée de l\'encodage JSON des réponses')
+LOGINS = MetricCounter('papillon_logins_total', 'Connexions à Pronote, par méthode, ENT et résultat', ('method', 'ent', 'result'))
+LOGIN_DURATION = MetricHistogram('papillon_login_duration_seconds', 'Durée des connexions à Pronote, par méthode et ENT', ('method', 'ent'))
+
+# encodeur JSON des réponses
+# JSON_ENCODER choisit la bibliothèque utilisée : 'orjson' (bien plus rapide, si elle est installée) ou 'json' (bibliothèque standard)
+JSON_ENCODER = environ.get('JSON_ENCODER', 'orjson')
+
+if JSON_ENCODER == 'orjson':
+	try:
+		import orjson
+	except ImportError:
+		print("WARN: orjson isn't installed, falling back to json")
+		JSON_ENCODER = 'json'
+
+if JSON_ENCODER == 'orjson':
+	def json_dumps(obj, **kwargs) -> bytes:
+		return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+elif JSON_ENCODER == 'json':
+	def json_dumps(obj, **kwargs) -> bytes:
+		return json.dumps(obj, separators=(",", ":"), **kwargs).encode()
+else:
+	raise ValueError(f"JSON_ENCODER inconnu : {JSON_ENCODER} (valeurs possibles : orjson, json)")
+
+def timed_json_dumps(obj, **kwargs):
+	start = time.perf_counter()
+	try:
+		return json_dumps(obj, **kwargs)
+	finally:
+		duration = time.perf_counter() - start
+		SERIALIZATION_DURATION.observe(duration)
+		profile = current_profile()
+		if profile is not None:
+			profile.serialization += duration
+
+app = Sanic("PapillonRest", dumps=timed_json_dumps)
 
 app.config.REQUEST_TIMEOUT = 5
 app.config.RESPONSE_TIMEOUT = 5
@@ -58,39 +197,795 @@ app.update_config({
 	'RESPONSE_TIMEOUT': 5,
 })
 
+@app.middleware('request')
+async def start_timer(request):
+	request.ctx.started = time.perf_counter()
+
+# les middlewares de réponse sont exécutés dans l'ordre inverse de leur déclaration : celui-ci voit le statut final (304 compris)
+@app.middleware('response')
+async def record_metrics(request, response):
+	route = request.route.uri if request.route is not None else 'unknown'
+	REQUESTS.inc(route, request.method, response.status)
+	if hasattr(request.ctx, 'started'):
+		REQUEST_DURATION.observe(time.perf_counter() - request.ctx.started, route)
+
+# compression des réponses
+# les réponses d'au moins COMPRESSION_MIN_SIZE octets sont compressées en brotli (si le module brotli est installé) ou en gzip, selon l'en-tête Accept-Encoding.
+# La compression est faite dans la boucle d'évènements : COMPRESSION_CPU_BUDGET limite le temps CPU qui peut y être passé, au-delà les réponses partent sans compression.
+# Déclaré avant ETag, ce middleware est exécuté après lui : l'ETag est calculé sur le corps non compressé, et il est faible pour toutes les réponses qui peuvent être compressées (voir ETag).
+COMPRESSION_MIN_SIZE = int(environ.get('COMPRESSION_MIN_SIZE', 1024)) # la taille minimale en octets des réponses compressées (0 pour désactiver la compression)
+COMPRESSION_CPU_BUDGET = float(environ.get('COMPRESSION_CPU_BUDGET', 0.25)) # le temps CPU maximal (en sec par sec) passé à compresser les réponses, par processus
+GZIP_LEVEL = 6 # le niveau de gzip des réponses compressées à la volée
+BROTLI_QUALITY = 4 # la qualité de brotli des réponses compressées à la volée (les StaticPayload sont compressés une seule fois avec la qualité maximale)
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+COMPRESSED = MetricCounter('papillon_compressed_responses_total', 'Réponses compressées, par encodage (budget : laissées sans compression faute de budget CPU)', ('encoding',))
+
+def accepted_encoding(accept_encoding: str) -> str|None:
+	"""Choisit l'encodage d'une réponse d'après l'en-tête Accept-Encoding : 'br', 'gzip' ou None (pas de compression).
+
+	À qualité (q) égale, brotli est préféré à gzip.
+	"""
+	accepted = {}
+	for item in accept_encoding.lower().split(','):
+		coding, _, params = item.partition(';')
+		q = 1.0
+		for param in params.split(';'):
+			name, _, value = param.strip().partition('=')
+			if name == 'q':
+				try:
+					q = float(value)
+				except ValueError:
+					q = 0.0
+		accepted[coding.strip()] = q
+
+	codings = ('br', 'gzip') if brotli is not None else ('gzip',)
+	best = max(codings, key=lambda coding: accepted.get(coding, accepted.get('*', 0)))
+	return best if accepted.get(best, accepted.get('*', 0)) > 0 else None
+
+def compressible(response) -> bool:
+	"""Indique si une réponse est (ou peut être, selon Accept-Encoding et le budget CPU) envoyée compressée."""
+	if 'content-encoding' in response.headers:
+		return True
+	return bool(COMPRESSION_MIN_SIZE) and len(response.body or b'') >= COMPRESSION_MIN_SIZE and (response.content_type or '').startswith(COMPRESSIBLE_TYPES)
+
+def compress(body: bytes, coding: str, static: bool = False) -> bytes:
+	"""Compresse un corps de réponse avec l'encodage donné ('br' ou 'gzip'), avec la qualité maximale si static."""
+	if coding == 'br':
+		return brotli.compress(body, quality=11 if static else BROTLI_QUALITY)
+	return gzip.compress(body, compresslevel=9 if static else GZIP_LEVEL, mtime=0)
+
+class CompressionBudget:
+	"""Budget de temps CPU de la compression : rate sec de compression par sec, avec au plus une seconde d'avance.
+
+	Args:
+		rate (float): le temps de compression autorisé par seconde.
+	"""
+
+	def __init__(self, rate: float):
+		self.rate = rate
+		self.available = rate
+		self.updated = time.monotonic()
+
+	def allows(self) -> bool:
+		now = time.monotonic()
+		self.available = min(self.rate, self.available + (now - self.updated) * self.rate)
+		self.updated = now
+		return self.available > 0
+
+	def spend(self, duration: float):
+		self.available -= duration
+
+class StaticPayload:
+	"""Corps JSON identique pour tous les clients, encodé et compressé une seule fois pour chaque encodage.
+
+	Args:
+		obj: les données de la réponse.
+	"""
+
+	def __init__(self, obj):
+		self.body = json_dumps(obj)
+		self.etag = response_etag(self.body)
+		self.encoded = {coding: compress(self.body, coding, static=True) for coding in (('br', 'gzip') if brotli is not None else ('gzip',))}
+
+	def response(self, request):
+		coding = accepted_encoding(request.headers.get('accept-encoding', ''))
+		if coding is None or not COMPRESSION_MIN_SIZE or len(self.body) < COMPRESSION_MIN_SIZE:
+			return raw(self.body, content_type='application/json', headers={'ETag': self.etag, 'Vary': 'Accept-Encoding'})
+		return raw(self.encoded[coding], content_type='application/json', headers={'ETag': self.etag, 'Vary': 'Accept-Encoding', 'Content-Encoding': coding})
+
+@app.before_server_start
+async def attach_compression_budget(app, loop):
+	app.ctx.compression_budget = CompressionBudget(COMPRESSION_CPU_BUDGET)
+
+@app.middleware('response')
+async def Compress(request, response):
+	body = response.body
+	if 'content-encoding' in response.headers or not compressible(response):
+		return
+
+	response.headers['Vary'] = 'Accept-Encoding'
+	coding = accepted_encoding(request.headers.get('accept-encoding', ''))
+	if coding is None:
+		return
+	budget = app.ctx.compression_budget
+	if not budget.allows():
+		COMPRESSED.inc('budget')
+		return
+
+	start = time.thread_time()
+	response.body = compress(body, coding)
+	budget.spend(time.thread_time() - start)
+	response.headers['Content-Encoding'] = coding
+	COMPRESSED.inc(coding)
+
 @app.middleware('response')
 async def CORS(request, response):
 	response.headers['Access-Control-Allow-Origin'] = '*'
 	response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-	response.headers['Access-Control-Allow-Headers'] = 'Authorization,Keep-Alive,User-Agent,If-Modified-Since,Cache-Control,Content-Type'
-	response.headers['Access-Control-Expose-Headers'] = 'Authorization,Keep-Alive,User-Agent,If-Modified-Since,Cache-Control,Content-Type'
+	response.headers['Access-Control-Allow-Headers'] = 'Authorization,Keep-Alive,User-Agent,If-Modified-Since,If-None-Match,Cache-Control,Content-Type,Accept-Encoding'
+	response.headers['Access-Control-Expose-Headers'] = 'Authorization,Keep-Alive,User-Agent,If-Modified-Since,Cache-Control,Content-Type,ETag'
 	if request.method == 'OPTIONS':
 		response.headers['Access-Control-Max-Age'] = 1728000
 		response.headers['Content-Type'] = 'text/plain charset=UTF-8'
 		response.headers['Content-Length'] = 0
 		response.status = 204
 
+# validation des réponses par ETag
+# les réponses des GET portent un ETag calculé sur leur contenu : un client qui renvoie cet ETag dans If-None-Match reçoit un 304 sans corps si la réponse n'a pas changé
+# L'ETag des réponses qui peuvent être compressées est toujours faible (W/"...") : il ne dépend ni de l'encodage choisi ni du budget de compression,
+# et le 304 porte le même ETag que la réponse complète.
+ENTITY_HEADERS = ('content-encoding', 'content-type', 'content-length', 'content-language', 'content-range') # les en-têtes qui décrivent un corps, retirés des 304
+def response_etag(body: bytes) -> str:
+	"""Retourne l'ETag (fort) d'un corps de réponse : un hash BLAKE2b de 128 bits, identique d'un processus à l'autre."""
+	return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+	"""Indique si un ETag fait partie de l'en-tête If-None-Match (comparaison faible : le préfixe W/ est ignoré)."""
+	if if_none_match.strip() == '*':
+		return True
+	etag = etag.removeprefix('W/')
+	return any(candidate.strip().removeprefix('W/') == etag for candidate in if_none_match.split(','))
+
+@app.middleware('response')
+async def ETag(request, response):
+	if request.method not in ('GET', 'HEAD') or response.status != 200 or not response.body:
+		return
+
+	etag = (response.headers.get('etag') or response_etag(response.body)).removeprefix('W/')
+	if compressible(response):
+		etag = 'W/' + etag
+	response.headers['ETag'] = etag
+	if etag_matches(etag, request.headers.get('if-none-match', '')):
+		response.status = 304
+		response.body = b''
+		for header in ENTITY_HEADERS:
+			response.headers.pop(header, None)
+
+# profilage des requêtes
+# Avec PROFILE_SECRET, une requête envoyée avec les en-têtes X-Papillon-Admin: <PROFILE_SECRET> et X-Papillon-Profile: 1 est profilée avec cProfile
+# (boucle d'évènements et threads du pool pronotepy). Avec PROFILE_SLOW_THRESHOLD, les piles des threads du pool sont échantillonnées
+# pendant chaque requête, et le profil des requêtes plus longues que le seuil est enregistré.
+# Les rapports sont gardés dans PROFILE_DIR (les PROFILE_MAX_FILES plus récents) et lisibles sur /profiles avec l'en-tête X-Papillon-Admin.
+PROFILE_SECRET = environ.get('PROFILE_SECRET', '') # le secret des en-têtes d'administration (vide pour désactiver le profilage à la demande et /profiles)
+PROFILE_SLOW_THRESHOLD = float(environ.get('PROFILE_SLOW_THRESHOLD', 0)) # la durée en sec au-delà de laquelle le profil d'une requête est enregistré (0 pour désactiver)
+PROFILE_SAMPLE_INTERVAL = float(environ.get('PROFILE_SAMPLE_INTERVAL', 0.01)) # le temps en sec entre deux échantillons des piles
+PROFILE_DIR = environ.get('PROFILE_DIR', 'profiles') # le dossier des rapports
+PROFILE_MAX_FILES = int(environ.get('PROFILE_MAX_FILES', 200)) # le nombre de rapports gardés, les plus anciens sont supprimés
+PROFILE_MAX_DURATION = 60 # le temps en sec après lequel le profilage d'une requête qui n'a pas répondu (client déconnecté...) est arrêté
+PROFILE_MAX_DEPTH = 64 # le nombre maximal d'appels gardés par pile échantillonnée
+
+class RequestProfile:
+	"""Mesures d'une requête profilée : temps passé dans le pool pronotepy et dans l'encodage JSON, profils cProfile et piles échantillonnées.
+
+	Args:
+		profiler (cProfile.Profile|None): le profileur de la boucle d'évènements pour un profilage demandé, None pour le seul échantillonnage.
+	"""
+
+	def __init__(self, profiler: cProfile.Profile|None = None):
+		self.profiler = profiler
+		self.thread_profilers = []
+		self.upstream = collections.Counter() # fonction -> durée totale en sec
+		self.serialization = 0.0
+		self.lock = threading.Lock()
+		self.samples = collections.Counter() # pile "module:fonction;module:fonction..." -> nombre d'échantillons
+
+	def start_thread(self) -> cProfile.Profile|None:
+		"""Rattache le thread du pool en cours à la requête (appelé au début d'un appel à pronotepy)."""
+		app.ctx.profiled_threads[threading.get_ident()] = self
+		if self.profiler is None:
+			return None
+		profiler = cProfile.Profile()
+		try:
+			profiler.enable()
+		except ValueError:
+			# depuis Python 3.12, le profileur de la boucle observe déjà tous les threads
+			return None
+		return profiler
+
+	def stop_thread(self, profiler: cProfile.Profile|None, name: str, duration: float):
+		app.ctx.profiled_threads.pop(threading.get_ident(), None)
+		if profiler is not None:
+			profiler.disable()
+			self.thread_profilers.append(profiler)
+		with self.lock:
+			self.upstream[name] += duration
+
+	def add_sample(self, frame):
+		stack = []
+		while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+			stack.append(f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}')
+			frame = frame.f_back
+		with self.lock:
+			self.samples[';'.join(reversed(stack))] += 1
+
+	def report(self, request, status: int, duration: float) -> str:
+		"""Met en forme le rapport de la requête (texte, piles au format "folded" lisible par flamegraph.pl ou speedscope)."""
+		args = [(key, value) for key, value in request.query_args if key != 'token']
+		lines = [
+			f'{request.method} {request.path}' + ('?' + urllib.parse.urlencode(args) if args else ''),
+			f'statut : {status}',
+			f'durée : {duration * 1000:.1f} ms',
+			f'encodage JSON : {self.serialization * 1000:.1f} ms',
+			'appels au pool pronotepy :',
+		]
+		with self.lock:
+			upstream = self.upstream.most_common()
+			samples = self.samples.most_common()
+		lines += [f'\t{name} : {total * 1000:.1f} ms' for name, total in upstream] or ['\taucun']
+
+		if self.profiler is not None:
+			stream = io.StringIO()
+			try:
+				stats = pstats.Stats(self.profiler, stream=stream)
+				for profiler in self.thread_profilers:
+					stats.add(profiler)
+				stats.sort_stats('cumulative').print_stats(80)
+			except TypeError:
+				# aucun appel enregistré
+				pass
+			lines += ['', 'cProfile (boucle d\'évènements et pool pronotepy) :', stream.getvalue()]
+
+		if samples:
+			lines += ['', f'piles du pool pronotepy échantillonnées toutes les {PROFILE_SAMPLE_INTERVAL * 1000:g} ms :']
+			lines += [f'{stack} {count}' for stack, count in samples]
+
+		return '\n'.join(lines) + '\n'
+
+def current_profile() -> RequestProfile|None:
+	"""Retourne les mesures de la requête en cours, si elle est profilée."""
+	if not PROFILE_SECRET and not PROFILE_SLOW_THRESHOLD:
+		return None
+	try:
+		return getattr(Request.get_current().ctx, 'profile', None)
+	except SanicException:
+		# hors d'une requête (maintien des sessions...)
+		return None
+
+def is_admin(request) -> bool:
+	return bool(PROFILE_SECRET) and hmac.compare_digest(request.headers.get('x-papillon-admin', '').encode(), PROFILE_SECRET.encode())
+
+def sample_stacks(threads: dict, stop: threading.Event):
+	# thread d'échantillonnage : relève la pile de chaque thread du pool rattaché à une requête
+	while not stop.wait(PROFILE_SAMPLE_INTERVAL):
+		frames = sys._current_frames()
+		for thread, profile in list(threads.items()):
+			frame = frames.get(thread)
+			if frame is not None:
+				profile.add_sample(frame)
+
+def write_profile(name: str, report: str):
+	"""Enregistre un rapport dans PROFILE_DIR et supprime les plus anciens au-delà de PROFILE_MAX_FILES. (appelé hors de la boucle d'évènements)"""
+	os.makedirs(PROFILE_DIR, exist_ok=True)
+	with open(os.path.join(PROFILE_DIR, name + '.txt'), 'w', encoding='utf8') as f:
+		f.write(report)
+
+	reports = sorted(file for file in os.listdir(PROFILE_DIR) if file.endswith('.txt'))
+	for file in reports[:-PROFILE_MAX_FILES]:
+		with contextlib.suppress(FileNotFoundError):
+			os.remove(os.path.join(PROFILE_DIR, file))
+
+@app.before_server_start
+async def attach_profiler(app, loop):
+	app.ctx.profiled_threads = {} # id du thread -> RequestProfile
+	app.ctx.profiling = None # la requête profilée avec cProfile dans la boucle d'évènements
+	app.ctx.profile_sampler_stop = threading.Event()
+	if PROFILE_SLOW_THRESHOLD:
+		threading.Thread(target=sample_stacks, args=(app.ctx.profiled_threads, app.ctx.profile_sampler_stop), name='profile-sampler', daemon=True).start()
+
+@app.after_server_stop
+async def detach_profiler(app, loop):
+	app.ctx.profile_sampler_stop.set()
+
+def __stop_loop_profiler(profile: RequestProfile):
+	if app.ctx.profiling is profile:
+		profile.profiler.disable()
+		app.ctx.profiling = None
+
+@app.middleware('request')
+async def start_profile(request):
+	if 'x-papillon-profile' in request.headers and is_admin(request):
+		if app.ctx.profiling is None:
+			# un seul profileur peut observer la boucle d'évènements à la fois
+			request.ctx.profile = app.ctx.profiling = RequestProfile(cProfile.Profile())
+			asyncio.get_running_loop().call_later(PROFILE_MAX_DURATION, __stop_loop_profiler, request.ctx.profile)
+			request.ctx.profile.profiler.enable()
+		else:
+			request.ctx.profile_busy = True
+	elif PROFILE_SLOW_THRESHOLD:
+		request.ctx.profile = RequestProfile()
+
+@app.middleware('response')
+async def finish_profile(request, response):
+	if getattr(request.ctx, 'profile_busy', False):
+		response.headers['X-Papillon-Profile'] = 'busy'
+	profile = getattr(request.ctx, 'profile', None)
+	if profile is None:
+		return
+
+	duration = time.perf_counter() - request.ctx.started
+	if profile.profiler is not None:
+		__stop_loop_profiler(profile)
+		kind = 'manual'
+	elif duration >= PROFILE_SLOW_THRESHOLD:
+		kind = 'slow'
+	else:
+		return
+
+	name = f'{datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")}-{secrets.token_hex(4)}-{kind}'
+	try:
+		await asyncio.get_running_loop().run_in_executor(None, write_profile, name, profile.report(request, response.status, duration))
+	except OSError as e:
+		print(f"WARN: Couldn't write profile {name}: {e}")
+		return
+	if kind == 'manual':
+		response.headers['X-Papillon-Profile'] = name
+
+# pool d'exécution des appels à pronotepy
+# pronotepy est bloquant : les appels sont exécutés dans un pool de threads borné pour qu'une instance Pronote lente ne bloque pas la boucle d'évènements
+UPSTREAM_POOL_SIZE = int(environ.get('UPSTREAM_POOL_SIZE', 32)) # le nombre de threads exécutant les appels à pronotepy
+UPSTREAM_QUEUE_DEPTH = int(environ.get('UPSTREAM_QUEUE_DEPTH', 256)) # le nombre d'appels pouvant attendre un thread libre avant que les requêtes ne soient refusées
+UPSTREAM_WAIT_TIMEOUT = float(environ.get('UPSTREAM_WAIT_TIMEOUT', 15)) # le temps en sec qu'une requête attend au maximum le résultat d'un appel (file d'attente comprise)
+UPSTREAM_LOGIN_TIMEOUT = float(environ.get('UPSTREAM_LOGIN_TIMEOUT', 30)) # pareil pour une connexion, plus longue (plusieurs allers-retours, parfois avec l'ENT)
+
+# la boucle n'est plus bloquée pendant les appels : le délai de Sanic doit laisser aux appels le temps d'aboutir
+app.config.RESPONSE_TIMEOUT = float(environ.get('RESPONSE_TIMEOUT', max(UPSTREAM_WAIT_TIMEOUT, UPSTREAM_LOGIN_TIMEOUT) + 10))
+
+@app.before_server_start
+async def attach_upstream_pool(app, loop):
+	app.ctx.upstream_pool = ThreadPoolExecutor(max_workers=UPSTREAM_POOL_SIZE, thread_name_prefix='pronotepy')
+	app.ctx.upstream_pending = 0
+
+@app.after_server_stop
+async def detach_upstream_pool(app, loop):
+	app.ctx.upstream_pool.shutdown(wait=False, cancel_futures=True)
+
+def submit_upstream(func, *args, **kwargs) -> asyncio.Future:
+	"""Soumet un appel bloquant à pronotepy au pool de threads, sans attendre son résultat.
+
+	Args:
+		func (callable): la fonction à exécuter (méthode de pronotepy ou fonction de mise en forme qui lit des attributs paresseux).
+		*args, **kwargs: les arguments passés à la fonction.
+
+	Returns:
+		asyncio.Future: le résultat à venir de la fonction.
+
+	Raises:
+		ServiceUnavailable: si la file d'attente du pool est pleine.
+	"""
+	if app.ctx.upstream_pending >= UPSTREAM_POOL_SIZE + UPSTREAM_QUEUE_DEPTH:
+		raise ServiceUnavailable("Le serveur est surchargé, réessayez plus tard.")
+
+	def release(future):
+		app.ctx.upstream_pending -= 1
+		# l'exception d'un appel abandonné après le délai d'attente est récupérée ici pour ne pas être signalée par asyncio
+		if not future.cancelled():
+			future.exception()
+
+	name = getattr(func, '__name__', type(func).__name__).strip('_')
+	profile = current_profile()
+
+	def timed():
+		start = time.perf_counter()
+		profiler = profile.start_thread() if profile is not None else None
+		try:
+			return func(*args, **kwargs)
+		finally:
+			duration = time.perf_counter() - start
+			UPSTREAM_DURATION.observe(duration, name)
+			if profile is not None:
+				profile.stop_thread(profiler, name, duration)
+
+	app.ctx.upstream_pending += 1
+	future = asyncio.get_running_loop().run_in_executor(app.ctx.upstream_pool, timed)
+	future.add_done_callback(release)
+	return future
+
+async def wait_upstream(future: asyncio.Future, timeout: float|None = None):
+	"""Attend au plus timeout (UPSTREAM_WAIT_TIMEOUT par défaut) le résultat d'un appel soumis au pool.
+
+	Le thread ne peut pas être interrompu : après le délai, l'appel continue en arrière-plan et garde sa place dans la file jusqu'à sa fin.
+
+	Raises:
+		ServiceUnavailable: si le résultat n'est pas arrivé à temps.
+	"""
+	try:
+		return await asyncio.wait_for(asyncio.shield(future), UPSTREAM_WAIT_TIMEOUT if timeout is None else timeout)
+	except asyncio.TimeoutError:
+		raise ServiceUnavailable("Pronote met trop de temps à répondre, réessayez plus tard.")
+
+async def run_upstream(func, *args, **kwargs):
+	"""Exécute un appel bloquant à pronotepy dans le pool de threads et attend son résultat.
+
+	Args:
+		func (callable): la fonction à exécuter.
+		*args, **kwargs: les arguments passés à la fonction.
+
+	Returns:
+		le résultat de la fonction.
+
+	Raises:
+		ServiceUnavailable: si la file d'attente du pool est pleine ou si l'appel dépasse UPSTREAM_WAIT_TIMEOUT.
+	"""
+	return await wait_upstream(submit_upstream(func, *args, **kwargs))
+
+# limitation par instance Pronote
+# chaque hôte Pronote (ex: 0000000a.index-education.net) n'a qu'un nombre limité d'appels en cours,
+# les suivants attendent leur tour dans une file FIFO : à la rentrée, les connexions d'un même établissement n'écroulent ni Pronote ni les autres établissements
+UPSTREAM_HOST_CONCURRENCY = int(environ.get('UPSTREAM_HOST_CONCURRENCY', 8)) # le nombre d'appels simultanés par hôte Pronote (0 pour ne pas limiter)
+UPSTREAM_HOST_QUEUE_DEPTH = int(environ.get('UPSTREAM_HOST_QUEUE_DEPTH', 512)) # le nombre d'appels pouvant attendre leur tour pour un même hôte avant que les requêtes ne soient refusées
+
+class HostLimiter:
+	"""Limite le nombre d'appels simultanés par hôte, avec une file d'attente FIFO.
+
+	Args:
+		limit (int): le nombre d'appels simultanés par hôte (0 pour ne pas limiter).
+		queue_depth (int): le nombre d'appels pouvant attendre leur tour par hôte.
+	"""
+
+	def __init__(self, limit: int, queue_depth: int):
+		self.limit = limit
+		self.queue_depth = queue_depth
+		self.active = collections.Counter()
+		self.queues = {} # hôte -> collections.deque de asyncio.Future, une par appel en attente
+		self.admitted = collections.Counter()
+		self.rejected = collections.Counter()
+		self.wait_total = collections.Counter()
+		self.wait_max = {}
+
+	async def acquire(self, host: str, timeout: float):
+		"""Attend une place pour un appel à l'hôte, à rendre avec release.
+
+		Raises:
+			ServiceUnavailable: si la file de l'hôte est pleine ou si la place n'est pas obtenue avant timeout.
+		"""
+		start = time.monotonic()
+		queue = self.queues.setdefault(host, collections.deque())
+		if not self.limit or (self.active[host] < self.limit and not queue):
+			self.active[host] += 1
+			self.__admit(host, 0)
+			return
+
+		if len(queue) >= self.queue_depth:
+			self.rejected[host] += 1
+			raise ServiceUnavailable("Trop de requêtes vers ce serveur Pronote, réessayez plus tard.")
+
+		turn = asyncio.get_running_loop().create_future()
+		queue.append(turn)
+		try:
+			await asyncio.wait([turn], timeout=timeout)
+		except BaseException:
+			# requête annulée : la place est rendue si elle venait d'être obtenue
+			if turn.done():
+				self.release(host)
+			else:
+				queue.remove(turn)
+				turn.cancel()
+			raise
+		if not turn.done():
+			queue.remove(turn)
+			turn.cancel()
+			self.rejected[host] += 1
+			raise ServiceUnavailable("Trop de requêtes vers ce serveur Pronote, réessayez plus tard.")
+		self.__admit(host, time.monotonic() - start)
+
+	def busy(self, host: str) -> bool:
+		"""Retourne True si des appels à l'hôte attendent déjà leur tour."""
+		return bool(self.queues.get(host))
+
+	def release(self, host: str):
+		queue = self.queues.get(host)
+		while queue:
+			turn = queue.popleft()
+			if not turn.done():
+				# la place passe directement au premier appel en attente
+				turn.set_result(None)
+				return
+
+		self.active[host] -= 1
+		if self.active[host] <= 0:
+			del self.active[host]
+			self.queues.pop(host, None)
+
+	def __admit(self, host: str, wait: float):
+		self.admitted[host] += 1
+		self.wait_total[host] += wait
+		self.wait_max[host] = max(self.wait_max.get(host, 0), wait)
+
+	def stats(self) -> dict:
+		return {
+			host: {
+				'active': self.active.get(host, 0),
+				'queued': len(self.queues.get(host, ())),
+				'admitted': self.admitted[host],
+				'rejected': self.rejected[host],
+				'wait_avg': self.wait_total[host] / self.admitted[host] if self.admitted[host] else 0,
+				'wait_max': self.wait_max.get(host, 0),
+			}
+			for host in self.admitted.keys() | self.rejected.keys()
+		}
+
+@app.before_server_start
+async def attach_host_limiter(app, loop):
+	app.ctx.host_limiter = HostLimiter(UPSTREAM_HOST_CONCURRENCY, UPSTREAM_HOST_QUEUE_DEPTH)
+
+def upstream_host(url: str) -> str:
+	"""Retourne l'hôte d'une URL Pronote, clé de la limitation par instance."""
+	return (urllib.parse.urlparse(url).hostname or '').lower()
+
+async def submit_host_upstream(host: str, func, *args, timeout: float|None = None, **kwargs) -> asyncio.Future:
+	"""Attend une place pour l'hôte Pronote (au plus timeout, UPSTREAM_WAIT_TIMEOUT par défaut), puis soumet l'appel au pool comme submit_upstream.
+
+	La place est gardée jusqu'à la fin de l'appel, même si la requête a abandonné entre-temps.
+
+	Args:
+		host (str): l'hôte Pronote appelé (voir upstream_host).
+		func (callable): la fonction à exécuter.
+		*args, **kwargs: les arguments passés à la fonction.
+		timeout (float|None): le temps d'attente maximal d'une place.
+
+	Returns:
+		asyncio.Future: le résultat à venir de la fonction.
+
+	Raises:
+		ServiceUnavailable: si la file de l'hôte ou celle du pool est pleine, ou si la place n'est pas obtenue à temps.
+	"""
+	limiter = app.ctx.host_limiter
+	await limiter.acquire(host, UPSTREAM_WAIT_TIMEOUT if timeout is None else timeout)
+	try:
+		future = submit_upstream(func, *args, **kwargs)
+	except BaseException:
+		limiter.release(host)
+		raise
+	future.add_done_callback(lambda future: limiter.release(host))
+	return future
+
 # système de tokens
+# SESSION_BACKEND choisit où sont conservées les sessions :
+# 'memory' -> uniquement dans le processus, elles sont perdues au redémarrage
+# 'redis' -> le client pronotepy est sérialisé dans Redis, les jetons survivent aux redémarrages et sont partagés entre processus
+SESSION_BACKEND = environ.get('SESSION_BACKEND', 'memory')
+REDIS_URL = environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+KEEP_ALIVE_INTERVAL = float(environ.get('KEEP_ALIVE_INTERVAL', 0)) # le temps en sec sans appel à Pronote après lequel une session active est maintenue par une requête légère (0 pour désactiver)
+KEEP_ALIVE_WINDOW = float(environ.get('KEEP_ALIVE_WINDOW', 1800)) # avec KEEP_ALIVE_INTERVAL, le temps en sec pendant lequel une session inutilisée reste valide et maintenue
+KEEP_ALIVE_RATE = float(environ.get('KEEP_ALIVE_RATE', 5)) # le nombre maximal de requêtes de maintien par seconde et par processus
+
+client_timeout_threshold = max(300, KEEP_ALIVE_WINDOW) if KEEP_ALIVE_INTERVAL else 300 # le temps en sec avant qu'un jeton ne soit rendu invalide
+MAX_SESSIONS = int(environ.get('MAX_SESSIONS', 10000)) # le nombre maximal de clients gardés en mémoire par processus (0 pour ne pas limiter)
+LOGIN_REUSE_TTL = 24 * 3600 # le temps en sec pendant lequel une connexion peut être réutilisée par les mêmes identifiants (tant que sa session est active)
+LOGIN_HASH_ITERATIONS = 100000 # le nombre d'itérations de PBKDF2 pour le hash des mots de passe gardé par reuse_login
+LOGIN_HASH_POOL_SIZE = 2 # le nombre de threads qui calculent les hash PBKDF2, à part du pool pronotepy pour qu'un afflux de connexions ne retarde pas les appels à Pronote
+SESSION_SWEEP_INTERVAL = float(environ.get('SESSION_SWEEP_INTERVAL', 30)) # le temps en sec entre deux passages du nettoyage des sessions expirées
+
+class MemorySessionStore:
+	"""Stockage des sessions dans le processus : saved_clients est la seule copie, rien n'est persisté."""
+
+	def __init__(self):
+		self.logins = collections.OrderedDict()
+
+	async def load(self, token: str) -> dict|None:
+		return None
+
+	async def save(self, token: str, client_dict: dict):
+		pass
+
+	async def touch(self, token: str):
+		pass
+
+	async def delete(self, token: str):
+		pass
+
+	async def alias(self, token: str, target: str):
+		pass
+
+	def lock(self, token: str):
+		return contextlib.nullcontext()
+
+	async def sync(self, token: str, client_dict: dict):
+		pass
+
+	async def cache_generation(self, token: str) -> int:
+		# un seul processus : l'invalidation locale du cache des réponses suffit
+		return 0
+
+	async def invalidate_cache(self, token: str):
+		pass
+
+	async def get_login(self, login_key: str) -> dict|None:
+		login = self.logins.get(login_key)
+		if login is None or login['expire_at'] <= time.time():
+			return None
+		return login
+
+	async def set_login(self, login_key: str, login: dict):
+		self.logins.pop(login_key, None)
+		self.logins[login_key] = dict(login, expire_at=time.time() + LOGIN_REUSE_TTL)
+		while MAX_SESSIONS and len(self.logins) > MAX_SESSIONS:
+			self.logins.popitem(last=False)
+
+	async def close(self):
+		pass
+
+
+class RedisSessionStore:
+	"""Stockage des sessions dans Redis.
+
+	Le client pronotepy est stocké sous forme de pickle avec une durée de vie de client_timeout_threshold, prolongée à chaque interaction (touch).
+	Les réécritures du client gardent cette durée de vie : le maintien des sessions (keep_sessions_alive) ne prolonge pas le jeton.
+	saved_clients sert de cache local des clients déjà désérialisés : Redis n'est relu que pour un jeton inconnu du processus,
+	ou quand un autre processus a modifié le client depuis (numéro de version différent).
+
+	Plusieurs processus peuvent servir le même jeton : chaque appel à Pronote est fait sous un verrou Redis,
+	puis le client est réécrit dans Redis si son état a changé (voir client_state).
+	Après une modification, le compteur cache_generation de la session est incrémenté pour que tous les processus vident leur cache des réponses.
+
+	Args:
+		redis_client (redis.asyncio.Redis): la connexion à Redis (un fakeredis.FakeAsyncRedis convient aussi).
+		prefix (str): le préfixe des clés Redis.
+	"""
+
+	def __init__(self, redis_client, prefix: str = 'papillon:session:'):
+		self.redis = redis_client
+		self.prefix = prefix
+
+	async def load(self, token: str) -> dict|None:
+		session = await self.redis.hgetall(self.prefix + token)
+		if not session:
+			return None
+		if b'alias' in session:
+			# le jeton désigne la session d'une connexion précédente
+			target = session[b'alias'].decode()
+			client_dict = await self.load(target)
+			if client_dict is not None:
+				client_dict['token'] = target
+			return client_dict
+		return {
+			'client': await run_upstream(pickle.loads, session[b'client']),
+			# la durée de vie dans Redis n'a pas expiré, la dernière interaction est donc assez récente
+			'last_interaction': time.time(),
+			'version': int(session[b'version'])
+		}
+
+	async def save(self, token: str, client_dict: dict):
+		client_pickle = await run_upstream(pickle.dumps, client_dict['client'])
+		key = self.prefix + token
+		async with self.redis.pipeline(transaction=True) as pipe:
+			pipe.hset(key, 'client', client_pickle)
+			pipe.hincrby(key, 'version', 1)
+			pipe.ttl(key)
+			_, version, ttl = await pipe.execute()
+		if ttl < 0:
+			# nouvelle clé (ou clé expirée entre-temps dans Redis) : la durée de vie part de la dernière interaction, pas de l'écriture
+			await self.redis.expireat(key, int(client_dict['last_interaction'] + client_timeout_threshold) + 1)
+		client_dict['version'] = version
+
+	async def touch(self, token: str):
+		await self.redis.expire(self.prefix + token, client_timeout_threshold)
+
+	async def delete(self, token: str):
+		await self.redis.delete(self.prefix + token)
+
+	async def alias(self, token: str, target: str):
+		key = self.prefix + token
+		async with self.redis.pipeline(transaction=True) as pipe:
+			pipe.hset(key, 'alias', target)
+			pipe.expire(key, client_timeout_threshold)
+			await pipe.execute()
+
+	def lock(self, token: str):
+		# le verrou expire de lui-même si le processus qui le détient meurt pendant un appel
+		return self.redis.lock(self.prefix + token + ':lock', timeout=60, sleep=0.01, blocking_timeout=UPSTREAM_WAIT_TIMEOUT)
+
+	async def sync(self, token: str, client_dict: dict):
+		version = await self.redis.hget(self.prefix + token, 'version')
+		if version is not None and int(version) != client_dict.get('version'):
+			fresh = await self.load(token)
+			if fresh is not None:
+				client_dict['client'] = fresh['client']
+				client_dict['version'] = fresh['version']
+
+	async def cache_generation(self, token: str) -> int:
+		generation = await self.redis.hget(self.prefix + token, 'cache_generation')
+		return int(generation) if generation is not None else 0
+
+	async def invalidate_cache(self, token: str):
+		# chaque processus a son propre cache des réponses : il le vide en voyant le compteur changer (voir sync_response_cache)
+		await self.redis.hincrby(self.prefix + token, 'cache_generation', 1)
+
+	async def get_login(self, login_key: str) -> dict|None:
+		login = await self.redis.hgetall(self.prefix + 'login:' + login_key)
+		if not login:
+			return None
+		return {key.decode(): value for key, value in login.items()}
+
+	async def set_login(self, login_key: str, login: dict):
+		# ':' n'apparaît jamais dans un jeton, les clés ne peuvent pas se confondre avec celles des sessions
+		key = self.prefix + 'login:' + login_key
+		async with self.redis.pipeline(transaction=True) as pipe:
+			pipe.delete(key)
+			pipe.hset(key, mapping=login)
+			pipe.expire(key, LOGIN_REUSE_TTL)
+			await pipe.execute()
+
+	async def close(self):
+		await self.redis.aclose()
+
+
 @app.before_server_start
 async def attach_saved_clients(app, loop):
-    app.ctx.saved_clients = {}
+	app.ctx.saved_clients = collections.OrderedDict()
+	if SESSION_BACKEND == 'memory':
+		app.ctx.session_store = MemorySessionStore()
+	elif SESSION_BACKEND == 'redis':
+		app.ctx.session_store = RedisSessionStore(redis.asyncio.from_url(REDIS_URL))
+	else:
+		raise ValueError(f"SESSION_BACKEND inconnu : {SESSION_BACKEND} (valeurs possibles : memory, redis)")
+
+@app.after_server_start
+async def start_session_sweeper(app, loop):
+	app.ctx.session_sweeper = asyncio.ensure_future(sweep_sessions(app))
+
+@app.after_server_start
+async def start_keep_alive(app, loop):
+	app.ctx.keep_alive_stats = collections.Counter()
+	app.ctx.keep_alive = asyncio.ensure_future(keep_sessions_alive(app)) if KEEP_ALIVE_INTERVAL else None
+
+@app.after_server_stop
+async def detach_saved_clients(app, loop):
+	app.ctx.session_sweeper.cancel()
+	if app.ctx.keep_alive is not None:
+		app.ctx.keep_alive.cancel()
+	await app.ctx.session_store.close()
 
 """
-saved_clients ->
+saved_clients -> (OrderedDict, de la session utilisée le moins récemment à la plus récente, donc triée par last_interaction)
 	token ->
 		client -> instance de pronotepy.Client
 		last_interaction -> int (provenant de time.time(), entier représentant le temps depuis la dernière intéraction avec le client)
-"""
+		version -> int (uniquement avec Redis, numéro de la dernière version du client écrite dans Redis)
+		last_upstream -> float (provenant de time.time(), fin du dernier appel à Pronote de ce processus, utilisé par keep_sessions_alive)
+		token -> str (uniquement si la session a plusieurs jetons, jeton sous lequel la session est enregistrée)
+		tokens -> set[str] (uniquement si la session a plusieurs jetons, ses jetons gardés dans saved_clients)
+		lock -> asyncio.Lock (pris pendant chaque appel à pronotepy de la session)
 
+Les jetons d'une même session (connexion réutilisée, voir reuse_login) partagent le même dictionnaire.
+"""
 
-client_timeout_threshold = 300 # le temps en sec avant qu'un jeton ne soit rendu invalide
 
-def get_client(token) -> tuple[str, pronotepy.Client|None]:
+async def get_client(token) -> tuple[str, pronotepy.Client|None]:
 	"""Retourne le client Pronote associé au jeton.
 
+	Le client est d'abord cherché dans saved_clients, puis dans le stockage des sessions
+	(un client chargé depuis Redis est gardé dans saved_clients, un autre processus a pu prolonger la session).
+
 	Args:
 		token (str): le jeton à partir duquel retrouver le client.
-		instance (bool): si True, le client ne sera pas recherché sur les autres instances.
 
 	Returns:
 		tuple: le couple (statut, client?) associé au jeton
@@ -98,45 +993,1505 @@ def get_client(token) -> tuple[str, pronotepy.Client|None]:
 			pronotepy.Client|None: une instance de client si le token est valide, None sinon.
 
 	"""
-	print(len(app.ctx.saved_clients), 'valid tokens')
-
 	if MAINTENANCE['enable']:
 		return 'maintenance', None
-	if token in app.ctx.saved_clients:
-		client_dict = app.ctx.saved_clients[token]
-		if time.time() - client_dict['last_interaction'] < client_timeout_threshold:
-			client_dict['last_interaction'] = time.time()
-			return 'ok', client_dict['client']
-		else:
-			del app.ctx.saved_clients[token]
+	if token is None:
+		return 'notfound', None
+
+	client_dict = app.ctx.saved_clients.get(token)
+	if client_dict is None or time.time() - client_dict['last_interaction'] >= client_timeout_threshold:
+		stored = await app.ctx.session_store.load(token)
+		if stored is None:
+			if client_dict is None:
+				return 'notfound', None
+			await delete_client(token)
 			return 'expired', None
+		target = app.ctx.saved_clients.get(stored.get('token'))
+		if target is not None and time.time() - target['last_interaction'] < client_timeout_threshold:
+			# la session désignée par le jeton est déjà chargée : son client est partagé
+			stored = target
+		elif 'token' in stored:
+			app.ctx.saved_clients[stored['token']] = stored
+		client_dict = app.ctx.saved_clients[token] = stored
+		if 'token' in client_dict:
+			client_dict.setdefault('tokens', {client_dict['token']}).add(token)
+
+	client_dict['last_interaction'] = time.time()
+	# tous les jetons de la session passent en fin de liste : sweep_sessions s'arrête à la première session non expirée
+	for sessionToken in client_dict.get('tokens', (token,)):
+		if sessionToken in app.ctx.saved_clients:
+			app.ctx.saved_clients.move_to_end(sessionToken)
+	__evict_least_recent()
+	await app.ctx.session_store.touch(token)
+	if session_token(token) != token:
+		await app.ctx.session_store.touch(session_token(token))
+	return 'ok', client_dict['client']
+
+async def save_client(token, client):
+	"""Enregistre un nouveau client sous le jeton donné, dans saved_clients et dans le stockage des sessions.
+
+	Args:
+		token (str): le jeton de la session.
+		client (pronotepy.Client): le client à enregistrer.
+	"""
+	client_dict = app.ctx.saved_clients[token] = {
+		'client': client,
+		'last_interaction': time.time(),
+		'last_upstream': time.time()
+	}
+	__evict_least_recent()
+	await app.ctx.session_store.save(token, client_dict)
+
+async def alias_client(token, target):
+	"""Enregistre un nouveau jeton pour une session existante : les deux jetons utilisent le même client.
+
+	Args:
+		token (str): le nouveau jeton.
+		target (str): un jeton de la session (déjà vérifié par get_client).
+	"""
+	client_dict = app.ctx.saved_clients[target]
+	target = client_dict.setdefault('token', target)
+	client_dict.setdefault('tokens', {target}).add(token)
+	app.ctx.saved_clients[token] = client_dict
+	__evict_least_recent()
+	await app.ctx.session_store.alias(token, target)
+
+def session_token(token) -> str:
+	"""Retourne le jeton sous lequel la session est enregistrée (le jeton lui-même, sauf pour une connexion réutilisée).
+
+	Args:
+		token (str): un jeton de la session.
+	"""
+	client_dict = app.ctx.saved_clients.get(token)
+	return client_dict.get('token', token) if client_dict is not None else token
+
+async def delete_client(token):
+	"""Supprime la session associée au jeton.
+
+	Args:
+		token (str): le jeton de la session à supprimer.
+	"""
+	forget_client(token)
+	await app.ctx.session_store.delete(token)
+
+def forget_client(token):
+	"""Retire la session de ce processus sans la supprimer du stockage des sessions.
+
+	Avec SESSION_BACKEND=memory la session est perdue, avec Redis elle sera rechargée à la prochaine requête.
+
+	Args:
+		token (str): le jeton de la session à retirer.
+	"""
+	client_dict = app.ctx.saved_clients.pop(token, None)
+	if client_dict is not None:
+		client_dict.get('tokens', set()).discard(token)
+	app.ctx.response_cache.invalidate(token)
+
+def __evict_least_recent():
+	# au-delà de MAX_SESSIONS, les sessions utilisées le moins récemment sont retirées en premier (début de l'OrderedDict)
+	while MAX_SESSIONS and len(app.ctx.saved_clients) > MAX_SESSIONS:
+		forget_client(next(iter(app.ctx.saved_clients)))
+
+async def sweep_sessions(app):
+	"""Retire régulièrement les sessions expirées de saved_clients.
+
+	saved_clients étant trié par dernière interaction, seules les sessions expirées en tête sont parcourues :
+	chaque passage coûte O(1) par session retirée, quel que soit le nombre de sessions actives.
+	Avec Redis, la session n'est retirée que de ce processus : sa durée de vie dans Redis est gérée par Redis.
+	"""
+	while True:
+		await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+		expire_before = time.time() - client_timeout_threshold
+		while app.ctx.saved_clients:
+			token, client_dict = next(iter(app.ctx.saved_clients.items()))
+			if client_dict['last_interaction'] > expire_before:
+				break
+			forget_client(token)
+
+# ordonnancement des appels par session
+# un pronotepy.Client n'est pas thread-safe : les appels d'un même jeton sont exécutés un par un,
+# et les appels identiques déjà en cours (même jeton, même fonction, mêmes paramètres) sont fusionnés en un seul aller-retour vers Pronote
+@app.before_server_start
+async def attach_session_scheduler(app, loop):
+	app.ctx.inflight_calls = {}
+
+"""
+inflight_calls ->
+	(token, func, args) -> asyncio.Task (appel en cours dont le résultat est partagé entre toutes les requêtes identiques)
+"""
+
+async def run_client_call(token, func, *args, mutating: bool = False):
+	"""Exécute un appel à pronotepy pour une session, après les appels déjà en cours de cette session.
+
+	Le délai UPSTREAM_WAIT_TIMEOUT compte aussi l'attente des appels précédents. S'il est dépassé, la requête répond 503
+	mais l'appel continue en arrière-plan : la session reste verrouillée tant que le thread utilise le client.
+
+	Args:
+		token (str): le jeton de la session.
+		func (callable): la fonction à exécuter dans le pool pronotepy, elle reçoit le client de la session en premier argument.
+		*args: les autres arguments de la fonction (ils doivent être hashables, ils font partie de la clé de fusion).
+		mutating (bool): True pour les appels qui modifient des données (changement d'état d'un devoir, réponse à une discussion...) :
+			ils ne sont jamais fusionnés avec une autre requête et vident le cache des réponses de la session.
+
+	Returns:
+		le résultat de la fonction.
+	"""
+	key = (session_token(token), func, args)
+	task = app.ctx.inflight_calls.get(key) if not mutating else None
+	if task is None:
+		task = asyncio.ensure_future(__run_locked(token, func, *args, mutating=mutating))
+		if not mutating:
+			app.ctx.inflight_calls[key] = task
+
+		def forget(task):
+			if app.ctx.inflight_calls.get(key) is task:
+				del app.ctx.inflight_calls[key]
+			if mutating:
+				# même en cas d'erreur, la modification a pu être faite côté Pronote
+				app.ctx.response_cache.invalidate(key[0])
+			# évite l'avertissement d'asyncio si toutes les requêtes en attente ont abandonné
+			if not task.cancelled():
+				task.exception()
+
+		task.add_done_callback(forget)
+
+	# une requête annulée (client déconnecté) ou trop longue ne doit pas annuler l'appel partagé avec les autres
+	return await wait_upstream(task)
+
+def client_state(client: pronotepy.Client) -> tuple|None:
+	"""Retourne une empreinte peu coûteuse de l'état du client, pour ne le réécrire dans le stockage des sessions que s'il a changé.
+
+	Chaque requête à Pronote avance le numéro de requête de pronotepy ; les attributs remplacés changent d'identité,
+	et les données de Papillon modifiées sur place (index des local_id, empreinte de /sync) sont signalées par mark_client_changed.
+
+	Returns:
+		tuple|None: l'empreinte, ou None si elle ne peut pas être calculée (le client est alors toujours réécrit).
+	"""
+	communication = getattr(client, 'communication', None)
+	if communication is None:
+		return None
+	return (communication.request_number, client.__dict__.get('papillon_changes', 0), tuple((name, id(value)) for name, value in client.__dict__.items()))
+
+def mark_client_changed(client: pronotepy.Client):
+	"""Signale une modification sur place des données gardées sur le client (voir client_state)."""
+	client.__dict__['papillon_changes'] = client.__dict__.get('papillon_changes', 0) + 1
+
+@contextlib.asynccontextmanager
+async def client_session(token):
+	"""Verrouille la session pour une suite d'appels à pronotepy et retourne son client.
+
+	Le verrou est pris dans ce processus puis dans le stockage des sessions ; à la sortie, le client est réenregistré s'il a changé.
+
+	Args:
+		token (str): le jeton de la session.
+
+	Raises:
+		ServiceUnavailable: si la session a expiré ou si un autre processus l'utilise trop longtemps.
+	"""
+	store = app.ctx.session_store
+	client_dict = app.ctx.saved_clients.get(token)
+	if client_dict is None:
+		raise ServiceUnavailable("La session a expiré pendant la requête.")
+
+	# le verrou est porté par la session : les jetons d'une connexion réutilisée partagent le même
+	async with client_dict.setdefault('lock', asyncio.Lock()):
+		if app.ctx.saved_clients.get(token) is not client_dict:
+			raise ServiceUnavailable("La session a expiré pendant la requête.")
+
+		target = client_dict.get('token', token)
+		try:
+			async with store.lock(target):
+				# un autre processus a pu utiliser ce client depuis notre dernier appel
+				await store.sync(target, client_dict)
+				state = client_state(client_dict['client'])
+				try:
+					yield client_dict['client']
+				finally:
+					client_dict['last_upstream'] = time.time()
+					# même en cas d'erreur, l'état de communication du client a pu changer
+					if state is None or client_state(client_dict['client']) != state:
+						await store.save(target, client_dict)
+		except redis.exceptions.LockError:
+			raise ServiceUnavailable("La session est occupée par une autre requête, réessayez plus tard.")
+
+async def __run_locked(token, func, *args, mutating: bool = False):
+	async with client_session(token) as client:
+		try:
+			future = await submit_host_upstream(upstream_host(client.pronote_url), func, client, *args)
+			return await future
+		finally:
+			if mutating:
+				# les caches des autres processus sont vidés avant que la session ne soit libérée
+				await app.ctx.session_store.invalidate_cache(session_token(token))
+
+# maintien des sessions
+# Pronote expire sa propre session après quelques minutes sans requête : la requête suivante doit alors se reconnecter (voire repasser par l'ENT).
+# Avec KEEP_ALIVE_INTERVAL, les sessions valides sans appel depuis KEEP_ALIVE_INTERVAL sont maintenues par une requête "Navigation" (session_check),
+# au plus KEEP_ALIVE_RATE par seconde, en commençant par celles qui attendent depuis le plus longtemps.
+def __keep_alive(client: pronotepy.Client) -> bool:
+	# session_check se reconnecte si la session Pronote avait déjà expiré, et le signale en retournant True
+	return client.session_check()
+
+async def keep_alive_session(token: str):
+	"""Maintient la session Pronote associée au jeton, sans prolonger le jeton lui-même."""
+	stats = app.ctx.keep_alive_stats
+	try:
+		expired = await run_client_call(token, __keep_alive)
+	except Exception as e:
+		stats['errors'] += 1
 	else:
-		return 'notfound', None
+		stats['refreshed' if expired else 'pings'] += 1
+
+async def keep_sessions_alive(app):
+	"""Envoie les requêtes de maintien des sessions, réparties dans le temps."""
+	limiter = app.ctx.host_limiter
+	while True:
+		await asyncio.sleep(1)
+		due_before = time.time() - KEEP_ALIVE_INTERVAL
+		expire_before = time.time() - client_timeout_threshold
+		due = {}
+		for token, client_dict in app.ctx.saved_clients.items():
+			# les jetons d'une même session partagent leur dictionnaire : une seule requête par session
+			if client_dict.get('last_upstream', client_dict['last_interaction']) <= due_before and client_dict['last_interaction'] > expire_before:
+				due.setdefault(id(client_dict), (token, client_dict))
+
+		budget = int(KEEP_ALIVE_RATE) + (random.random() < KEEP_ALIVE_RATE % 1)
+		for token, client_dict in sorted(due.values(), key=lambda item: item[1].get('last_upstream', item[1]['last_interaction']))[:budget]:
+			# la file d'un hôte déjà saturé est laissée aux vraies requêtes
+			if limiter.busy(upstream_host(client_dict['client'].pronote_url)):
+				continue
+			# un seul maintien en cours par session, même si la requête dure plus d'une seconde
+			client_dict['last_upstream'] = time.time()
+			asyncio.ensure_future(keep_alive_session(token))
+
+# cache des réponses par session
+# les réponses des endpoints de lecture sont gardées déjà sérialisées, par jeton, endpoint et paramètres
+RESPONSE_CACHE_TTL = {
+	# le temps en sec pendant lequel une réponse est resservie sans interroger Pronote
+	'user': 600,
+	'timetable': 600,
+	'grades': 120,
+	'evaluations': 120,
+	'absences': 300,
+	'delays': 300,
+	'punishments': 300,
+	'news': 120,
+	'recipients': 3600,
+	'homework': 300,
+}
+RESPONSE_CACHE_MAX_BYTES = int(environ.get('RESPONSE_CACHE_MAX_BYTES', 256 * 1024 * 1024)) # la taille maximale des réponses en cache par processus (0 pour désactiver le cache)
+
+class ResponseCache:
+	"""Cache des réponses JSON déjà sérialisées, par session.
+
+	Les entrées sont gardées dans l'ordre d'utilisation : au-delà de max_bytes, les moins récemment servies sont retirées en premier.
 
-@app.get('/')
-async def home(request):
-	return rjson({
+	Args:
+		max_bytes (int): la taille totale maximale des réponses en cache.
+	"""
+
+	def __init__(self, max_bytes: int):
+		self.max_bytes = max_bytes
+		self.size = 0
+		self.entries = collections.OrderedDict() # (token, endpoint, params) -> (expire_at, body)
+		self.keys_by_token = collections.defaultdict(set)
+		self.generations = collections.Counter()
+		self.shared_generations = {} # token -> dernier cache_generation lu dans le stockage des sessions
+		self.hits = collections.Counter()
+		self.misses = collections.Counter()
+		self.prefetched = set() # les clés des réponses préchargées pas encore servies
+
+	def get(self, token: str, endpoint: str, params: tuple) -> bytes|None:
+		key = (token, endpoint, params)
+		entry = self.entries.get(key)
+		if entry is not None and entry[0] > time.time():
+			self.entries.move_to_end(key)
+			self.hits[endpoint] += 1
+			if key in self.prefetched:
+				self.prefetched.discard(key)
+				PREFETCH_ENTRIES.inc(endpoint, 'hit')
+			return entry[1]
+
+		if entry is not None:
+			self.__remove(key)
+		self.misses[endpoint] += 1
+		return None
+
+	def contains(self, token: str, endpoint: str, params: tuple) -> bool:
+		"""Indique si une réponse encore valide est en cache, sans la compter comme servie."""
+		entry = self.entries.get((token, endpoint, params))
+		return entry is not None and entry[0] > time.time()
+
+	def generation(self, token: str) -> int:
+		"""Retourne le numéro d'invalidation de la session, à passer à put pour ne pas mettre en cache une réponse lue avant une modification."""
+		return self.generations[token]
+
+	def put(self, token: str, endpoint: str, params: tuple, body: bytes, generation: int, prefetched: bool = False):
+		ttl = RESPONSE_CACHE_TTL.get(endpoint, 0)
+		if not ttl or len(body) > self.max_bytes or generation != self.generations[token]:
+			return
+
+		key = (token, endpoint, params)
+		if key in self.entries:
+			self.__remove(key)
+		self.entries[key] = (time.time() + ttl, body)
+		self.keys_by_token[token].add(key)
+		self.size += len(body)
+		if prefetched:
+			self.prefetched.add(key)
+
+		while self.size > self.max_bytes:
+			self.__remove(next(iter(self.entries)))
+
+	def invalidate(self, token: str):
+		"""Retire toutes les réponses en cache de la session."""
+		self.generations[token] += 1
+		self.shared_generations.pop(token, None)
+		for key in self.keys_by_token.pop(token, ()):
+			self.size -= len(self.entries.pop(key)[1])
+			self.__forget_prefetched(key)
+
+	def sync(self, token: str, shared_generation: int):
+		"""Vide le cache de la session si un processus l'a modifiée depuis la dernière lecture de son compteur d'invalidation partagé."""
+		if self.shared_generations.get(token) != shared_generation:
+			if token in self.shared_generations or token in self.keys_by_token:
+				self.invalidate(token)
+			self.shared_generations[token] = shared_generation
+
+	def __remove(self, key):
+		self.size -= len(self.entries.pop(key)[1])
+		self.__forget_prefetched(key)
+		keys = self.keys_by_token[key[0]]
+		keys.discard(key)
+		if not keys:
+			del self.keys_by_token[key[0]]
+
+	def __forget_prefetched(self, key):
+		if key in self.prefetched:
+			self.prefetched.discard(key)
+			PREFETCH_ENTRIES.inc(key[1], 'unused')
+
+@app.before_server_start
+async def attach_response_cache(app, loop):
+	app.ctx.response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES)
+
+async def sync_response_cache(token: str):
+	"""Avant de lire le cache de la session, le vide si un autre processus a modifié la session entre-temps."""
+	cacheToken = session_token(token)
+	app.ctx.response_cache.sync(cacheToken, await app.ctx.session_store.cache_generation(cacheToken))
+
+async def cached_client_call(request, token, endpoint, func, *args):
+	"""Répond avec la réponse en cache de la session si elle est encore valide, sinon exécute l'appel et met sa réponse en cache.
+
+	L'en-tête Cache-Control: no-cache force un nouvel appel à Pronote (la nouvelle réponse remplace celle en cache).
+
+	Args:
+		request (sanic.Request): la requête en cours.
+		token (str): le jeton de la session.
+		endpoint (str): le nom de l'endpoint (clé de RESPONSE_CACHE_TTL).
+		func (callable): la fonction de mise en forme passée à run_client_call.
+		*args: les paramètres normalisés de la requête, ils font partie de la clé du cache.
+
+	Returns:
+		HTTPResponse: la réponse JSON.
+	"""
+	cache = app.ctx.response_cache
+	cacheToken = session_token(token)
+	await sync_response_cache(token)
+	if 'no-cache' not in request.headers.get('cache-control', ''):
+		await wait_prefetch(cacheToken, endpoint)
+		body = cache.get(cacheToken, endpoint, args)
+		if body is not None:
+			return raw(body, content_type='application/json')
+
+	return raw(await fetch_cached(token, endpoint, func, *args), content_type='application/json')
+
+async def fetch_cached(token, endpoint, func, *args, prefetched: bool = False) -> bytes:
+	"""Exécute l'appel et met sa réponse dans le cache de la session.
+
+	Returns:
+		bytes: la réponse JSON sérialisée.
+	"""
+	cache = app.ctx.response_cache
+	cacheToken = session_token(token)
+	generation = cache.generation(cacheToken)
+	body = rjson(await run_client_call(token, func, *args)).body
+	cache.put(cacheToken, endpoint, args, body, generation, prefetched)
+	return body
+
+async def days_body(request, token: str, endpoint: str, func, dateFrom: datetime.date, dateTo: datetime.date) -> bytes:
+	"""Assemble une liste entre deux dates à partir des journées en cache, en récupérant les journées manquantes en un seul appel à Pronote.
+
+	Chaque journée est gardée en cache séparément : une plage qui recoupe des journées déjà demandées ne récupère que les journées manquantes.
+
+	Args:
+		request (sanic.Request): la requête en cours (Cache-Control: no-cache ignore le cache, le paramètre fields fait partie de la clé).
+		token (str): le jeton de la session.
+		endpoint (str): le nom de l'endpoint (clé de RESPONSE_CACHE_TTL).
+		func (callable): la fonction passée à run_client_call avec (première journée, dernière journée, fields),
+			elle retourne les objets mis en forme de chaque journée (dict[datetime.date, list[dict]]), ou None si Pronote n'a pas pu les fournir.
+		dateFrom (datetime.date): la date de début.
+		dateTo (datetime.date): la date de fin (incluse).
+
+	Returns:
+		bytes: la liste JSON des objets de toute la plage.
+	"""
+	cache = app.ctx.response_cache
+	cacheToken = session_token(token)
+	fields = request_fields(request)
+	days = [dateFrom + datetime.timedelta(days=i) for i in range((dateTo - dateFrom).days + 1)]
+
+	dayBodies = {}
+	await sync_response_cache(token)
+	if 'no-cache' not in request.headers.get('cache-control', ''):
+		await wait_prefetch(cacheToken, endpoint)
+		for day in days:
+			body = cache.get(cacheToken, endpoint, (day, fields))
+			if body is not None:
+				dayBodies[day] = body
+
+	missing = [day for day in days if day not in dayBodies]
+	if missing:
+		fetched = await fetch_days(token, endpoint, func, missing, fields)
+		if fetched is None:
+			return b'[]'
+		dayBodies.update(fetched)
+
+	# chaque journée est une liste JSON : on retire ses crochets pour les concaténer en une seule liste
+	return b'[' + b','.join(dayBodies[day][1:-1] for day in days if dayBodies[day] != b'[]') + b']'
+
+async def fetch_days(token: str, endpoint: str, func, days: list[datetime.date], fields: str|None, prefetched: bool = False) -> dict[datetime.date, bytes]|None:
+	"""Récupère en un seul appel les journées données (de la première à la dernière) et met chacune d'elles dans le cache de la session.
+
+	Returns:
+		dict[datetime.date, bytes]|None: la liste JSON de chaque journée, ou None si Pronote n'a pas pu les fournir.
+	"""
+	cache = app.ctx.response_cache
+	cacheToken = session_token(token)
+	generation = cache.generation(cacheToken)
+	daysData = await run_client_call(token, func, days[0], days[-1], fields)
+	if daysData is None:
+		return None
+
+	dayBodies = {}
+	for day in days:
+		dayBodies[day] = rjson(daysData.get(day, [])).body
+		cache.put(cacheToken, endpoint, (day, fields), dayBodies[day], generation, prefetched)
+	return dayBodies
+
+# préchargement à la connexion
+# les premières requêtes après /generatetoken (emploi du temps, devoirs, notes) trouvent un cache vide. Pour les ENT de PREFETCH_ENTS,
+# les données demandées en premier par l'application sont téléchargées en arrière-plan juste après la connexion et placées dans le cache de la session.
+# Le préchargement passe après les vraies requêtes : chaque étape attend que la session, l'hôte Pronote et le pool soient libres,
+# et une requête qui arrive pendant l'étape de son endpoint attend son résultat au lieu de refaire l'appel.
+PREFETCH_ENTS = {ent.strip() for ent in environ.get('PREFETCH_ENTS', '').split(',') if ent.strip()} # les ENT dont les connexions sont préchargées ('none' : sans ENT, '*' : toutes, vide pour désactiver)
+PREFETCH_CONCURRENCY = int(environ.get('PREFETCH_CONCURRENCY', 4)) # le nombre de sessions préchargées en même temps par processus
+PREFETCH_MAX_PENDING = 1000 # au-delà de ce nombre de sessions en attente de préchargement, les nouvelles connexions ne sont pas préchargées
+PREFETCH_HOMEWORK_DAYS = 7 # les devoirs préchargés sont ceux d'aujourd'hui aux PREFETCH_HOMEWORK_DAYS jours suivants
+PREFETCH_IDLE_CHECK = 0.05 # le temps en sec entre deux vérifications que la session et l'hôte Pronote sont libres
+PREFETCH_MAX_WAIT = 30 # le temps en sec après lequel les étapes qui n'ont pas trouvé la session libre sont abandonnées
+
+PREFETCHES = MetricCounter('papillon_prefetch_steps_total', 'Étapes de préchargement à la connexion, par endpoint et résultat (ok, error, cached : déjà en cache, skipped : session jamais libre)', ('endpoint', 'result'))
+PREFETCH_ENTRIES = MetricCounter('papillon_prefetch_entries_total', 'Réponses préchargées retirées du suivi, par endpoint (hit : servie depuis le cache, unused : expirée ou remplacée sans avoir été servie)', ('endpoint', 'usage'))
+
+@app.before_server_start
+async def attach_prefetcher(app, loop):
+	app.ctx.prefetch_slots = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+	app.ctx.prefetch_tasks = set()
+	app.ctx.prefetching = {} # (jeton de la session, endpoint) -> asyncio.Future terminée à la fin de l'étape
+
+@app.after_server_stop
+async def detach_prefetcher(app, loop):
+	for task in app.ctx.prefetch_tasks:
+		task.cancel()
+
+def start_prefetch(token: str, ent: str):
+	"""Lance le préchargement d'une session qui vient de se connecter, si son ENT est dans PREFETCH_ENTS.
+
+	Args:
+		token (str): le jeton de la nouvelle session.
+		ent (str): le nom de l'ENT de la connexion ('none' sans ENT), comme dans les métriques des connexions.
+	"""
+	if '*' not in PREFETCH_ENTS and ent not in PREFETCH_ENTS:
+		return
+	if len(app.ctx.prefetch_tasks) >= PREFETCH_MAX_PENDING:
+		PREFETCHES.inc('all', 'skipped')
+		return
+
+	task = asyncio.ensure_future(prefetch_session(token))
+	app.ctx.prefetch_tasks.add(task)
+	task.add_done_callback(app.ctx.prefetch_tasks.discard)
+
+async def wait_prefetch(token: str, endpoint: str):
+	"""Attend (au plus UPSTREAM_WAIT_TIMEOUT) la fin de l'étape de préchargement en cours pour cet endpoint de la session, s'il y en a une."""
+	step = app.ctx.prefetching.get((token, endpoint))
+	if step is not None:
+		await asyncio.wait([step], timeout=UPSTREAM_WAIT_TIMEOUT)
+
+async def __wait_idle(token: str) -> bool:
+	# une étape ne commence que si aucune requête de la session n'est en cours et qu'aucun appel n'attend son tour pour l'hôte ou le pool
+	deadline = time.monotonic() + PREFETCH_MAX_WAIT
+	while True:
+		client_dict = app.ctx.saved_clients.get(token)
+		if client_dict is None:
+			return False
+		lock = client_dict.get('lock')
+		host = upstream_host(client_dict['client'].pronote_url)
+		if (lock is None or not lock.locked()) and not app.ctx.host_limiter.busy(host) and app.ctx.upstream_pending < UPSTREAM_POOL_SIZE:
+			return True
+		if time.monotonic() > deadline:
+			return False
+		await asyncio.sleep(PREFETCH_IDLE_CHECK)
+
+async def prefetch_session(token: str):
+	"""Précharge dans le cache de la session les cours du jour et de la semaine, les devoirs à venir, les notes de la période et les actualités (non lues comprises)."""
+	today = datetime.date.today()
+	monday = today - datetime.timedelta(days=today.weekday())
+	# (endpoint, fonction, journées) : sans journées, la réponse est mise en cache avec les mêmes paramètres qu'une requête sans fields,
+	# /grades et /news la trouveront (ou fusionneront avec l'appel en cours)
+	steps = [
+		('timetable', __get_timetable, [monday + datetime.timedelta(days=i) for i in range(7)]),
+		('homework', __get_homework_days, [today + datetime.timedelta(days=i) for i in range(PREFETCH_HOMEWORK_DAYS + 1)]),
+		('grades', __get_grades, None),
+		('news', __get_news, None),
+	]
+
+	cache = app.ctx.response_cache
+	async with app.ctx.prefetch_slots:
+		for endpoint, func, days in steps:
+			if not await __wait_idle(token):
+				PREFETCHES.inc(endpoint, 'skipped')
+				continue
+
+			# une vraie requête a pu remplir le cache entre-temps
+			await sync_response_cache(token)
+			cacheToken = session_token(token)
+			if days is not None:
+				days = [day for day in days if not cache.contains(cacheToken, endpoint, (day, None))]
+				cached = not days
+			else:
+				cached = cache.contains(cacheToken, endpoint, (None,))
+			if cached:
+				PREFETCHES.inc(endpoint, 'cached')
+				continue
+
+			key = (cacheToken, endpoint)
+			app.ctx.prefetching[key] = asyncio.get_running_loop().create_future()
+			try:
+				if days is not None:
+					await fetch_days(token, endpoint, func, days, None, prefetched=True)
+				else:
+					await fetch_cached(token, endpoint, func, None, prefetched=True)
+			except Exception as e:
+				PREFETCHES.inc(endpoint, 'error')
+			else:
+				PREFETCHES.inc(endpoint, 'ok')
+			finally:
+				app.ctx.prefetching.pop(key).set_result(None)
+
+# réponses en flux
+# avec l'en-tête Accept: application/x-ndjson, les longues listes (/discussions, /news, /absences) sont envoyées un objet par ligne au fur et à mesure :
+# la liste n'est ni construite ni encodée en entier, et le premier objet part dès qu'il est prêt
+STREAM_CHUNK_ITEMS = 32 # le nombre maximal d'objets mis en forme par appel au pool pronotepy
+STREAM_CHUNK_SECONDS = 0.05 # le temps en sec après lequel les objets déjà mis en forme sont envoyés sans attendre STREAM_CHUNK_ITEMS
+STREAM_MAX_CHUNKS = 8 # le nombre maximal de paquets mis en forme en attente d'envoi, au-delà la mise en forme attend que le client lise
+
+def wants_ndjson(request) -> bool:
+	# les sous-requêtes de /batch ne peuvent pas être envoyées en flux
+	return hasattr(request, 'respond') and 'application/x-ndjson' in request.headers.get('accept', '')
+
+def __next_chunk(items) -> tuple[list, bool]:
+	chunk = []
+	deadline = time.perf_counter() + STREAM_CHUNK_SECONDS
+	for item in items:
+		chunk.append(item)
+		if len(chunk) >= STREAM_CHUNK_ITEMS or time.perf_counter() >= deadline:
+			return chunk, False
+	return chunk, True
+
+async def __produce_chunks(token, func, args: tuple, chunks: asyncio.Queue):
+	# sous le verrou de la session, uniquement le temps des appels au pool : l'envoi au client se fait hors du verrou
+	try:
+		async with client_session(token) as client:
+			host = upstream_host(client.pronote_url)
+			items = func(client, *args)
+			deadline = time.monotonic() + UPSTREAM_WAIT_TIMEOUT
+			future = None
+			try:
+				done = False
+				while not done:
+					future = await submit_host_upstream(host, __next_chunk, items)
+					chunk, done = await wait_upstream(future, max(0, deadline - time.monotonic()))
+					if chunks.full():
+						# le client lit moins vite que Pronote ne répond : la mise en forme attend, dans la limite du même délai
+						try:
+							await asyncio.wait_for(chunks.put(chunk), max(0, deadline - time.monotonic()))
+						except asyncio.TimeoutError:
+							raise ServiceUnavailable("La réponse est lue trop lentement, réessayez plus tard.")
+					else:
+						chunks.put_nowait(chunk)
+			finally:
+				if future is not None and not future.done():
+					# délai dépassé ou requête annulée : le thread utilise encore le client, la session reste verrouillée jusqu'à la fin de l'appel
+					await asyncio.wait([future])
+				items.close()
+	except Exception as e:
+		# hors du verrou : la fin du flux peut attendre que le client lise
+		await chunks.put(e)
+	else:
+		await chunks.put(None)
+
+async def stream_client_call(request, token, func, *args):
+	"""Envoie en NDJSON les objets produits par un générateur, par paquets exécutés dans le pool pronotepy sous le verrou de la session.
+
+	Les paquets sont produits dans une tâche à part : le verrou est rendu dès que le dernier objet est mis en forme, même si le client lit lentement.
+	Au plus STREAM_MAX_CHUNKS paquets attendent d'être envoyés : au-delà, la mise en forme attend que le client lise.
+	Comme pour run_client_call, toute la liste doit être mise en forme (et lue, au-delà de STREAM_MAX_CHUNKS paquets) en moins de UPSTREAM_WAIT_TIMEOUT.
+	Une erreur avant le premier paquet donne une réponse d'erreur habituelle ; après, elle est envoyée comme dernière ligne : {"status": "error", "error": str}.
+
+	Args:
+		request (sanic.Request): la requête en cours.
+		token (str): le jeton de la session.
+		func (callable): la fonction génératrice, elle reçoit le client de la session en premier argument et produit les objets mis en forme.
+		*args: les autres arguments de la fonction.
+	"""
+	chunks = asyncio.Queue(STREAM_MAX_CHUNKS)
+	producer = asyncio.ensure_future(__produce_chunks(token, func, args, chunks))
+	response = None
+	try:
+		while True:
+			chunk = await chunks.get()
+			if isinstance(chunk, Exception):
+				if response is None:
+					raise chunk
+				await response.send(timed_json_dumps({"status": "error", "error": str(chunk)}) + b'\n')
+				break
+			if response is None:
+				response = await request.respond(content_type='application/x-ndjson')
+			if chunk is None:
+				break
+			if chunk:
+				await response.send(b''.join(timed_json_dumps(item) + b'\n' for item in chunk))
+	finally:
+		# client déconnecté : inutile de mettre en forme la suite
+		if not producer.done():
+			producer.cancel()
+
+	await response.eof()
+
+# cache partagé par établissement
+# certaines données (les menus...) sont les mêmes pour tous les élèves d'une instance Pronote :
+# elles sont gardées par URL Pronote et paramètres, et rafraîchies en arrière-plan avec la session d'un des élèves
+SHARED_CACHE_TTL = {
+	# le temps en sec pendant lequel une réponse est considérée à jour
+	'menus': 900,
+}
+SHARED_CACHE_MAX_AGE = int(environ.get('SHARED_CACHE_MAX_AGE', 6 * 3600)) # au-delà de son TTL et jusqu'à cet âge, une réponse est servie pendant son rafraîchissement en arrière-plan
+SHARED_CACHE_MAX_ENTRIES = int(environ.get('SHARED_CACHE_MAX_ENTRIES', 10000)) # le nombre maximal de réponses gardées par processus
+
+class SharedCache:
+	"""Cache des réponses JSON communes à tout un établissement.
+
+	Un seul appel à Pronote est fait par clé, même si des milliers de requêtes arrivent en même temps :
+	les suivantes attendent le même appel, puis les réponses trop anciennes sont resservies pendant qu'un seul rafraîchissement tourne en arrière-plan.
+
+	Args:
+		max_entries (int): le nombre maximal de réponses gardées, les moins récemment servies sont retirées en premier.
+	"""
+
+	def __init__(self, max_entries: int):
+		self.max_entries = max_entries
+		self.entries = collections.OrderedDict() # (pronote_url, endpoint, params) -> (fetched_at, body)
+		self.fetches = {} # (pronote_url, endpoint, params) -> asyncio.Task
+		self.hits = collections.Counter()
+		self.stale_hits = collections.Counter()
+		self.misses = collections.Counter()
+
+	async def get(self, pronote_url: str, endpoint: str, token: str, func, *args) -> bytes:
+		"""Retourne la réponse en cache, ou l'obtient avec la session donnée.
+
+		Args:
+			pronote_url (str): l'URL de l'instance Pronote.
+			endpoint (str): le nom de l'endpoint (clé de SHARED_CACHE_TTL).
+			token (str): le jeton de la session à utiliser si un appel à Pronote est nécessaire.
+			func (callable): la fonction de mise en forme passée à run_client_call.
+			*args: les paramètres normalisés de la requête, ils font partie de la clé du cache.
+
+		Returns:
+			bytes: la réponse JSON sérialisée.
+		"""
+		key = (pronote_url, endpoint, args)
+		entry = self.entries.get(key)
+		if entry is not None:
+			age = time.time() - entry[0]
+			if age < SHARED_CACHE_TTL[endpoint]:
+				self.entries.move_to_end(key)
+				self.hits[endpoint] += 1
+				return entry[1]
+			if age < SHARED_CACHE_MAX_AGE:
+				self.entries.move_to_end(key)
+				self.stale_hits[endpoint] += 1
+				self.__fetch(key, token, func, *args)
+				return entry[1]
+
+		self.misses[endpoint] += 1
+		# shield : une requête annulée ne doit pas annuler l'appel attendu par les autres
+		return await asyncio.shield(self.__fetch(key, token, func, *args))
+
+	def __fetch(self, key, token, func, *args) -> asyncio.Task:
+		task = self.fetches.get(key)
+		if task is None:
+			task = asyncio.ensure_future(self.__refresh(key, token, func, *args))
+			self.fetches[key] = task
+
+			def forget(task):
+				if self.fetches.get(key) is task:
+					del self.fetches[key]
+				if not task.cancelled() and task.exception() is not None:
+					print(f"Error while refreshing {key[1]} for {key[0]}: {task.exception()!r}")
+			task.add_done_callback(forget)
+		return task
+
+	async def __refresh(self, key, token, func, *args) -> bytes:
+		body = rjson(await run_client_call(token, func, *args)).body
+		self.entries[key] = (time.time(), body)
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.max_entries:
+			self.entries.popitem(last=False)
+		return body
+
+@app.before_server_start
+async def attach_shared_cache(app, loop):
+	app.ctx.shared_cache = SharedCache(SHARED_CACHE_MAX_ENTRIES)
+
+# index des identifiants locaux
+# les endpoints de modification reçoivent le local_id d'un devoir, d'une actualité ou d'une discussion :
+# les objets pronotepy vus par les endpoints de liste sont gardés sur le client, pour les retrouver sans retélécharger toute la liste
+LOCAL_ID_MAX_AGE = 600 # le temps en sec pendant lequel un objet indexé est réutilisé, au-delà la liste est retéléchargée
+LOCAL_ID_MAX_ENTRIES = 500 # le nombre maximal d'objets indexés par type et par session
+
+def __homework_local_id(homework) -> str:
+	# return a combination of the 20 first letters of description, 2 first letters of subject name and the date
+	return homework.description[:20] + homework.subject.name[:2] + homework.date.strftime("%Y-%m-%d_%H:%M")
+
+def __news_local_id(news) -> str:
+	local_id = ""
+
+	try :
+		local_id += news.title[:3]
+	except Exception as e:
+		local_id += ""
+
+	return local_id + news.creation_date.strftime("%Y-%m-%d_%H:%M")
+
+def __discussion_local_id(discussion) -> str:
+	try:
+		# return a combination of the 3 first letters of subject, 3 first letters of creator and the date
+		return discussion.subject[:3] + discussion.creator[:3] + discussion.date.strftime("%Y-%m-%d_%H:%M")
+	except Exception as e:
+		return discussion.date.strftime("%Y-%m-%d_%H:%M")
+
+def index_local_ids(client: pronotepy.Client, kind: str, objects: dict):
+	"""Enregistre des objets pronotepy par local_id sur le client.
+
+	L'index est un attribut du client : il suit le client dans le stockage des sessions, et disparaît avec lui.
+
+	Args:
+		client (pronotepy.Client): le client de la session.
+		kind (str): le type d'objet ('homework', 'news' ou 'discussion').
+		objects (dict): les objets à indexer, par local_id.
+	"""
+	index = client.__dict__.setdefault('papillon_local_ids', {}).setdefault(kind, {})
+	now = time.time()
+	for local_id, obj in objects.items():
+		index.pop(local_id, None)
+		index[local_id] = (now, obj)
+
+	while len(index) > LOCAL_ID_MAX_ENTRIES:
+		del index[next(iter(index))]
+	mark_client_changed(client)
+
+def find_local_id(client: pronotepy.Client, kind: str, local_id: str, refetch) -> object|None:
+	"""Retrouve un objet pronotepy par local_id.
+
+	Args:
+		client (pronotepy.Client): le client de la session.
+		kind (str): le type d'objet ('homework', 'news' ou 'discussion').
+		local_id (str): l'identifiant local de l'objet.
+		refetch (callable): appelée sans paramètre si l'objet n'est pas indexé (ou l'est depuis plus de LOCAL_ID_MAX_AGE),
+			elle doit retélécharger la liste et l'indexer avec index_local_ids.
+
+	Returns:
+		object|None: l'objet pronotepy, ou None s'il n'existe pas.
+	"""
+	entry = getattr(client, 'papillon_local_ids', {}).get(kind, {}).get(local_id)
+	if entry is not None and time.time() - entry[0] < LOCAL_ID_MAX_AGE:
+		return entry[1]
+
+	refetch()
+	entry = client.papillon_local_ids.get(kind, {}).get(local_id)
+	return entry[1] if entry is not None else None
+
+def forget_local_id(client: pronotepy.Client, kind: str, local_id: str):
+	getattr(client, 'papillon_local_ids', {}).get(kind, {}).pop(local_id, None)
+	mark_client_changed(client)
+
+def __index_homeworks(client: pronotepy.Client, homeworks: list):
+	index_local_ids(client, 'homework', {__homework_local_id(homework): homework for homework in homeworks})
+
+def __index_news(client: pronotepy.Client, allNews: list):
+	index_local_ids(client, 'news', {__news_local_id(news): news for news in allNews})
+
+def __index_discussions(client: pronotepy.Client, allDiscussions: list):
+	# une discussion supprimée ne doit pas rester dans l'index
+	client.__dict__.setdefault('papillon_local_ids', {}).pop('discussion', None)
+	mark_client_changed(client)
+	index_local_ids(client, 'discussion', {__discussion_local_id(discussion): discussion for discussion in allDiscussions})
+
+def __find_discussion(client: pronotepy.Client, discussionId: str):
+	return find_local_id(client, 'discussion', discussionId, lambda: __index_discussions(client, client.discussions()))
+
+# projection des champs
+# le paramètre fields (ex: fields=id,title,messages.id) limite les champs renvoyés par les endpoints de lecture.
+# Pour une liste, les champs s'appliquent à chacun de ses objets. Les serializers ne lisent que les attributs demandés :
+# les attributs chargés à la demande par pronotepy (participants d'une discussion, contenu d'un cours...) ne sont alors pas téléchargés.
+def request_fields(request) -> str|None:
+	"""Retourne les champs demandés par le paramètre fields, triés et sans doublon (ils font partie des clés de fusion et de cache), ou None pour tous les champs."""
+	paths = {path.strip() for value in request.args.getlist('fields', []) for path in value.split(',')}
+	paths.discard('')
+	return ','.join(sorted(paths)) if paths else None
+
+@functools.lru_cache(maxsize=1024)
+def parse_fields(fields: str|None) -> dict|None:
+	"""Transforme les champs demandés ('id,messages.id,messages.date') en arbre ({'id': None, 'messages': {'id': None, 'date': None}}).
+
+	None désigne un champ demandé en entier. L'arbre retourné est partagé entre les appels : il ne doit pas être modifié.
+	"""
+	if fields is None:
+		return None
+
+	tree = {}
+	for path in fields.split(','):
+		node = tree
+		*parents, name = path.split('.')
+		for parent in parents:
+			if parent in node and node[parent] is None:
+				# le champ parent est déjà demandé en entier
+				break
+			node = node.setdefault(parent, {})
+		else:
+			node[name] = None
+	return tree
+
+def project(obj, spec: dict, fields: dict|None) -> dict:
+	"""Met en forme un objet selon sa spécification, en ne lisant que les champs demandés.
+
+	Args:
+		obj: l'objet pronotepy à mettre en forme.
+		spec (dict): nom du champ -> nom de l'attribut de l'objet, ou fonction (objet, sous-champs demandés) -> valeur.
+		fields (dict|None): l'arbre des champs demandés (voir parse_fields), None pour tous les champs.
+
+	Returns:
+		dict: les champs demandés, dans l'ordre de la spécification.
+	"""
+	if fields is None:
+		return {name: getattr(obj, getter) if type(getter) is str else getter(obj, None) for name, getter in spec.items()}
+	return {name: getattr(obj, getter) if type(getter) is str else getter(obj, fields[name]) for name, getter in spec.items() if name in fields}
+
+def select_fields(value, fields: dict|None):
+	"""Applique les champs demandés à des données déjà mises en forme (dictionnaires et listes)."""
+	if fields is None:
+		return value
+	if isinstance(value, list):
+		return [select_fields(item, fields) for item in value]
+	if isinstance(value, dict):
+		return {name: select_fields(item, fields[name]) for name, item in value.items() if name in fields}
+	return value
+
+# mise en forme des objets pronotepy
+# un serializer par type d'objet : les endpoints, /batch et les caches partagent la même forme JSON
+def format_datetime(value: datetime.date) -> str:
+	"""Met en forme une date ou une date et heure en 'YYYY-MM-DD HH:MM' (isoformat est bien plus rapide que strftime)."""
+	if type(value) is datetime.date:
+		return value.isoformat() + " 00:00"
+	return value.isoformat(" ", "minutes")
+
+FILE_FIELDS = {
+	"id": "id",
+	"name": "name",
+	"url": "url",
+	"type": "type",
+}
+
+def serialize_file(file, fields: dict|None = None) -> dict:
+	return project(file, FILE_FIELDS, fields)
+
+def serialize_files(files, fields: dict|None = None) -> list[dict]:
+	return [project(file, FILE_FIELDS, fields) for file in files or []]
+
+SUBJECT_FIELDS = {
+	"id": "id",
+	"name": "name",
+	"groups": "groups",
+}
+
+def serialize_subject(subject, fields: dict|None = None) -> dict:
+	return project(subject, SUBJECT_FIELDS, fields)
+
+def __lesson_content(lesson, fields: dict|None):
+	lessonContent = []
+	try :
+		if lesson.content != None:
+			lessonContent = project(lesson.content, LESSON_CONTENT_FIELDS, fields)
+	except Exception as e:
+		lessonContent = []
+	return lessonContent
+
+def __lesson_subject(lesson, fields: dict|None) -> dict:
+	if lesson.subject is None:
+		return select_fields({"id": "0", "name": "", "groups": False}, fields)
+	return serialize_subject(lesson.subject, fields)
+
+LESSON_CONTENT_FIELDS = {
+	"title": "title",
+	"description": "description",
+	"category": "category",
+	"files": lambda content, fields: serialize_files(content.files, fields),
+}
+
+LESSON_FIELDS = {
+	"id": "id",
+	"num": "num",
+	"subject": __lesson_subject,
+	"teachers": "teacher_names",
+	"rooms": "classrooms",
+	"group_names": "group_names",
+	"memo": "memo",
+	"content": __lesson_content,
+	"virtual": "virtual_classrooms",
+	"start": lambda lesson, fields: format_datetime(lesson.start),
+	"end": lambda lesson, fields: format_datetime(lesson.end),
+	"background_color": "background_color",
+	"status": "status",
+	"is_cancelled": "canceled",
+	"is_outing": "outing",
+	"is_detention": "detention",
+	"is_exempted": "exempted",
+	"is_test": "test",
+}
+
+def serialize_lesson(lesson, fields: dict|None = None) -> dict:
+	return project(lesson, LESSON_FIELDS, fields)
+
+HOMEWORK_FIELDS = {
+	"id": "id",
+	"local_id": lambda homework, fields: __homework_local_id(homework),
+	"subject": lambda homework, fields: serialize_subject(homework.subject, fields),
+	"description": "description",
+	"background_color": "background_color",
+	"done": "done",
+	"date": lambda homework, fields: format_datetime(homework.date),
+	"files": lambda homework, fields: serialize_files(homework.files, fields),
+}
+
+def serialize_homework(homework, fields: dict|None = None) -> dict:
+	return project(homework, HOMEWORK_FIELDS, fields)
+
+GRADE_VALUE_FIELDS = {
+	"value": lambda grade, fields: __transform_to_number(__get_grade_state(grade.grade)),
+	"out_of": lambda grade, fields: __transform_to_number(grade.out_of),
+	"coefficient": lambda grade, fields: __transform_to_number(grade.coefficient),
+	"average": lambda grade, fields: __transform_to_number(__get_grade_state(grade.average)),
+	"max": lambda grade, fields: __transform_to_number(__get_grade_state(grade.max)),
+	"min": lambda grade, fields: __transform_to_number(__get_grade_state(grade.min)),
+	"significant": lambda grade, fields: __get_grade_state(grade.grade, True),
+}
+
+GRADE_FIELDS = {
+	"id": "id",
+	"subject": lambda grade, fields: serialize_subject(grade.subject, fields),
+	"date": lambda grade, fields: format_datetime(grade.date),
+	"description": "comment",
+	"is_bonus": "is_bonus",
+	"is_optional": "is_optionnal",
+	"is_out_of_20": "is_out_of_20",
+	"grade": lambda grade, fields: project(grade, GRADE_VALUE_FIELDS, fields),
+}
+
+def serialize_grade(grade, fields: dict|None = None) -> dict:
+	return project(grade, GRADE_FIELDS, fields)
+
+AVERAGE_FIELDS = {
+	"subject": lambda average, fields: serialize_subject(average.subject, fields),
+	"average": lambda average, fields: __transform_to_number(__get_grade_state(average.student)),
+	"class_average": lambda average, fields: __transform_to_number(__get_grade_state(average.class_average)),
+	"max": lambda average, fields: __transform_to_number(__get_grade_state(average.max)),
+	"min": lambda average, fields: __transform_to_number(__get_grade_state(average.min)),
+	"out_of": lambda average, fields: __transform_to_number(__get_grade_state(average.out_of)),
+	"significant": lambda average, fields: __get_grade_state(average.student, True),
+	"color": lambda average, fields: average.background_color if average.background_color != None else "#08BE88",
+}
+
+def serialize_average(average, fields: dict|None = None) -> dict:
+	return project(average, AVERAGE_FIELDS, fields)
+
+ABSENCE_FIELDS = {
+	"id": "id",
+	"from": lambda absence, fields: format_datetime(absence.from_date),
+	"to": lambda absence, fields: format_datetime(absence.to_date),
+	"justified": "justified",
+	"hours": "hours",
+	"reasons": "reasons",
+}
+
+def serialize_absence(absence, fields: dict|None = None) -> dict:
+	return project(absence, ABSENCE_FIELDS, fields)
+
+DELAY_FIELDS = {
+	"id": "id",
+	"date": lambda delay, fields: format_datetime(delay.date),
+	"duration": "minutes",
+	"justified": "justified",
+	"justification": "justification",
+	"reasons": "reasons",
+}
+
+def serialize_delay(delay, fields: dict|None = None) -> dict:
+	return project(delay, DELAY_FIELDS, fields)
+
+SCHEDULE_FIELDS = {
+	"id": "id",
+	"start": lambda schedule, fields: format_datetime(schedule.start),
+	"duration": "duration",
+}
+
+PUNISHMENT_HOMEWORK_FIELDS = {
+	"text": "homework",
+	"documents": lambda punishment, fields: serialize_files(punishment.homework_documents, fields),
+}
+
+PUNISHMENT_REASON_FIELDS = {
+	"text": "reasons",
+	"circumstances": "circumstances",
+	"documents": lambda punishment, fields: serialize_files(punishment.circumstance_documents, fields),
+}
+
+PUNISHMENT_FIELDS = {
+	"id": "id",
+	"schedulable": "schedulable",
+	"schedule": lambda punishment, fields: [project(schedule, SCHEDULE_FIELDS, fields) for schedule in punishment.schedule or []],
+	"date": lambda punishment, fields: format_datetime(punishment.given),
+	"given_by": "giver",
+	"exclusion": "exclusion",
+	"during_lesson": "during_lesson",
+	"homework": lambda punishment, fields: project(punishment, PUNISHMENT_HOMEWORK_FIELDS, fields),
+	"reason": lambda punishment, fields: project(punishment, PUNISHMENT_REASON_FIELDS, fields),
+	"nature": "nature",
+	"duration": "duration",
+}
+
+def serialize_punishment(punishment, fields: dict|None = None) -> dict:
+	return project(punishment, PUNISHMENT_FIELDS, fields)
+
+INFORMATION_FIELDS = {
+	"id": "id",
+	"local_id": lambda news, fields: __news_local_id(news),
+	"title": "title",
+	"date": lambda news, fields: format_datetime(news.creation_date),
+	"category": "category",
+	"read": "read",
+	"survey": "survey",
+	"anonymous_survey": "anonymous_response",
+	"author": "author",
+	"content": "content",
+	"attachments": lambda news, fields: serialize_files(news.attachments, fields),
+	"html_content": "_raw_content",
+}
+
+def serialize_information(news, fields: dict|None = None) -> dict:
+	return project(news, INFORMATION_FIELDS, fields)
+
+def __discussion_participants(discussion, fields: dict|None) -> list:
+	participants = []
+	try :
+		participants = discussion.participants()
+	except Exception as e:
+		participants = []
+	return participants
+
+MESSAGE_FIELDS = {
+	"id": "id",
+	"content": "content",
+	"author": "author",
+	"date": lambda message, fields: format_datetime(message.date) if message.date is not None else None,
+	"seen": "seen",
+}
+
+DISCUSSION_FIELDS = {
+	"local_id": lambda discussion, fields: __discussion_local_id(discussion),
+	"subject": "subject",
+	"creator": "creator",
+	"date": lambda discussion, fields: format_datetime(discussion.date) if discussion.date is not None else None,
+	"unread": "unread",
+	"closed": "close",
+	"replyable": "replyable",
+	"messages": lambda discussion, fields: [project(message, MESSAGE_FIELDS, fields) for message in discussion.messages],
+	"participants": __discussion_participants,
+}
+
+def serialize_discussion(discussion, fields: dict|None = None) -> dict:
+	return project(discussion, DISCUSSION_FIELDS, fields)
+
+RECIPIENT_FIELDS = {
+	"id": "id",
+	"name": "name",
+	"type": "type",
+	"email": "email",
+	"functions": "functions",
+	"with_discussion": "with_discussion",
+}
+
+def serialize_recipient(recipient, fields: dict|None = None) -> dict:
+	return project(recipient, RECIPIENT_FIELDS, fields)
+
+ACQUISITION_FIELDS = {
+	"id": "id",
+	"name": "name",
+	"coefficient": "coefficient",
+	"abbreviation": "abbreviation",
+	"domain": "domain",
+	"level": "level",
+}
+
+EVALUATION_FIELDS = {
+	"id": "id",
+	"subject": lambda evaluation, fields: serialize_subject(evaluation.subject, fields),
+	"name": "name",
+	"description": "description",
+	"teacher": "teacher",
+	"date": lambda evaluation, fields: format_datetime(evaluation.date),
+	"paliers": "paliers",
+	"coefficient": "coefficient",
+	"acquisitions": lambda evaluation, fields: [project(acquisition, ACQUISITION_FIELDS, fields) for acquisition in evaluation.acquisitions or []],
+}
+
+def serialize_evaluation(evaluation, fields: dict|None = None) -> dict:
+	return project(evaluation, EVALUATION_FIELDS, fields)
+
+def serialize_menu(menu) -> dict:
+	return {
+		"id": menu.id,
+		"name": menu.name,
+		"date": menu.date.isoformat(),
+		"type": {
+			"is_lunch": menu.is_lunch,
+			"is_dinner": menu.is_dinner,
+		},
+		"first_meal": __get_meal_food(menu.first_meal),
+		"dessert": __get_meal_food(menu.dessert),
+		"cheese": __get_meal_food(menu.cheese),
+		"other_meal": __get_meal_food(menu.other_meal),
+		"side_meal": __get_meal_food(menu.side_meal),
+		"main_meal": __get_meal_food(menu.main_meal),
+	}
+
+@app.get('/metrics')
+async def metrics(request):
+	"""
+	Envoie les métriques du processus au format texte de Prometheus. (en-tête Authorization: Bearer <METRICS_TOKEN> ou X-Papillon-Admin requis)
+	"""
+
+	# les métriques nomment les instances Pronote et les ENT des élèves connectés
+	authorization = request.headers.get('authorization', '')
+	if not (METRICS_TOKEN and hmac.compare_digest(authorization.encode(), ('Bearer ' + METRICS_TOKEN).encode())) and not is_admin(request):
+		raise Forbidden("En-tête Authorization invalide.")
+
+	responseCache = app.ctx.response_cache
+	sharedCache = app.ctx.shared_cache
+	hosts = app.ctx.host_limiter.stats()
+
+	lines = []
+	for metric in (REQUESTS, REQUEST_DURATION, UPSTREAM_DURATION, SERIALIZATION_DURATION, COMPRESSED, LOGINS, LOGIN_DURATION, PREFETCHES, PREFETCH_ENTRIES):
+		lines += metric.render()
+	lines += render_metric('papillon_sessions', 'gauge', 'Jetons valides gardés en mémoire', (), {(): len(app.ctx.saved_clients)})
+	lines += render_metric('papillon_upstream_pending', 'gauge', 'Appels en cours ou en attente dans le pool pronotepy', (), {(): app.ctx.upstream_pending})
+	lines += render_metric('papillon_upstream_host_active', 'gauge', 'Appels en cours par instance Pronote', ('host',), {(host,): stats['active'] for host, stats in hosts.items()})
+	lines += render_metric('papillon_upstream_host_queued', 'gauge', 'Appels en attente de leur tour par instance Pronote', ('host',), {(host,): stats['queued'] for host, stats in hosts.items()})
+	lines += render_metric('papillon_upstream_host_rejected_total', 'counter', 'Appels refusés après UPSTREAM_WAIT_TIMEOUT d\'attente, par instance Pronote', ('host',), {(host,): stats['rejected'] for host, stats in hosts.items()})
+	lines += render_metric('papillon_keep_alive_total', 'counter', 'Requêtes de maintien des sessions, par résultat', ('result',), {(result,): count for result, count in app.ctx.keep_alive_stats.items()})
+	lines += render_metric('papillon_response_cache_requests_total', 'counter', 'Lectures du cache des réponses par session, par endpoint et résultat', ('endpoint', 'result'),
+		{**{(endpoint, 'hit'): count for endpoint, count in responseCache.hits.items()}, **{(endpoint, 'miss'): count for endpoint, count in responseCache.misses.items()}})
+	lines += render_metric('papillon_response_cache_bytes', 'gauge', 'Taille des réponses gardées dans le cache par session', (), {(): responseCache.size})
+	lines += render_metric('papillon_shared_cache_requests_total', 'counter', 'Lectures du cache partagé par établissement, par endpoint et résultat', ('endpoint', 'result'),
+		{**{(endpoint, 'hit'): count for endpoint, count in sharedCache.hits.items()}, **{(endpoint, 'stale'): count for endpoint, count in sharedCache.stale_hits.items()}, **{(endpoint, 'miss'): count for endpoint, count in sharedCache.misses.items()}})
+
+	return text('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.get('/profiles')
+async def profiles(request):
+	"""
+	Liste les rapports de profilage enregistrés, du plus récent au plus ancien. (en-tête X-Papillon-Admin requis)
+	"""
+
+	if not is_admin(request):
+		raise Forbidden("En-tête X-Papillon-Admin invalide.")
+
+	try:
+		reports = sorted((file[:-4] for file in os.listdir(PROFILE_DIR) if file.endswith('.txt')), reverse=True)
+	except FileNotFoundError:
+		reports = []
+	return rjson(reports)
+
+@app.get('/profiles/<profileId>')
+async def profile(request, profileId: str):
+	"""
+	Envoie un rapport de profilage. (en-tête X-Papillon-Admin requis)
+	"""
+
+	if not is_admin(request):
+		raise Forbidden("En-tête X-Papillon-Admin invalide.")
+
+	path = os.path.join(PROFILE_DIR, os.path.basename(profileId) + '.txt')
+	if not os.path.isfile(path):
+		raise NotFound("Ce rapport n'existe pas.")
+	with open(path, 'r', encoding='utf8') as f:
+		return text(f.read())
+
+def __infos() -> dict:
+	return {
 		'status': 'ok',
 		'message': 'server is running',
 		'server': socket.gethostname(),
 		'version': API_VERSION,
 		'ent_list': CAS_LIST if not MAINTENANCE['enable'] else []
-	})
+	}
+
+@app.before_server_start
+async def attach_infos_payload(app, loop):
+	# la réponse de / et /infos (avec la liste des ENT) est la même pour tous : elle est encodée et compressée au démarrage
+	app.ctx.infos_payload = StaticPayload(__infos())
+
+@app.get('/')
+async def home(request):
+	return app.ctx.infos_payload.response(request)
 
 @app.get('/infos')
 async def infos(request):
+	return app.ctx.infos_payload.response(request)
+
+# rechargement de la configuration
+# maintenance.json et cas_list.json sont relus dès qu'ils changent (vérifiés toutes les CONFIG_RELOAD_INTERVAL sec), ou par POST /admin/reload :
+# le mode maintenance s'active et se désactive sans redémarrage, donc sans perdre les sessions gardées en mémoire
+CONFIG_RELOAD_INTERVAL = float(environ.get('CONFIG_RELOAD_INTERVAL', 5)) # le temps en sec entre deux vérifications des fichiers de configuration (0 pour désactiver)
+CONFIG_FILES = ('maintenance.json', 'cas_list.json')
+
+def config_signature() -> tuple:
+	"""Retourne la date de modification et la taille de chaque fichier de configuration (None pour un fichier illisible)."""
+	signature = []
+	for path in CONFIG_FILES:
+		try:
+			stat = os.stat(path)
+			signature.append((stat.st_mtime_ns, stat.st_size))
+		except OSError:
+			signature.append(None)
+	return tuple(signature)
+
+def reload_config() -> bool:
+	"""Relit maintenance.json et cas_list.json et remplace la configuration en cours si elle a changé.
+
+	Les deux fichiers sont lus et vérifiés avant de remplacer quoi que ce soit : une requête voit soit l'ancienne configuration, soit la nouvelle.
+	Un fichier invalide (en cours d'écriture...) laisse l'ancienne configuration en place.
+	La réponse de / et /infos n'est encodée, compressée et son ETag recalculé qu'une fois par changement.
+
+	Returns:
+		bool: True si la configuration a été remplacée.
+	"""
+	global MAINTENANCE, CAS_LIST
+	try:
+		with open('maintenance.json', 'r', encoding='utf8') as f:
+			maintenance = json.load(f)
+		with open('cas_list.json', 'r', encoding='utf8') as f:
+			casList = json.load(f)
+		if not isinstance(maintenance, dict) or 'enable' not in maintenance or not isinstance(casList, list):
+			raise ValueError("maintenance.json doit être un objet avec la clé enable, cas_list.json une liste")
+	except (OSError, ValueError) as e:
+		print(f"WARN: Couldn't reload the configuration: {e}")
+		return False
+
+	if maintenance == MAINTENANCE and casList == CAS_LIST:
+		return False
+	MAINTENANCE, CAS_LIST = maintenance, casList
+	app.ctx.infos_payload = StaticPayload(__infos())
+	return True
+
+async def watch_config(app):
+	"""Recharge la configuration quand la date de modification ou la taille d'un de ses fichiers change."""
+	signature = config_signature()
+	while True:
+		await asyncio.sleep(CONFIG_RELOAD_INTERVAL)
+		current = config_signature()
+		if current != signature:
+			signature = current
+			reload_config()
+
+@app.after_server_start
+async def start_config_watcher(app, loop):
+	app.ctx.config_watcher = asyncio.ensure_future(watch_config(app)) if CONFIG_RELOAD_INTERVAL else None
+
+@app.after_server_stop
+async def stop_config_watcher(app, loop):
+	if app.ctx.config_watcher is not None:
+		app.ctx.config_watcher.cancel()
+
+@app.post('/admin/reload')
+async def admin_reload(request):
+	"""
+	Relit maintenance.json et cas_list.json sans attendre la prochaine vérification. (en-tête X-Papillon-Admin requis)
+
+	Avec plusieurs workers, seul le processus qui reçoit la requête est rechargé : les autres le sont à leur prochaine vérification.
+
+	Returns:
+		dict: {"reloaded": bool, "maintenance": bool, "ent_count": int}
+	"""
+
+	if not is_admin(request):
+		raise Forbidden("En-tête X-Papillon-Admin invalide.")
+
+	reloaded = reload_config()
 	return rjson({
-		'status': 'ok',
-		'message': 'server is running',
-		'server': socket.gethostname(),
-		'version': API_VERSION,
-		'ent_list': CAS_LIST if not MAINTENANCE['enable'] else []
+		"reloaded": reloaded,
+		"maintenance": MAINTENANCE['enable'],
+		"ent_count": len(CAS_LIST),
 	})
  
 # requête initiale :
 # un client doit faire
 # token = POST /generatetoken body={url, username, password, ent}
 # GET * token=token
+def __login_key(url: str, username: str, type: str, ent: str|None) -> str:
+	# les identifiants ne sont pas gardés en clair, même dans les clés de Redis
+	return hashlib.sha256(json.dumps([url, username, type, ent]).encode()).hexdigest()
+
+@app.before_server_start
+async def attach_login_hash_pool(app, loop):
+	app.ctx.login_hash_pool = ThreadPoolExecutor(max_workers=LOGIN_HASH_POOL_SIZE, thread_name_prefix='pbkdf2')
+
+@app.after_server_stop
+async def detach_login_hash_pool(app, loop):
+	app.ctx.login_hash_pool.shutdown(wait=False, cancel_futures=True)
+
+async def __hash_password(password: str, salt: bytes) -> bytes:
+	return await asyncio.get_running_loop().run_in_executor(app.ctx.login_hash_pool, hashlib.pbkdf2_hmac, 'sha256', password.encode(), salt, LOGIN_HASH_ITERATIONS)
+
+async def reuse_login(login_key: str, password: str) -> str|None:
+	"""Réutilise la session d'une connexion précédente avec les mêmes identifiants, au lieu de se reconnecter à Pronote.
+
+	Args:
+		login_key (str): la clé de la connexion (voir __login_key).
+		password (str): le mot de passe reçu, comparé au hash salé gardé par remember_login.
+
+	Returns:
+		str|None: un nouveau jeton pour la session existante, ou None s'il faut se connecter.
+	"""
+	login = await app.ctx.session_store.get_login(login_key)
+	if login is None:
+		return None
+
+	# le mot de passe est vérifié avant de toucher à la session : des essais erronés ne la prolongent pas
+	if not hmac.compare_digest(await __hash_password(password, login['salt']), login['hash']):
+		return None
+
+	target = login['token'].decode() if isinstance(login['token'], bytes) else login['token']
+	success, client = await get_client(target)
+	if success != 'ok' or not client.logged_in:
+		return None
+
+	token = secrets.token_urlsafe(16)
+	await alias_client(token, target)
+	return token
+
+async def remember_login(login_key: str, password: str, token: str):
+	"""Garde la connexion qui vient d'être faite pour que reuse_login puisse la réutiliser.
+
+	Args:
+		login_key (str): la clé de la connexion (voir __login_key).
+		password (str): le mot de passe utilisé, seul un hash salé est gardé.
+		token (str): le jeton de la nouvelle session.
+	"""
+	salt = secrets.token_bytes(16)
+	await app.ctx.session_store.set_login(login_key, {
+		'token': token,
+		'salt': salt,
+		'hash': await __hash_password(password, salt),
+	})
+
+async def timed_login(method: str, ent: str, url: str, func, *args, keep_late=None, **kwargs) -> pronotepy.Client:
+	"""Connecte un client à Pronote dans le pool (au plus UPSTREAM_LOGIN_TIMEOUT, attente de l'hôte comprise), en mesurant la durée et le résultat de la connexion.
+
+	Args:
+		method (str): la méthode de connexion ('url', 'qrcode' ou 'token').
+		ent (str): le nom de l'ENT ('none' sans ENT).
+		url (str): l'URL Pronote.
+		func (callable): le constructeur du client pronotepy.
+		*args, **kwargs: les arguments passés à func.
+		keep_late (callable|None): coroutine appelée avec le client si la connexion aboutit après le délai, pour ne pas la perdre.
+
+	Returns:
+		pronotepy.Client: le client (connecté ou non).
+
+	Raises:
+		ServiceUnavailable: si une file d'attente est pleine, ou si la connexion n'aboutit pas à temps.
+	"""
+	start = time.perf_counter()
+	result = 'failure'
+	try:
+		future = await submit_host_upstream(upstream_host(url), func, *args, timeout=UPSTREAM_LOGIN_TIMEOUT, **kwargs)
+		try:
+			client = await wait_upstream(future, max(0, UPSTREAM_LOGIN_TIMEOUT - (time.perf_counter() - start)))
+		except ServiceUnavailable:
+			if keep_late is not None:
+				future.add_done_callback(lambda future: __keep_late_login(future, method, ent, keep_late))
+			raise
+		if client.logged_in:
+			result = 'success'
+		return client
+	except ServiceUnavailable:
+		result = 'unavailable'
+		raise
+	finally:
+		LOGIN_DURATION.observe(time.perf_counter() - start, method, ent)
+		LOGINS.inc(method, ent, result)
+
+def __keep_late_login(future: asyncio.Future, method: str, ent: str, keep_late):
+	# la requête a déjà répondu 503 : une connexion réussie est quand même gardée, la prochaine tentative la réutilise
+	if future.cancelled() or future.exception() is not None or not future.result().logged_in:
+		return
+	LOGINS.inc(method, ent, 'late')
+	app.add_task(keep_late(future.result()))
+
+async def register_login(client: pronotepy.Client, ent: str, login_key: str|None = None, password: str|None = None) -> str:
+	"""Enregistre un client connecté sous un nouveau jeton.
+
+	Args:
+		client (pronotepy.Client): le client connecté.
+		ent (str): le nom de l'ENT ('none' sans ENT), pour le préchargement.
+		login_key (str|None): la clé de la connexion (voir __login_key) pour que reuse_login puisse la réutiliser, None pour ne pas la garder.
+		password (str|None): le mot de passe utilisé, avec login_key.
+
+	Returns:
+		str: le jeton de la session.
+	"""
+	token = secrets.token_urlsafe(16)
+	# Set current period
+	client.calculated_period = __get_current_period(client)
+	client.activated_period = __get_current_period(client, False, None, True)
+
+	await save_client(token, client)
+	if login_key is not None:
+		await remember_login(login_key, password, token)
+	start_prefetch(token, ent)
+	return token
+
 @app.route('/generatetoken', methods=['POST'])
 async def generate_token(request):
 	body = request.form
@@ -186,17 +2541,32 @@ async def generate_token(request):
 				elif not rk in body and rk == 'ent':
 					noENT = True 
 
+			# seuls les noms d'ENT existants servent de label, pour ne pas créer une série par valeur envoyée
+			loginEnt = 'none' if noENT else body['ent'] if hasattr(pronotepy.ent, body['ent']) else 'unknown'
+			loginKey = __login_key(body['url'], body['username'], type, None if noENT else body['ent'])
+			token = await reuse_login(loginKey, body['password'])
+			if token is not None:
+				LOGINS.inc('url', loginEnt, 'reused')
+				return rjson({
+					"token": token,
+					"error": False
+				})
+
+			password = body['password']
+			keepLate = lambda client: register_login(client, loginEnt, loginKey, password)
 			try:
 				if noENT:
 					if type == 'parent':
-						client = pronotepy.ParentClient(body['url'], username=body['username'], password=body['password'])
+						client = await timed_login('url', loginEnt, body['url'], pronotepy.ParentClient, body['url'], username=body['username'], password=body['password'], keep_late=keepLate)
 					else:
-						client = pronotepy.Client(body['url'], username=body['username'], password=body['password'])
+						client = await timed_login('url', loginEnt, body['url'], pronotepy.Client, body['url'], username=body['username'], password=body['password'], keep_late=keepLate)
 				else:
 					if type == 'parent':
-						client = pronotepy.ParentClient(body['url'], username=body['username'], password=body['password'], ent=getattr(pronotepy.ent, body['ent']))
+						client = await timed_login('url', loginEnt, body['url'], pronotepy.ParentClient, body['url'], username=body['username'], password=body['password'], ent=getattr(pronotepy.ent, body['ent']), keep_late=keepLate)
 					else:
-						client = pronotepy.Client(body['url'], username=body['username'], password=body['password'], ent=getattr(pronotepy.ent, body['ent']))
+						client = await timed_login('url', loginEnt, body['url'], pronotepy.Client, body['url'], username=body['username'], password=body['password'], ent=getattr(pronotepy.ent, body['ent']), keep_late=keepLate)
+			except ServiceUnavailable:
+				raise
 			except Exception as e:
 				print(f"Error while trying to connect to {body['url']}")
 				return rjson({
@@ -219,11 +2589,13 @@ async def generate_token(request):
 						},status=400)
 
 			try:
-				client = pronotepy.Client.qrcode_login({
+				client = await timed_login('qrcode', 'none', body['url'], pronotepy.Client.qrcode_login, {
 					"jeton": body['qrToken'],
 					"login": body['login'],
 					"url": body['url']
 				}, body['checkCode'], body['uuid'])
+			except ServiceUnavailable:
+				raise
 			except Exception as e:         
 				return rjson({
 					"token": False,
@@ -239,12 +2611,14 @@ async def generate_token(request):
 					}, status=400)
 
 			try:
-				client = pronotepy.Client.token_login(
+				client = await timed_login('token', 'none', body['url'], pronotepy.Client.token_login,
 					pronote_url = body['url'],
 					username = body['username'],
 					password = body['password'],
 					uuid=body['uuid']
 				)
+			except ServiceUnavailable:
+				raise
 			except Exception as e:
 				print(f"Error while trying to connect to {body['url']}")
 
@@ -253,24 +2627,15 @@ async def generate_token(request):
 					"error": str(e),
 				}, status=498)
 
-		token = secrets.token_urlsafe(16)
-		# Set current period
-		client.calculated_period = __get_current_period(client)
-		client.activated_period = __get_current_period(client, False, None, True)
-
-		client_pickle = base64.b64encode(pickle.dumps(client)).decode()
-
-		app.ctx.saved_clients[token] = {
-			'client': client,
-			'last_interaction': time.time()
-		}
-
-
-
 		#print(len(app.ctx.saved_clients), 'valid tokens')
 
 		# if error return error
 		if client.logged_in:
+			if method == "url":
+				token = await register_login(client, loginEnt, loginKey, body['password'])
+			else:
+				token = await register_login(client, 'none')
+
 			if method != "url":
 				QRtokenArray = {
 					"token": token,
@@ -357,6 +2722,22 @@ def __get_current_period(client: pronotepy.Client, wantSpecificPeriod: bool = Fa
 			return __get_current_period(client, False, None)
 
 
+def __set_period(client: pronotepy.Client, periodName: str) -> str:
+	"""
+	Sélectionne la période utilisée par les autres requêtes. (appelé sous le verrou de la session pour que le changement soit enregistré)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		periodName (str): Le nom de la période à sélectionner
+		
+	Returns:
+		str: Le nom de la période sélectionnée
+	"""
+	
+	client.calculated_period = __get_current_period(client, True, periodName)
+	return client.calculated_period.name
+
+
 @app.route('/changePeriod', methods=['POST'])
 async def change_period(request):
 	"""
@@ -373,14 +2754,14 @@ async def change_period(request):
 	token = request.args.get('token')
 	periodName = request.args.get('periodName')
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
 		if client.logged_in:
 			try:
-				client.calculated_period = __get_current_period(client, True, periodName)
+				periodName = await run_client_call(token, __set_period, periodName, mutating=True)
 				return rjson({
 					'status': 'ok',
-					'period': client.calculated_period.name
+					'period': periodName
 				})
 			except Exception as e:
 				return text('"'+success+'"', status=498)
@@ -388,6 +2769,74 @@ async def change_period(request):
 		return text('"'+success+'"', status=498)
 
 
+def __user_info(name: str, default):
+	# certaines informations ne sont pas fournies par tous les établissements
+	def getter(client: pronotepy.Client, fields: dict|None):
+		try:
+			return getattr(client.info, name)
+		except Exception as err:
+			return default
+	return getter
+
+def __user_children(client: pronotepy.Client, fields: dict|None) -> list:
+	children = []
+	if type(client).__name__ == "ParentClient":
+		try:
+			children = client.children.to_dict()
+		except Exception as err:
+			children = []
+	return children
+
+PERIOD_FIELDS = {
+	'start': lambda period, fields: period.start.strftime('%Y-%m-%d'),
+	'end': lambda period, fields: period.end.strftime('%Y-%m-%d'),
+	'name': 'name',
+	'id': 'id',
+}
+
+def __user_periods(client: pronotepy.Client, fields: dict|None) -> list[dict]:
+	periods = []
+	for period in client.periods:
+		periodData = project(period, PERIOD_FIELDS, fields)
+		if fields is None or 'actual' in fields:
+			periodData['actual'] = client.calculated_period.id == period.id
+		periods.append(periodData)
+	return periods
+
+USER_CLIENT_FIELDS = {
+	"type": lambda client, fields: type(client).__name__,
+	"children": __user_children,
+}
+
+USER_FIELDS = {
+	"name": lambda client, fields: client.info.name,
+	"class": lambda client, fields: client.info.class_name,
+	"establishment": __user_info('establishment', ""),
+	"phone": __user_info('phone', ""),
+	"email": __user_info('email', ""),
+	"address": __user_info('address', []),
+	"ine": __user_info('ine_number', ""),
+	"profile_picture": lambda client, fields: client.info.profile_picture.url if client.info.profile_picture else None,
+	"delegue": lambda client, fields: client.info.delegue,
+	"periods": __user_periods,
+	"client": lambda client, fields: project(client, USER_CLIENT_FIELDS, fields),
+}
+
+def __get_user(client: pronotepy.Client, fields: str|None = None) -> dict:
+	"""
+	Récupère et met en forme les informations de l'utilisateur. (appelé dans le pool pronotepy, certaines informations sont chargées à la demande)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		fields (str|None): Les champs demandés (voir request_fields), None pour tous les champs
+		
+	Returns:
+		dict: Les informations de l'utilisateur
+	"""
+	
+	return project(client, USER_FIELDS, parse_fields(fields))
+
+
 @app.route('/user', methods=['GET'])
 async def user(request):
 	"""
@@ -415,88 +2864,57 @@ async def user(request):
 	
 	token = request.args.get('token')
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
 		if client.logged_in:
-			periods = []
-			for period in client.periods:
-				periods.append({
-					'start': period.start.strftime('%Y-%m-%d'),
-					'end': period.end.strftime('%Y-%m-%d'),
-					'name': period.name,
-					'id': period.id,
-					'actual': client.calculated_period.id == period.id
-				})
-
-			etabData = ""
-			try:
-				etabData = client.info.establishment
-			except Exception as err:
-				etabData = ""
-
-			phone = ""
-			try:
-				phone = client.info.phone
-			except Exception as err:
-				phone = ""
-
-			email = ""
-			try:
-				email = client.info.email
-			except Exception as err:
-				email = ""
-
-			address = []
-			try:
-				address = client.info.address
-			except Exception as err:
-				address = []
-
-			ine_number = ""
-			try:
-				ine_number = client.info.ine_number
-			except Exception as err:
-				ine_number = ""
-
-			usertype = type(client).__name__
-
-			children = []
-			if (usertype == "ParentClient"):
-				try:
-					children = client.children.to_dict()
-				except Exception as err:
-					children = []
-
-			userData = {
-				"name": client.info.name,
-				"class": client.info.class_name,
-				"establishment": etabData,
-				"phone": phone,
-				"email": email,
-				"address": address,
-				"ine": ine_number,
-				"profile_picture": client.info.profile_picture.url if client.info.profile_picture else None,
-				"delegue": client.info.delegue,
-				"periods": periods,
-				"client": {
-					"type": usertype,
-					"children": children
-				}
-			}
-
-			return rjson(userData)
+			return await cached_client_call(request, token, 'user', __get_user, request_fields(request))
 	else:
 		return text('"'+success+'"', status=498)
 
 
+def __get_timetable(client: pronotepy.Client, dateFrom: datetime.date, dateTo: datetime.date, fields: str|None = None) -> dict[datetime.date, list[dict]]|None:
+	"""
+	Récupère et met en forme les cours entre deux dates en un seul appel à Pronote. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		dateFrom (datetime.date): La date de début
+		dateTo (datetime.date): La date de fin (incluse)
+		fields (str|None): Les champs demandés (voir request_fields), None pour tous les champs
+		
+	Returns:
+		dict[datetime.date, list[dict]]|None: Les informations de l'emploi du temps pour chaque jour, ou None si Pronote n'a pas pu les fournir
+	"""
+	
+	try :
+		# pronotepy ramène date_to à minuit (même pour un datetime) : on demande jusqu'au lendemain et on filtre ensuite
+		lessons = client.lessons(dateFrom, dateTo + datetime.timedelta(days=1))
+	except Exception as e:
+		return None
+
+	lessonFields = parse_fields(fields)
+	lessonsData = {dateFrom + datetime.timedelta(days=i): [] for i in range((dateTo - dateFrom).days + 1)}
+	for lesson in lessons:
+		day = lessonsData.get(lesson.start.date())
+		if day is not None:
+			day.append(serialize_lesson(lesson, lessonFields))
+
+	return lessonsData
+
+TIMETABLE_MAX_DAYS = 62 # le nombre maximal de jours demandés en une fois à /timetable
+
 @app.route('/timetable', methods=['GET'])
 async def timetable(request):
 	"""
-	Récupère l'emploi du temps de l'utilisateur.
+	Récupère l'emploi du temps de l'utilisateur, pour une journée ou entre deux dates.
+	
+	Chaque journée est gardée en cache séparément : une plage qui recoupe des journées déjà demandées ne récupère que les journées manquantes.
 	
 	Args:
 		token (str): Le token du client Pronote
 		dateString (str): La date à récupérer sous la forme YYYY-MM-DD
+		dateFrom (str): La date de début sous la forme YYYY-MM-DD (remplace dateString)
+		dateTo (str): La date de fin (incluse) sous la forme YYYY-MM-DD
 		
 	Returns:
 		list[dict]: Les informations de l'emploi du temps :
@@ -521,80 +2939,77 @@ async def timetable(request):
 			"is_exempted": bool,
 			"is_test": bool,
 		}]
+	
+	Raises:
+		BadRequest: si dateTo est avant dateFrom ou si la plage dépasse TIMETABLE_MAX_DAYS jours.
 	"""
 	
 	token = request.args.get('token')
-	dateString = request.args.get('dateString')
+	dateString = request.args.get('dateFrom', request.args.get('dateString'))
 
-	dateToGet = None
+	dateFrom = None
+
+	try :
+		dateFrom = datetime.datetime.strptime(dateString, "%Y-%m-%d").date()
+	except Exception as e:
+		dateFrom = datetime.datetime.now().date()
 
 	try :
-		dateToGet = datetime.datetime.strptime(dateString, "%Y-%m-%d").date()
+		dateTo = datetime.datetime.strptime(request.args.get('dateTo'), "%Y-%m-%d").date()
 	except Exception as e:
-		dateToGet = datetime.datetime.now().date()
-	success, client = get_client(token)
+		dateTo = dateFrom
+
+	if dateTo < dateFrom or (dateTo - dateFrom).days >= TIMETABLE_MAX_DAYS:
+		raise BadRequest({
+			"status": "invalid range",
+			"error": f"dateTo doit être après dateFrom, sur {TIMETABLE_MAX_DAYS} jours au plus."
+		})
+
+	success, client = await get_client(token)
 
 	if success == 'ok':
 		if client.logged_in:
-			lessons = []
-			try :
-				lessons = client.lessons(dateToGet)
-			except Exception as e:
-				lessons = []
+			return raw(await days_body(request, token, 'timetable', __get_timetable, dateFrom, dateTo), content_type='application/json')
+	else:
+		return text('"'+success+'"', status=498)
+
+def __get_content(client: pronotepy.Client, dateToGet: datetime.date) -> list[dict]:
+	"""
+	Récupère et met en forme le contenu des cours d'une journée. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		dateToGet (datetime.date): La date à récupérer
+		
+	Returns:
+		list[dict]: Les contenus des cours
+	"""
+	
+	content = client.lessons(dateToGet, dateToGet)
 
-			lessonsData = []
-			for lesson in lessons:
+	contentData = []
+	for lesson in content:
+		if lesson.content != None:
+			for contentElement in lesson.content:
 				files = []
-				lessonContent = []
-
-				try :
-					if lesson.content != None:
-						for file in lesson.content.files:
-							files.append({
-								"id": file.id,
-								"name": file.name,
-								"url": file.url,
-								"type": file.type
-							})
-
-						lessonContent = {
-							"title": lesson.content.title,
-							"description": lesson.content.description,
-							"category": lesson.content.category,
-							"files": files
-						}
-				except Exception as e:
-					lessonContent = []
-
-				lessonData = {
-					"id": lesson.id,
-					"num": lesson.num,
-					"subject": {
-						"id": lesson.subject.id if lesson.subject is not None else "0",
-						"name": lesson.subject.name if lesson.subject is not None else "",
-						"groups": lesson.subject.groups if lesson.subject is not None else False
-					},
-					"teachers": lesson.teacher_names,
-					"rooms": lesson.classrooms,
-					"group_names": lesson.group_names,
-					"memo": lesson.memo,
-					"content": lessonContent,
-					"virtual": lesson.virtual_classrooms,
-					"start": lesson.start.strftime("%Y-%m-%d %H:%M"),
-					"end": lesson.end.strftime("%Y-%m-%d %H:%M"),
-					"background_color": lesson.background_color,
-					"status": lesson.status,
-					"is_cancelled": lesson.canceled,
-					"is_outing": lesson.outing,
-					"is_detention": lesson.detention,
-					"is_exempted": lesson.exempted,
-					"is_test": lesson.test,
+				for file in contentElement.files:
+					files.append({
+						"id": file.id,
+						"name": file.name,
+						"url": file.url,
+						"type": file.type
+					})
+				
+				contentList = {
+					"title": contentElement.title,
+					"description": contentElement.description,
+					"category": contentElement.category,
+					"files": files
 				}
-				lessonsData.append(lessonData)
 
-			return rjson(lessonsData)
-	else:
-		return text('"'+success+'"', status=498)
+		contentData.append(contentList)
+
+	return contentData
 
 @app.route('/content', methods=['GET'])
 async def content(request):
@@ -613,43 +3028,71 @@ async def content(request):
 	dateString = request.args.get('dateString')
 
 	dateToGet = datetime.datetime.strptime(dateString, "%Y-%m-%d").date()
-	success, client = get_client(token)
+	success, client = await get_client(token)
 
 	if success == 'ok':
 		if client.logged_in:
-			content = client.lessons(dateToGet, dateToGet)
-
-			contentData = []
-			for lesson in content:
-				if lesson.content != None:
-					for contentElement in lesson.content:
-						files = []
-						for file in contentElement.files:
-							files.append({
-								"id": file.id,
-								"name": file.name,
-								"url": file.url,
-								"type": file.type
-							})
-						
-						contentList = {
-							"title": contentElement.title,
-							"description": contentElement.description,
-							"category": contentElement.category,
-							"files": files
-						}
-
-				contentData.append(contentList)
-
-			return rjson(contentData)
+			contentData = await run_client_call(token, __get_content, dateToGet)
+			return rjson(select_fields(contentData, parse_fields(request_fields(request))))
 	else:
 		return text('"'+success+'"', status=498)
 
+def __get_homeworks(client: pronotepy.Client, dateFrom: datetime.date, dateTo: datetime.date, fields: str|None = None) -> list[dict]:
+	"""
+	Récupère et met en forme les devoirs entre deux dates. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		dateFrom (datetime.date): La date de début
+		dateTo (datetime.date): La date de fin
+		fields (str|None): Les champs demandés (voir request_fields), None pour tous les champs
+		
+	Returns:
+		list[dict]: Les informations des devoirs
+	"""
+	
+	homeworks = client.homework(date_from=dateFrom, date_to=dateTo)
+	__index_homeworks(client, homeworks)
+
+	homeworkFields = parse_fields(fields)
+	homeworksData = [serialize_homework(homework, homeworkFields) for homework in homeworks]
+
+	return homeworksData
+
+def __get_homework_days(client: pronotepy.Client, dateFrom: datetime.date, dateTo: datetime.date, fields: str|None = None) -> dict[datetime.date, list[dict]]:
+	"""
+	Récupère et met en forme les devoirs entre deux dates, par date de rendu. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		dateFrom (datetime.date): La date de début
+		dateTo (datetime.date): La date de fin (incluse)
+		fields (str|None): Les champs demandés (voir request_fields), None pour tous les champs
+		
+	Returns:
+		dict[datetime.date, list[dict]]: Les informations des devoirs de chaque jour
+	"""
+	
+	homeworks = client.homework(date_from=dateFrom, date_to=dateTo)
+	__index_homeworks(client, homeworks)
+
+	homeworkFields = parse_fields(fields)
+	homeworksData = {dateFrom + datetime.timedelta(days=i): [] for i in range((dateTo - dateFrom).days + 1)}
+	for homework in homeworks:
+		day = homework.date.date() if isinstance(homework.date, datetime.datetime) else homework.date
+		homeworksData.setdefault(day, []).append(serialize_homework(homework, homeworkFields))
+
+	return homeworksData
+
+HOMEWORK_MAX_DAYS = 400 # le nombre maximal de jours demandés en une fois à /homework (une année scolaire entière passe)
+
 @app.route('/homework', methods=['GET'])
 async def homework(request):
 	"""
 	Récupère les devoirs de l'utilisateur.
 	
+	Comme pour /timetable, chaque journée est gardée en cache séparément.
+	
 	Args:
 		token (str): Le token du client Pronote
 		dateFrom (str): La date de début à récupérer sous la forme YYYY-MM-DD
@@ -657,6 +3100,9 @@ async def homework(request):
 		
 	Returns:
 		list[dict]: Les informations des devoirs
+	
+	Raises:
+		BadRequest: si la plage dépasse HOMEWORK_MAX_DAYS jours.
 	"""
 	
 	token = request.args.get('token')
@@ -669,51 +3115,18 @@ async def homework(request):
 	except Exception as e:
 		dateFrom = datetime.datetime.now().date()
 		dateTo = datetime.datetime.now().date()
-	success, client = get_client(token)
+
+	# chaque journée est une entrée du cache : la taille de la plage est bornée
+	if (dateTo - dateFrom).days >= HOMEWORK_MAX_DAYS:
+		raise BadRequest({
+			"status": "invalid range",
+			"error": f"La plage doit faire {HOMEWORK_MAX_DAYS} jours au plus."
+		})
+	success, client = await get_client(token)
 
 	if success == 'ok':
 		if client.logged_in:
-			homeworks = client.homework(date_from=dateFrom, date_to=dateTo)
-
-			homeworksData = []
-			for homework in homeworks:
-				files = []
-				for file in homework.files:
-					files.append({
-						"id": file.id,
-						"name": file.name,
-						"url": file.url,
-						"type": file.type
-					})
-
-				local_id = ""
-
-				# return a combination of the 20 first letters of description, 2 first letters of subject name and the date
-				if len(homework.description) > 20:
-					local_id += homework.description[:20]
-				else:
-					local_id += homework.description
-				
-				local_id += homework.subject.name[:2]
-				local_id += homework.date.strftime("%Y-%m-%d_%H:%M")
-
-				homeworkData = {
-					"id": homework.id,
-					"local_id": local_id,
-					"subject": {
-						"id": homework.subject.id,
-						"name": homework.subject.name,
-						"groups": homework.subject.groups,
-					},
-					"description": homework.description,
-					"background_color": homework.background_color,
-					"done": homework.done,
-					"date": homework.date.strftime("%Y-%m-%d %H:%M"),
-					"files": files
-				}
-				homeworksData.append(homeworkData)
-
-			return rjson(homeworksData)
+			return raw(await days_body(request, token, 'homework', __get_homework_days, dateFrom, dateTo), content_type='application/json')
 	else:
 		return text('"'+success+'"', status=498)
 
@@ -784,6 +3197,35 @@ def __transform_to_number(value)->float|int:
 		return float(value.replace(",", "."))
 
 
+def __period_grades(period: pronotepy.Period, fields: dict|None) -> list[dict]:
+	allGrades = []
+	try :
+		allGrades = period.grades
+	except Exception as e:
+		allGrades = []
+	return [serialize_grade(grade, fields) for grade in allGrades]
+
+GRADES_FIELDS = {
+	"grades": __period_grades,
+	"averages": lambda period, fields: [serialize_average(average, fields) for average in period.averages],
+	"overall_average": lambda period, fields: __transform_to_number(__get_grade_state(period.overall_average)),
+	"class_overall_average": lambda period, fields: __transform_to_number(__get_grade_state(period.class_overall_average)),
+}
+
+def __get_grades(client: pronotepy.Client, fields: str|None = None) -> dict:
+	"""
+	Récupère et met en forme les notes et moyennes de la période sélectionnée. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		fields (str|None): Les champs demandés (voir request_fields), None pour tous les champs
+		
+	Returns:
+		dict: Les informations des notes
+	"""
+	
+	return project(client.calculated_period, GRADES_FIELDS, parse_fields(fields))
+
 @app.route('/grades', methods=['GET'])
 async def grades(request):
 	"""
@@ -798,72 +3240,35 @@ async def grades(request):
 	
 	token = request.args.get('token')
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
-		allGrades = []
-		try :
-			allGrades = client.calculated_period.grades
-		except Exception as e:
-			allGrades = []
-		gradesData = []
-		for grade in allGrades:
-			gradeData = {
-				"id": grade.id,
-				"subject": {
-					"id": grade.subject.id,
-					"name": grade.subject.name,
-					"groups": grade.subject.groups,
-				},
-				"date": grade.date.strftime("%Y-%m-%d %H:%M"),
-				"description": grade.comment,
-				"is_bonus": grade.is_bonus,
-				"is_optional": grade.is_optionnal,
-				"is_out_of_20": grade.is_out_of_20,
-				"grade": {
-					"value": __transform_to_number(__get_grade_state(grade.grade)),
-					"out_of": __transform_to_number(grade.out_of),
-					"coefficient": __transform_to_number(grade.coefficient),
-					"average": __transform_to_number(__get_grade_state(grade.average)),
-					"max": __transform_to_number(__get_grade_state(grade.max)),
-					"min": __transform_to_number(__get_grade_state(grade.min)),
-					"significant": __get_grade_state(grade.grade, True),
-				}
-			}
-
-			gradesData.append(gradeData)
-
-		averagesData = []
-
-		allAverages = client.calculated_period.averages
-		for average in allAverages:
-			averageData = {
-				"subject": {
-					"id": average.subject.id,
-					"name": average.subject.name,
-					"groups": average.subject.groups,
-				},
-				"average": __transform_to_number(__get_grade_state(average.student)),
-				"class_average": __transform_to_number(__get_grade_state(average.class_average)),
-				"max": __transform_to_number(__get_grade_state(average.max)),
-				"min": __transform_to_number(__get_grade_state(average.min)),
-				"out_of": __transform_to_number(__get_grade_state(average.out_of)),
-				"significant": __get_grade_state(average.student, True),
-				"color": average.background_color if average.background_color != None else "#08BE88"
-			}
-
-			averagesData.append(averageData)
-
-		gradeReturn = {
-			"grades": gradesData,
-			"averages": averagesData,
-			"overall_average": __transform_to_number(__get_grade_state(client.calculated_period.overall_average)),
-			"class_overall_average": __transform_to_number(__get_grade_state(client.calculated_period.class_overall_average)),
-		}
-
-		return rjson(gradeReturn)
+		return await cached_client_call(request, token, 'grades', __get_grades, request_fields(request))
 	else:
 		return text('"'+success+'"', status=498)
 
+def __get_absences(client: pronotepy.Client, allPeriods: bool, fields: str|None = None) -> list[dict]:
+	"""
+	Récupère et met en forme les absences. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		allPeriods (bool): Si toutes les périodes doivent être récupérées
+		fields (str|None): Les champs demandés (voir request_fields), None pour tous les champs
+		
+	Returns:
+		list[dict]: Les informations des absences
+	"""
+	
+	return list(__iter_absences(client, allPeriods, fields))
+
+def __iter_absences(client: pronotepy.Client, allPeriods: bool, fields: str|None = None):
+	# les absences de chaque période ne sont téléchargées qu'au moment de les envoyer
+	absenceFields = parse_fields(fields)
+	periods = client.activated_period if allPeriods else [client.calculated_period]
+	for period in periods:
+		for absence in period.absences:
+			yield serialize_absence(absence, absenceFields)
+
 @app.route('/absences', methods=['GET'])
 async def absences(request):
 	"""
@@ -880,30 +3285,37 @@ async def absences(request):
 	token = request.args.get('token')
 	allPeriods = request.args.get('allPeriods', default=True)
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
-		if allPeriods:
-			allAbsences = [absence for period in client.activated_period for absence in period.absences]
-		else:
-			allAbsences = client.calculated_period.absences
-
-		absencesData = []
-		for absence in allAbsences:
-			absenceData = {
-				"id": absence.id,
-				"from": absence.from_date.strftime("%Y-%m-%d %H:%M"),
-				"to": absence.to_date.strftime("%Y-%m-%d %H:%M"),
-				"justified": absence.justified,
-				"hours": absence.hours,
-				"reasons": absence.reasons,
-			}
+		if wants_ndjson(request):
+			return await stream_client_call(request, token, __iter_absences, allPeriods, request_fields(request))
+		return await cached_client_call(request, token, 'absences', __get_absences, allPeriods, request_fields(request))
+	else:
+		return text('"'+success+'"', status=498)
 
-			absencesData.append(absenceData)
 
-		return rjson(absencesData)
+def __get_delays(client: pronotepy.Client, allPeriods: bool, fields: str|None = None) -> list[dict]:
+	"""
+	Récupère et met en forme les retards. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		allPeriods (bool): Si toutes les périodes doivent être récupérées
+		fields (str|None): Les champs demandés (voir request_fields), None pour tous les champs
+		
+	Returns:
+		list[dict]: Les informations des retards
+	"""
+	
+	if allPeriods:
+		allDelays = [delay for period in client.activated_period for delay in period.delays]
 	else:
-		return text('"'+success+'"', status=498)
+		allDelays = client.calculated_period.delays
+
+	delayFields = parse_fields(fields)
+	delaysData = [serialize_delay(delay, delayFields) for delay in allDelays]
 
+	return delaysData
 
 @app.route('/delays', methods=['GET'])
 async def delays(request):
@@ -921,30 +3333,35 @@ async def delays(request):
 	token = request.args.get('token')
 	allPeriods = request.args.get('allPeriods', default=True)
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
-		if allPeriods:
-			allDelays = [delay for period in client.activated_period for delay in period.delays]
-		else:
-			allDelays = client.calculated_period.delays
-
-		delaysData = []
-		for delay in allDelays:
-			delayData = {
-				"id": delay.id,
-				"date": delay.date.strftime("%Y-%m-%d %H:%M"),
-				"duration": delay.minutes,
-				"justified": delay.justified,
-				"justification": delay.justification,
-				"reasons": delay.reasons,
-			}
+		return await cached_client_call(request, token, 'delays', __get_delays, allPeriods, request_fields(request))
+	else:
+		return text('"'+success+'"', status=498)
 
-			delaysData.append(delayData)
 
-		return rjson(delaysData)
+def __get_punishments(client: pronotepy.Client, allPeriods: bool, fields: str|None = None) -> list[dict]:
+	"""
+	Récupère et met en forme les punitions. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		allPeriods (bool): Si toutes les périodes doivent être récupérées
+		fields (str|None): Les champs demandés (voir request_fields), None pour tous les champs
+		
+	Returns:
+		list[dict]: Les informations des punitions
+	"""
+	
+	if allPeriods:
+		allPunishments = [punishment for period in client.activated_period for punishment in period.punishments]
 	else:
-		return text('"'+success+'"', status=498)
+		allPunishments = client.calculated_period.punishments
 
+	punishmentFields = parse_fields(fields)
+	punishmentsData = [serialize_punishment(punishment, punishmentFields) for punishment in allPunishments]
+
+	return punishmentsData
 
 @app.route('/punishments', methods=['GET'])
 async def punishments(request):
@@ -962,71 +3379,39 @@ async def punishments(request):
 	token = request.args.get('token')
 	allPeriods = request.args.get('allPeriods', default=True)
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
-		if allPeriods:
-			allPunishments = [punishment for period in client.activated_period for punishment in period.punishments]
-		else:
-			allPunishments = client.calculated_period.punishments
-
-		punishmentsData = []
-		for punishment in allPunishments:
-			homeworkDocs = []
-			if punishment.homework_documents is not None:
-				for homeworkDoc in punishment.homework_documents:
-					homeworkDocs.append({
-						"id": homeworkDoc.id,
-						"name": homeworkDoc.name,
-						"url": homeworkDoc.url,
-						"type": homeworkDoc.type
-					})
-
-			circumstanceDocs = []
-			if punishment.circumstance_documents is not None:
-				for circumstanceDoc in punishment.circumstance_documents:
-					circumstanceDocs.append({
-						"id": circumstanceDoc.id,
-						"name": circumstanceDoc.name,
-						"url": circumstanceDoc.url,
-						"type": circumstanceDoc.type
-					})
+		return await cached_client_call(request, token, 'punishments', __get_punishments, allPeriods, request_fields(request))
+	else:
+		return text('"'+success+'"', status=498)
 
-			schedules = []
-			if punishment.schedule is not None:
-				for schedule in punishment.schedule:
-					schedules.append({
-						"id": schedule.id,
-						"start": schedule.start.strftime("%Y-%m-%d %H:%M"),
-						"duration": schedule.duration,
-					})
 
-			punishmentData = {
-				"id": punishment.id,
-				"schedulable": punishment.schedulable,
-				"schedule": schedules,
-				"date": punishment.given.strftime("%Y-%m-%d %H:%M"),
-				"given_by": punishment.giver,
-				"exclusion": punishment.exclusion,
-				"during_lesson": punishment.during_lesson,
-				"homework": {
-					"text": punishment.homework,
-					"documents": homeworkDocs,
-				},
-				"reason": {
-					"text": punishment.reasons,
-					"circumstances": punishment.circumstances,
-					"documents": circumstanceDocs,
-				},
-				"nature": punishment.nature,
-				"duration": punishment.duration
-			}
+def __get_news(client: pronotepy.Client, fields: str|None = None) -> list[dict]:
+	"""
+	Récupère et met en forme les actualités. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		fields (str|None): Les champs demandés (voir request_fields), None pour tous les champs
+		
+	Returns:
+		list[dict]: Les informations des actualités
+	"""
+	
+	return list(__iter_news(client, fields))
 
-			punishmentsData.append(punishmentData)
+def __iter_news(client: pronotepy.Client, fields: str|None = None):
+	allNews = []
+	try :
+		allNews = client.information_and_surveys()
+	except Exception as e:
+		allNews = []
 
-		return rjson(punishmentsData)
-	else:
-		return text('"'+success+'"', status=498)
+	__index_news(client, allNews)
 
+	newsFields = parse_fields(fields)
+	for news in allNews:
+		yield serialize_information(news, newsFields)
 
 @app.route('/news', methods=['GET'])
 async def news(request):
@@ -1042,55 +3427,47 @@ async def news(request):
 	
 	token = request.args.get('token')
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
-		allNews = []
-		try :
-			allNews = client.information_and_surveys()
-		except Exception as e:
-			allNews = []
-
-		newsAllData = []
-		for news in allNews:
-			local_id = ""
-
-			try :
-				local_id += news.title[:3]
-			except Exception as e:
-				local_id += ""
-
-			local_id += news.creation_date.strftime("%Y-%m-%d_%H:%M")
-
-			attachments = []
-			if news.attachments is not None:
-				for attachment in news.attachments:
-					attachments.append({
-						"id": attachment.id,
-						"name": attachment.name,
-						"url": attachment.url,
-						"type": attachment.type
-					})
+		if wants_ndjson(request):
+			return await stream_client_call(request, token, __iter_news, request_fields(request))
+		return await cached_client_call(request, token, 'news', __get_news, request_fields(request))
+	else:
+		return text('"'+success+'"', status=498)
 
-			newsData = {
-				"id": news.id,
-				"local_id": local_id,
-				"title": news.title,
-				"date": news.creation_date.strftime("%Y-%m-%d %H:%M"),
-				"category": news.category,
-				"read": news.read,
-				"survey": news.survey,
-				"anonymous_survey": news.anonymous_response,
-				"author": news.author,
-				"content": news.content,
-				"attachments": attachments,
-				"html_content": news._raw_content
-			}
+def __toggle_news_read(client: pronotepy.Client, newsId: str) -> dict:
+	"""
+	Inverse l'état de lecture d'une actualité. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		newsId (str): L'identifiant local de l'actualité
+		
+	Returns:
+		dict: Le statut de la requête et le nouvel état de lecture
+		
+	Raises:
+		NotFound: si l'actualité n'a pas été trouvée.
+	"""
+	
+	news = find_local_id(client, 'news', newsId, lambda: __index_news(client, client.information_and_surveys()))
 
-			newsAllData.append(newsData)
+	if news is not None:
+		current_state = news.read
 
-		return rjson(newsAllData)
-	else:
-		return text('"'+success+'"', status=498)
+		news.mark_as_read(not news.read)
+		current_state = not news.read
+			
+		return {
+			"status": "ok",
+			"current_state": current_state,
+			"error": None
+		}
+	
+	raise NotFound({
+		"status": "not found",
+		"error": "L'actualité n'a pas été trouvée."
+	})
 
 @app.route('/news/markAsRead', methods=['POST'])
 async def read_news(request):
@@ -1108,43 +3485,57 @@ async def read_news(request):
 	token = request.args.get('token')
 	newsId = request.args.get('newsId')
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
 		if client.logged_in:
 			try:
-				allNews = client.information_and_surveys()
-
-				for news in allNews:
-					local_id = ""
-
-					# return a combination of the 20 first letters of content, 2 first letters of title and the date
-
-					local_id += news.title[:3]
-					local_id += news.creation_date.strftime("%Y-%m-%d_%H:%M")
-
-					if local_id == newsId:
-						current_state = news.read
-
-						news.mark_as_read(not news.read)
-						current_state = not news.read
-							
-						return rjson({
-							"status": "ok",
-							"current_state": current_state,
-							"error": None
-						})
-				
-				raise NotFound({
-					"status": "not found",
-					"error": "L'actualité n'a pas été trouvée."
-				})
-	
+				return rjson(await run_client_call(token, __toggle_news_read, newsId, mutating=True))
+			except ServiceUnavailable:
+				raise
 			except Exception as e:
 				raise ServerError({
 					"status": "error",
 					"error": str(e)
 				})
 
+def __get_discussions(client: pronotepy.Client, fields: str|None = None) -> list[dict]:
+	"""
+	Récupère et met en forme les discussions et leurs messages. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		fields (str|None): Les champs demandés (voir request_fields), None pour tous les champs
+		
+	Returns:
+		list[dict]: Les informations des discussions
+	"""
+	
+	return list(__iter_discussions(client, fields))
+
+def __iter_discussions(client: pronotepy.Client, fields: str|None = None):
+	# les participants de chaque discussion sont téléchargés au moment de l'envoyer (s'ils sont demandés)
+	discussionFields = parse_fields(fields)
+	# le local_id d'une discussion lit sa date, donc ses messages (une requête par discussion) :
+	# les discussions ne sont indexées que si le local_id est demandé, au fur et à mesure de l'envoi,
+	# sinon un endpoint de modification retéléchargera la liste (voir __find_discussion)
+	indexed = discussionFields is None or 'local_id' in discussionFields
+
+	allDiscussions = []
+	try :
+		allDiscussions = client.discussions()
+		if indexed:
+			# une discussion supprimée ne doit pas rester dans l'index
+			client.__dict__.setdefault('papillon_local_ids', {}).pop('discussion', None)
+			mark_client_changed(client)
+	except Exception as e:
+		allDiscussions = []
+
+	for discussion in allDiscussions:
+		serialized = serialize_discussion(discussion, discussionFields)
+		if indexed:
+			index_local_ids(client, 'discussion', {serialized['local_id']: discussion})
+		yield serialized
+
 @app.route('/discussions', methods=['GET'])
 async def discussions(request):
 	"""
@@ -1176,61 +3567,46 @@ async def discussions(request):
 	
 	token = request.args.get('token')
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
-		allDiscussions = []
-		try :
-			allDiscussions = client.discussions()
-		except Exception as e:
-			allDiscussions = []
-
-		discussionsAllData = []
-		for discussion in allDiscussions:
-			messages = []
-			for message in discussion.messages:
-				messages.append({
-					"id": message.id,
-					"content": message.content,
-					"author": message.author,
-					"date": message.date.strftime("%Y-%m-%d %H:%M") if message.date is not None else None,
-					"seen": message.seen
-				})
-
-			local_id = ""
-
-			try:
-				# return a combination of the 20 first letters of subject, 2 first letters of creator and the date
-				local_id += discussion.subject[:3]
-				local_id += discussion.creator[:3]
-				local_id += discussion.date.strftime("%Y-%m-%d_%H:%M")
-			except Exception as e:
-				local_id += discussion.date.strftime("%Y-%m-%d_%H:%M")
-
-			participants = []
-			try :
-				participants = discussion.participants()
-			except Exception as e:
-				participants = []
-
-			discussionData = {
-				"local_id": local_id,
-				"subject": discussion.subject,
-				"creator": discussion.creator,
-				"date": discussion.date.strftime("%Y-%m-%d %H:%M") if discussion.date is not None else None,
-				"unread": discussion.unread,
-				"closed": discussion.close,
-				"replyable": discussion.replyable,
-				"messages": messages,
-				"participants": participants
-			}
-
-			discussionsAllData.append(discussionData)
-
+		if wants_ndjson(request):
+			return await stream_client_call(request, token, __iter_discussions, request_fields(request))
+		discussionsAllData = await run_client_call(token, __get_discussions, request_fields(request))
 		return rjson(discussionsAllData)
 	else:
 		return text('"'+success+'"', status=498)
 
 
+def __delete_discussion(client: pronotepy.Client, discussionId: str) -> dict:
+	"""
+	Supprime une discussion. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		discussionId (str): L'identifiant local de la discussion
+		
+	Returns:
+		dict: Le statut de la requête
+		
+	Raises:
+		NotFound: si la discussion n'a pas été trouvée.
+	"""
+	
+	discussion = __find_discussion(client, discussionId)
+
+	if discussion is not None:
+		discussion.delete()
+		forget_local_id(client, 'discussion', discussionId)
+		return {
+			"status": "ok",
+			"error": None
+		}
+	
+	raise NotFound({
+		"status": "not found",
+		"error": "La discussion n'a pas été trouvée."
+	})
+
 @app.route('/discussion/delete', methods=['POST'])
 async def delete_discussion(request):
 	"""
@@ -1247,38 +3623,53 @@ async def delete_discussion(request):
 	token = request.args.get('token')
 	discussionId = request.args.get('discussionId')
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
 		try:
-			allDiscussions = client.discussions()
-			for discussion in allDiscussions:
-				local_id = ""
-
-				try:
-					# return a combination of the 20 first letters of subject, 2 first letters of creator and the date
-					local_id += discussion.subject[:3]
-					local_id += discussion.creator[:3]
-					local_id += discussion.date.strftime("%Y-%m-%d_%H:%M")
-				except Exception as e:
-					local_id += discussion.date.strftime("%Y-%m-%d_%H:%M")
-
-				if local_id == discussionId:
-					discussion.delete()
-					return rjson({
-						"status": "ok",
-						"error": None
-					})
-			
-			raise NotFound({
-				"status": "not found",
-				"error": "La discussion n'a pas été trouvée."
-			})
+			return rjson(await run_client_call(token, __delete_discussion, discussionId, mutating=True))
+		except ServiceUnavailable:
+			raise
 		except Exception as e:
 			raise ServerError({
 				"status": "error",
 				"error": str(e)
 			})
 
+def __toggle_discussion_read(client: pronotepy.Client, discussionId: str) -> dict:
+	"""
+	Inverse l'état de lecture d'une discussion. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		discussionId (str): L'identifiant local de la discussion
+		
+	Returns:
+		dict: Le statut de la requête
+		
+	Raises:
+		NotFound: si la discussion n'a pas été trouvée.
+	"""
+	
+	discussion = __find_discussion(client, discussionId)
+
+	if discussion is not None:
+		# pronotepy ne met pas unread à jour : l'objet reste dans l'index des local_id, le prochain appel doit voir le nouvel état
+		if discussion.unread == 0: 
+			discussion.mark_as(False)
+			discussion.unread = 1
+		else: 
+			discussion.mark_as(True)
+			discussion.unread = 0
+		return {
+			"status": "ok",
+			"error": None
+		}
+	
+	raise NotFound({
+		"status": "not found",
+		"error": "La discussion n'a pas été trouvée."
+	})
+
 @app.route('/discussion/readState', methods=['POST'])
 async def read_discussion(request):
 	"""
@@ -1295,35 +3686,12 @@ async def read_discussion(request):
 	token = request.args.get('token')
 	discussionId = request.args.get('discussionId')
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
 		try:
-			allDiscussions = client.discussions()
-			for discussion in allDiscussions:
-				local_id = ""
-
-				try:
-					# return a combination of the 20 first letters of subject, 2 first letters of creator and the date
-					local_id += discussion.subject[:3]
-					local_id += discussion.creator[:3]
-					local_id += discussion.date.strftime("%Y-%m-%d_%H:%M")
-				except Exception as e:
-					local_id += discussion.date.strftime("%Y-%m-%d_%H:%M")
-
-				if local_id == discussionId:
-					if discussion.unread == 0: 
-						discussion.mark_as(False)
-					else: 
-						discussion.mark_as(True)
-					return rjson({
-						"status": "ok",
-						"error": None
-					})
-			
-			raise NotFound({
-				"status": "not found",
-				"error": "La discussion n'a pas été trouvée."
-			})
+			return rjson(await run_client_call(token, __toggle_discussion_read, discussionId, mutating=True))
+		except ServiceUnavailable:
+			raise
 		except Exception as e:
 			raise ServerError({
 				"status": "error",
@@ -1332,6 +3700,43 @@ async def read_discussion(request):
 	else:
 		return text('"'+success+'"', status=498)
 
+def __reply_discussion(client: pronotepy.Client, discussionId: str, content: str) -> dict:
+	"""
+	Répond à une discussion. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		discussionId (str): L'identifiant local de la discussion
+		content (str): Le contenu du message
+		
+	Returns:
+		dict: Le statut de la requête
+		
+	Raises:
+		Forbidden: si la discussion n'est pas ouverte à la réponse.
+		NotFound: si la discussion n'a pas été trouvée.
+	"""
+	
+	discussion = __find_discussion(client, discussionId)
+
+	if discussion is not None:
+		if discussion.replyable:
+			discussion.reply(content)
+			return {
+				"status": "ok",
+				"error": None
+			}
+		else:
+			raise Forbidden({
+				"status": "not replyable",
+				"error": "La discussion n'est pas ouverte à la réponse."
+			})
+	
+	raise NotFound({
+		"status": "not found",
+		"error": "La discussion n'a pas été trouvée."
+	})
+
 @app.route('/discussion/reply', methods=['POST'])
 async def reply_discussion(request):
 	"""
@@ -1350,38 +3755,12 @@ async def reply_discussion(request):
 	discussionId = request.args.get('discussionId')
 	content = request.args.get('content')
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
 		try:
-			allDiscussions = client.discussions()
-			for discussion in allDiscussions:
-				local_id = ""
-
-				try:
-					# return a combination of the 20 first letters of subject, 2 first letters of creator and the date
-					local_id += discussion.subject[:3]
-					local_id += discussion.creator[:3]
-					local_id += discussion.date.strftime("%Y-%m-%d_%H:%M")
-				except Exception as e:
-					local_id += discussion.date.strftime("%Y-%m-%d_%H:%M")
-
-				if local_id == discussionId:
-					if discussion.replyable:
-						discussion.reply(content)
-						return rjson({
-							"status": "ok",
-							"error": None
-						})
-					else:
-						raise Forbidden({
-							"status": "not replyable",
-							"error": "La discussion n'est pas ouverte à la réponse."
-						})
-			
-			raise NotFound({
-				"status": "not found",
-				"error": "La discussion n'a pas été trouvée."
-			})
+			return rjson(await run_client_call(token, __reply_discussion, discussionId, content, mutating=True))
+		except ServiceUnavailable:
+			raise
 		except Exception as e:
 			raise ServerError({
 				"status": "error",
@@ -1391,6 +3770,52 @@ async def reply_discussion(request):
 		return text('"'+success+'"', status=498)
 
 
+RECIPIENTS_TTL = 3600 # le temps en sec pendant lequel l'annuaire des destinataires d'une session est réutilisé
+RECIPIENTS_MISS_TTL = 60 # quand un destinataire demandé n'est pas dans l'annuaire, celui-ci est retéléchargé s'il a plus de RECIPIENTS_MISS_TTL sec
+
+def __recipient_directory(client: pronotepy.Client, max_age: int = RECIPIENTS_TTL) -> dict:
+	"""
+	Retourne l'annuaire des destinataires de la session, indexé par identifiant. (appelé dans le pool pronotepy)
+	
+	L'annuaire est gardé sur le client et n'est retéléchargé qu'au-delà de max_age.
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		max_age (int): L'âge maximal en sec de l'annuaire déjà téléchargé
+		
+	Returns:
+		dict[str, pronotepy.Recipient]: Les destinataires possibles, par identifiant, dans l'ordre de Pronote
+	"""
+	
+	fetched_at, directory = client.__dict__.get('papillon_recipients', (0, None))
+	if directory is None or time.time() - fetched_at >= max_age:
+		directory = {recipient.id: recipient for recipient in client.get_recipients()}
+		client.papillon_recipients = (time.time(), directory)
+	return directory
+
+def __get_recipients(client: pronotepy.Client, fields: str|None = None) -> list[dict]:
+	"""
+	Récupère et met en forme les destinataires possibles. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		fields (str|None): Les champs demandés (voir request_fields), None pour tous les champs
+		
+	Returns:
+		list[dict]: La liste des destinataires possibles
+	"""
+	
+	allRecipients = []
+	try:
+		allRecipients = __recipient_directory(client).values()
+	except Exception as e:
+		allRecipients = []
+
+	recipientFields = parse_fields(fields)
+	recipientsAllData = [serialize_recipient(recipient, recipientFields) for recipient in allRecipients]
+
+	return recipientsAllData
+
 @app.route('/recipients', methods=['GET'])
 async def recipients(request):
 	"""
@@ -1414,32 +3839,61 @@ async def recipients(request):
 	
 	token = request.args.get('token')
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
-		allRecipients = []
-		try:
-			allRecipients = client.get_recipients()
-		except Exception as e:
-			allRecipients = []
-
-		recipientsAllData = []
-		for recipient in allRecipients:
-			recipientData = {
-				"id": recipient.id,
-				"name": recipient.name,
-				"type": recipient.type,
-				"email": recipient.email,
-				"functions": recipient.functions,
-				"with_discussion": recipient.with_discussion
-			}
-
-			recipientsAllData.append(recipientData)
-		
-		return rjson(recipientsAllData)
+		return await cached_client_call(request, token, 'recipients', __get_recipients, request_fields(request))
 	else:
 		return text('"'+success+'"', status=498)
 
 
+def __create_discussion(client: pronotepy.Client, subject: str, content: str, recipientsId: str) -> dict:
+	"""
+	Crée une discussion. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		subject (str): Le sujet de la discussion
+		content (str): Le contenu du message
+		recipientsId (str): La liste des identifiants des destinataires ([id1, id2, id3])
+		
+	Returns:
+		dict: Le statut de la requête
+		
+	Raises:
+		BadRequest: si aucun destinataire n'est valide ou si un destinataire n'accepte pas les discussions.
+	"""
+	
+	try:
+		recipientsId = [recipient for recipient in json.loads(recipientsId) if isinstance(recipient, str)]
+	except Exception as e:
+		recipientsId = []
+
+	directory = __recipient_directory(client)
+	if any(recipient not in directory for recipient in recipientsId):
+		# un destinataire a pu être ajouté depuis le téléchargement de l'annuaire
+		directory = __recipient_directory(client, RECIPIENTS_MISS_TTL)
+
+	prn_recipients = [directory[recipient] for recipient in recipientsId if recipient in directory]
+				
+	if len(prn_recipients) == 0:
+		raise BadRequest({
+			"status": "no recipient",
+			"error": "Aucun destinataire valide n'a été trouvé."
+		})
+		
+	for prn_recipient in prn_recipients:
+		if prn_recipient.with_discussion == False:
+			raise BadRequest({
+				"status": "recipient not accept discussion",
+				"error": "Un ou plusieurs destinataires n'acceptent pas les discussions."
+			})
+			
+	client.new_discussion(subject, content, prn_recipients)
+	return {
+		"status": "ok",
+		"error": None
+	}
+
 @app.route('/discussion/create', methods=['POST'])
 async def create_discussion(request):
 	"""
@@ -1460,33 +3914,12 @@ async def create_discussion(request):
 	content = request.args.get('content')
 	recipientsId = request.args.get('recipientsId')
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
 		try:
-			prn_recipients = []
-			for recipient in json_module.loads(recipientsId):
-				for prn_recipient in client.get_recipients():
-					if prn_recipient.id == recipient:
-						prn_recipients.append(prn_recipient)
-						
-			if len(prn_recipients) == 0:
-				raise BadRequest({
-					"status": "no recipient",
-					"error": "Aucun destinataire valide n'a été trouvé."
-				})
-				
-			for prn_recipient in prn_recipients:
-				if prn_recipient.with_discussion == False:
-					raise BadRequest({
-						"status": "recipient not accept discussion",
-						"error": "Un ou plusieurs destinataires n'acceptent pas les discussions."
-					})
-					
-			client.new_discussion(subject, content, prn_recipients)
-			return rjson({
-				"status": "ok",
-				"error": None
-			})
+			return rjson(await run_client_call(token, __create_discussion, subject, content, recipientsId, mutating=True))
+		except ServiceUnavailable:
+			raise
 		except Exception as e:            
 			raise ServerError({
 				"status": "error",
@@ -1496,6 +3929,29 @@ async def create_discussion(request):
 		return text('"'+success+'"', status=498)
 
 
+def __get_evaluations(client: pronotepy.Client, fields: str|None = None) -> list[dict]:
+	"""
+	Récupère et met en forme les évaluations de la période sélectionnée. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		fields (str|None): Les champs demandés (voir request_fields), None pour tous les champs
+		
+	Returns:
+		list[dict]: La liste des évaluations
+	"""
+	
+	allEvaluations = []
+	try :
+		allEvaluations = client.calculated_period.evaluations
+	except Exception as e:
+		allEvaluations = []
+
+	evaluationFields = parse_fields(fields)
+	evaluationsAllData = [serialize_evaluation(evaluation, evaluationFields) for evaluation in allEvaluations]
+
+	return evaluationsAllData
+
 @app.route('/evaluations', methods=['GET'])
 async def evaluations(request):
 	"""
@@ -1533,47 +3989,9 @@ async def evaluations(request):
 	
 	token = request.args.get('token')
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
-		allEvaluations = []
-		try :
-			allEvaluations = client.calculated_period.evaluations
-		except Exception as e:
-			allEvaluations = []
-
-		evaluationsAllData = []
-		for evaluation in allEvaluations:
-			acquisitions = []
-			if evaluation.acquisitions is not None:
-				for acquisition in evaluation.acquisitions:
-					acquisitions.append({
-						"id": acquisition.id,
-						"name": acquisition.name,
-						"coefficient": acquisition.coefficient,
-						"abbreviation": acquisition.abbreviation,
-						"domain": acquisition.domain,
-						"level": acquisition.level
-					})
-
-			evaluationData = {
-				"id": evaluation.id,
-				"subject": {
-					"id": evaluation.subject.id,
-					"name": evaluation.subject.name,
-					"groups": evaluation.subject.groups,
-				},
-				"name": evaluation.name,
-				"description": evaluation.description,
-				"teacher": evaluation.teacher,
-				"date": evaluation.date.strftime("%Y-%m-%d %H:%M"),
-				"paliers": evaluation.paliers,
-				"coefficient": evaluation.coefficient,
-				"acquisitions": acquisitions,
-			}
-
-			evaluationsAllData.append(evaluationData)
-
-		return rjson(evaluationsAllData)
+		return await cached_client_call(request, token, 'evaluations', __get_evaluations, request_fields(request))
 	else:
 		return text('"'+success+'"', status=498)
 
@@ -1638,13 +4056,32 @@ async def export_ical(request):
 	
 	token = request.args.get('token')
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
-		ical_url = client.export_ical()
-		return rjson({"ical_url": ical_url})
+		ical_url = await run_client_call(token, pronotepy.Client.export_ical)
+		return rjson(select_fields({"ical_url": ical_url}, parse_fields(request_fields(request))))
 	else:
 		return text('"'+success+'"', status=498)
 
+def __get_menus(client: pronotepy.Client, dateFrom: datetime.date, dateTo: datetime.date) -> list[dict]:
+	"""
+	Récupère et met en forme les menus entre deux dates. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		dateFrom (datetime.date): La date de début
+		dateTo (datetime.date): La date de fin
+		
+	Returns:
+		list[dict]: La liste des menus
+	"""
+	
+	allMenus = client.menus(date_from=dateFrom, date_to=dateTo)
+
+	menusAllData = [serialize_menu(menu) for menu in allMenus]
+
+	return menusAllData
+
 @app.route('/menu', methods=['GET'])
 async def menu(request):
 	"""
@@ -1686,42 +4123,58 @@ async def menu(request):
 		dateFrom = datetime.datetime.now().date()
 		dateTo = datetime.datetime.now().date()
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 	if success == 'ok':
-		allMenus = client.menus(date_from=dateFrom, date_to=dateTo)
-
-		menusAllData = []
-		for menu in allMenus:
-			cheese = __get_meal_food(menu.cheese)
-			dessert = __get_meal_food(menu.dessert)
-			other_meal = __get_meal_food(menu.other_meal)
-			side_meal = __get_meal_food(menu.side_meal)
-			main_meal = __get_meal_food(menu.main_meal)
-			first_meal = __get_meal_food(menu.first_meal)
-
-			menuData = {
-				"id": menu.id,
-				"name": menu.name,
-				"date": menu.date.strftime("%Y-%m-%d"),
-				"type": {
-					"is_lunch": menu.is_lunch,
-					"is_dinner": menu.is_dinner,
-				},
-				"first_meal": first_meal,
-				"dessert": dessert,
-				"cheese": cheese,
-				"other_meal": other_meal,
-				"side_meal": side_meal,
-				"main_meal": main_meal,
-			}
-
-			menusAllData.append(menuData)
-
-		return rjson(menusAllData)
+		menusBody = await app.ctx.shared_cache.get(client.pronote_url, 'menus', token, __get_menus, dateFrom, dateTo)
+		fields = request_fields(request)
+		if fields is not None:
+			# les menus en cache sont partagés par tout l'établissement : les champs sont choisis après coup
+			return rjson(select_fields(json.loads(menusBody), parse_fields(fields)))
+		return raw(menusBody, content_type='application/json')
 	else:
 		return text('"'+success+'"', status=498)
 	
 
+def __toggle_homework_done(client: pronotepy.Client, dateFrom: datetime.date, dateTo: datetime.date, homeworkId: str) -> dict:
+	"""
+	Inverse l'état d'un devoir. (appelé dans le pool pronotepy)
+	
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		dateFrom (datetime.date): La date de début
+		dateTo (datetime.date): La date de fin
+		homeworkId (str): Le LocaID du devoir
+		
+	Returns:
+		dict: Le statut de la requête et le nouvel état du devoir
+		
+	Raises:
+		NotFound: si le devoir n'a pas été trouvé.
+	"""
+	
+	def refetch():
+		try :
+			__index_homeworks(client, client.homework(date_from=dateFrom, date_to=dateTo))
+		except Exception as e:
+			pass
+
+	homework = find_local_id(client, 'homework', homeworkId, refetch)
+
+	if homework is not None:
+		current_state = homework.done
+		if homework.done:
+			homework.set_done(False)
+			current_state = False
+		else:
+			homework.set_done(True)
+			current_state = True
+		return {
+			"status": "ok",
+			"current_state": current_state,
+			"error": None
+		}
+	raise NotFound("Aucun devoir trouvé avec cet ID local.")
+
 @app.route('/homework/changeState', methods=['POST'])
 async def set_homework_as_done(request):
 	"""
@@ -1749,53 +4202,298 @@ async def set_homework_as_done(request):
 		dateFrom = datetime.datetime.now().date()
 		dateTo = datetime.datetime.now().date()
 
-	success, client = get_client(token)
+	success, client = await get_client(token)
 
 	if success == 'ok':
 		if client.logged_in:
 			try:
-				homeworks = []
-				try :
-					homeworks = client.homework(date_from=dateFrom, date_to=dateTo)
-				except Exception as e:
-					homeworks = []
-				changed = False
-
-				for homework in homeworks:
-					local_id = ""
-
-					# return a combination of the 20 first letters of description, 2 first letters of subject name and the date
-					if len(homework.description) > 20:
-						local_id += homework.description[:20]
-					else:
-						local_id += homework.description
-					
-					local_id += homework.subject.name[:2]
-					local_id += homework.date.strftime("%Y-%m-%d_%H:%M")
-					
-					if local_id == homeworkId:
-						current_state = homework.done
-						if homework.done:
-							homework.set_done(False)
-							current_state = False
-						else:
-							homework.set_done(True)
-							current_state = True
-						changed = True
-						return rjson({
-							"status": "ok",
-							"current_state": current_state,
-							"error": None
-						})
-				if not changed:
-					raise NotFound("Aucun devoir trouvé avec cet ID local.")
+				return rjson(await run_client_call(token, __toggle_homework_done, dateFrom, dateTo, homeworkId, mutating=True))
+			except ServiceUnavailable:
+				raise
 			except Exception as e:
 				raise ServerError(str(e))
 	else:
 		return text('"'+success+'"', status=498)
 
+# synchronisation incrémentale
+# /sync garde sur le client (donc avec la session, y compris dans Redis) une empreinte de chaque objet déjà envoyé : id -> (hash, version d'ajout, version de modification).
+# Le curseur rendu au client désigne une version de cette empreinte : le /sync suivant ne renvoie que les objets ajoutés, modifiés ou retirés depuis.
+SYNC_HOMEWORK_DAYS = 28 # les devoirs synchronisés sont ceux d'aujourd'hui aux SYNC_HOMEWORK_DAYS jours suivants
+SYNC_MAX_REMOVED = 1000 # le nombre d'objets retirés gardés par session, un curseur plus ancien que le plus ancien d'entre eux demande une synchronisation complète
+
+def __get_sync_lists(client: pronotepy.Client) -> dict[str, list[dict]]:
+	today = datetime.date.today()
+	return {
+		'grades': __get_grades(client)['grades'],
+		'homework': __get_homeworks(client, today, today + datetime.timedelta(days=SYNC_HOMEWORK_DAYS)),
+		'news': __get_news(client),
+		'discussions': __get_discussions(client),
+		'absences': __get_absences(client, True),
+		'punishments': __get_punishments(client, True),
+	}
+
+def __sync_item_id(item: dict) -> str:
+	# les discussions n'ont pas d'id Pronote, seulement un local_id
+	return item['id'] if 'id' in item else item['local_id']
+
+def update_sync_snapshot(client: pronotepy.Client, lists: dict[str, list[dict]]) -> dict:
+	"""Met à jour l'empreinte de synchronisation du client avec les listes actuelles.
+
+	La version n'augmente que si un objet a été ajouté, modifié ou retiré.
+
+	Args:
+		client (pronotepy.Client): le client de la session.
+		lists (dict): les objets mis en forme, par type.
+
+	Returns:
+		dict: l'empreinte de la session.
+	"""
+	snapshot = client.__dict__.setdefault('papillon_sync', {
+		'id': secrets.token_urlsafe(6),
+		'version': 0,
+		'horizon': 0, # les retraits jusqu'à cette version ont été oubliés
+		'items': {}, # type -> {id -> (hash, version d'ajout, version de modification)}
+		'removed': {}, # (type, id) -> version du retrait, dans l'ordre des versions
+	})
+	version = snapshot['version'] + 1
+	changed = False
+
+	for kind, items in lists.items():
+		known = snapshot['items'].setdefault(kind, {})
+		seen = set()
+		for item in items:
+			itemId = __sync_item_id(item)
+			digest = hashlib.blake2b(rjson(item).body, digest_size=8).digest()
+			entry = known.get(itemId)
+			if entry is None:
+				known[itemId] = (digest, version, version)
+				snapshot['removed'].pop((kind, itemId), None)
+				changed = True
+			elif entry[0] != digest:
+				known[itemId] = (digest, entry[1], version)
+				changed = True
+			seen.add(itemId)
+
+		for itemId in known.keys() - seen:
+			del known[itemId]
+			snapshot['removed'][(kind, itemId)] = version
+			changed = True
+
+	if changed:
+		snapshot['version'] = version
+		mark_client_changed(client)
+
+	removed = snapshot['removed']
+	while len(removed) > SYNC_MAX_REMOVED:
+		key = next(iter(removed))
+		snapshot['horizon'] = removed.pop(key)
+
+	return snapshot
+
+def __sync(client: pronotepy.Client, since: str|None, fields: str|None = None) -> dict:
+	"""
+	Récupère les listes synchronisées et les compare à l'empreinte de la session. (appelé dans le pool pronotepy)
+
+	Args:
+		client (pronotepy.Client): Le client Pronote
+		since (str|None): Le curseur du dernier /sync du client
+		fields (str|None): Les champs demandés pour chaque objet (voir request_fields), None pour tous les champs
+
+	Returns:
+		dict: Les changements depuis le curseur et le nouveau curseur
+	"""
+
+	lists = __get_sync_lists(client)
+	snapshot = update_sync_snapshot(client, lists)
+
+	# un curseur inconnu (autre session, empreinte réinitialisée...) ou trop ancien demande une synchronisation complète
+	sinceVersion = None
+	snapshotId, _, version = (since or '').rpartition('.')
+	if snapshotId == snapshot['id'] and version.isdigit() and snapshot['horizon'] <= int(version) <= snapshot['version']:
+		sinceVersion = int(version)
+	full = sinceVersion is None
+	if full:
+		sinceVersion = 0
+
+	# l'empreinte est calculée sur les objets entiers : les champs demandés ne sont choisis qu'après coup
+	itemFields = parse_fields(fields)
+	changes = {}
+	for kind, items in lists.items():
+		known = snapshot['items'][kind]
+		added, changed = [], []
+		for item in items:
+			_, addedAt, changedAt = known[__sync_item_id(item)]
+			if changedAt > sinceVersion:
+				(added if addedAt > sinceVersion else changed).append(select_fields(item, itemFields))
+		changes[kind] = {
+			"added": added,
+			"changed": changed,
+			"removed": [] if full else [itemId for (removedKind, itemId), removedAt in snapshot['removed'].items() if removedKind == kind and removedAt > sinceVersion],
+		}
+
+	return {
+		"cursor": f"{snapshot['id']}.{snapshot['version']}",
+		"full": full,
+		"changes": changes,
+	}
+
+@app.route('/sync', methods=['GET'])
+async def sync(request):
+	"""
+	Récupère les notes, devoirs, actualités, discussions, absences et punitions ajoutés, modifiés ou retirés depuis la dernière synchronisation.
+
+	Sans curseur (ou avec un curseur inconnu ou trop ancien), tous les objets sont renvoyés dans "added" et "full" vaut true :
+	le client doit alors remplacer ses listes au lieu de leur appliquer les changements.
+
+	Args:
+		token (str): Le token du client Pronote
+		since (str): Le curseur renvoyé par le /sync précédent (facultatif)
+		fields (str): Les champs renvoyés pour chaque objet, par exemple id,local_id,title (facultatif)
+
+	Returns:
+		dict: Les changements par type d'objet :
+
+		{
+			"cursor": str,
+			"full": bool,
+			"changes": {
+				"grades" | "homework" | "news" | "discussions" | "absences" | "punishments": {
+					"added": list[dict],
+					"changed": list[dict],
+					"removed": list[str], (les id, ou les local_id pour les discussions)
+				},
+			},
+		}
+	"""
+
+	token = request.args.get('token')
+	since = request.args.get('since')
+
+	success, client = await get_client(token)
+	if success == 'ok':
+		return rjson(await run_client_call(token, __sync, since, request_fields(request)))
+	else:
+		return text('"'+success+'"', status=498)
+
+# requêtes groupées
+# /batch exécute plusieurs endpoints de lecture en une seule requête HTTP, avec le même jeton
+BATCH_ROUTES = {
+	'/user': user,
+	'/timetable': timetable,
+	'/content': content,
+	'/homework': homework,
+	'/grades': grades,
+	'/absences': absences,
+	'/delays': delays,
+	'/punishments': punishments,
+	'/news': news,
+	'/discussions': discussions,
+	'/recipients': recipients,
+	'/evaluations': evaluations,
+	'/export/ical': export_ical,
+	'/menu': menu,
+	'/sync': sync,
+}
+BATCH_MAX_REQUESTS = 16 # le nombre maximal de sous-requêtes par requête /batch
+
+async def __run_batch_item(request, token: str, path: str) -> bytes:
+	"""
+	Exécute une sous-requête de /batch avec le handler de son endpoint.
+	
+	Args:
+		request (sanic.Request): La requête /batch (ses en-têtes sont transmis au handler)
+		token (str): Le token du client Pronote
+		path (str): L'endpoint et ses paramètres, par exemple /homework?dateFrom=2023-01-01&dateTo=2023-01-07
+		
+	Returns:
+		bytes: Le résultat JSON de la sous-requête : {"path": str, "status": int, "body": any}
+	"""
+	
+	route, _, query = path.partition('?')
+	args = urllib.parse.parse_qs(query)
+	args['token'] = [token]
+	# les handlers n'utilisent que request.args et request.headers
+	subRequest = types.SimpleNamespace(args=RequestParameters(args), headers=request.headers)
+
+	try:
+		handler = BATCH_ROUTES.get(route)
+		if handler is None:
+			raise NotFound({
+				"status": "unknown route",
+				"error": "Cet endpoint n'existe pas ou ne peut pas être utilisé dans /batch."
+			})
+		response = await handler(subRequest)
+		if response is None:
+			raise ServerError("Le client n'est pas connecté.")
+		status, body = response.status, response.body
+	except SanicException as e:
+		status, body = e.status_code, rjson(e.args[0] if e.args else str(e)).body
+	except Exception as e:
+		status, body = 500, rjson(str(e)).body
+
+	return b'{"path":' + rjson(path).body + b',"status":' + str(status).encode() + b',"body":' + body + b'}'
+
+@app.route('/batch', methods=['POST'])
+async def batch(request):
+	"""
+	Exécute plusieurs endpoints de lecture en même temps, en une seule requête HTTP.
+	
+	Les sous-requêtes partagent le jeton de /batch. Leurs appels à Pronote restent exécutés un par un (un client pronotepy n'est pas thread-safe),
+	mais les réponses déjà en cache sont servies immédiatement et une sous-requête en erreur n'empêche pas les autres de répondre.
+	
+	Args:
+		token (str): Le token du client Pronote
+		body (list[str]): Les endpoints à appeler avec leurs paramètres (BATCH_MAX_REQUESTS au plus), par exemple ["/user", "/homework?dateFrom=2023-01-01&dateTo=2023-01-07"]
+		
+	Returns:
+		list[dict]: Les résultats, dans l'ordre des sous-requêtes :
+		
+		[{
+			"path": str,
+			"status": int,
+			"body": any
+		}]
+		
+	Raises:
+		BadRequest: si le corps n'est pas une liste d'endpoints ou s'il en contient plus de BATCH_MAX_REQUESTS.
+	"""
+	
+	token = request.args.get('token')
+
+	try:
+		paths = request.json
+	except Exception as e:
+		paths = None
+
+	if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths) or len(paths) > BATCH_MAX_REQUESTS:
+		raise BadRequest({
+			"status": "invalid batch",
+			"error": f"Le corps doit être une liste de {BATCH_MAX_REQUESTS} endpoints au plus."
+		})
+
+	success, client = await get_client(token)
+
+	if success == 'ok':
+		results = await asyncio.gather(*[__run_batch_item(request, token, path) for path in paths])
+		return raw(b'[' + b','.join(results) + b']', content_type='application/json')
+	else:
+		return text('"'+success+'"', status=498)
+
 def main():
-	app.run(host="0.0.0.0", port=8000, single_process=True)
+	parser = argparse.ArgumentParser(description="Serveur de l'API Papillon")
+	parser.add_argument('--workers', type=int, default=int(environ.get('WORKERS', 1)), help="nombre de processus qui servent les requêtes (variable d'environnement WORKERS)")
+	args = parser.parse_args()
+
+	if args.workers < 1:
+		parser.error("--workers doit être supérieur ou égal à 1")
+
+	if args.workers == 1:
+		app.run(host="0.0.0.0", port=8000, single_process=True)
+	else:
+		# chaque processus a son propre saved_clients : les sessions doivent être partagées par Redis pour que n'importe quel processus puisse servir n'importe quel jeton
+		if SESSION_BACKEND != 'redis':
+			parser.error("plusieurs processus nécessitent SESSION_BACKEND=redis")
+		app.run(host="0.0.0.0", port=8000, workers=args.workers)
 
 if __name__ == '__main__':
 	main()
\ No newline at end of file
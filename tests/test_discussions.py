@@ -0,0 +1,55 @@
+"""Tests hors ligne des routes des discussions, avec le faux client pronotepy de fake_pronote.py.
+
+Utilisation : python -m pytest tests (nécessite pytest et sanic-testing)
+"""
+
+import base64, os, sys
+
+os.environ.setdefault('FAKE_PRONOTE_LATENCY', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_pronote, server
+from sanic_testing.reusable import ReusableClient
+
+fake_pronote.install(server.pronotepy)
+
+def b64(value: str) -> str:
+    return base64.b64encode(value.encode()).decode()
+
+def test_read_state_toggles_twice(monkeypatch):
+    sent = []
+    mark_as = fake_pronote.Discussion.mark_as
+    monkeypatch.setattr(fake_pronote.Discussion, 'mark_as', lambda self, read: (sent.append(read), mark_as(self, read)))
+
+    with ReusableClient(server.app, port=18200) as client:
+        _, response = client.post('/generatetoken', data={'url': b64('https://fake.index-education.net/pronote/eleve.html'), 'username': b64('eleve'), 'password': b64('motdepasse')})
+        token = response.json['token']
+        _, response = client.get('/discussions', params={'token': token, 'fields': 'local_id,unread'})
+        discussion = response.json[0]
+
+        for _ in range(2):
+            _, response = client.post('/discussion/readState', params={'token': token, 'discussionId': discussion['local_id']})
+            assert response.status == 200
+
+    # pronotepy ne met pas unread à jour après mark_as : le serveur doit quand même alterner
+    assert sent == [discussion['unread'] != 0, discussion['unread'] == 0]
+
+def test_subject_only_listing_reads_no_messages(monkeypatch):
+    read = []
+    messages = fake_pronote.Discussion.messages
+    monkeypatch.setattr(fake_pronote.Discussion, 'messages', property(lambda self: (read.append(self.subject), messages.fget(self))[1]))
+
+    with ReusableClient(server.app, port=18201) as client:
+        tokens = []
+        for _ in range(2):
+            _, response = client.post('/generatetoken', data={'url': b64('https://fake.index-education.net/pronote/eleve.html'), 'username': b64('eleve'), 'password': b64('motdepasse')})
+            tokens.append(response.json['token'])
+
+        _, response = client.get('/discussions', params={'token': tokens[0], 'fields': 'subject'})
+        assert response.status == 200 and all(list(discussion) == ['subject'] for discussion in response.json)
+        assert read == []
+
+        # la première session n'a pas indexé ses discussions : le local_id est retrouvé en retéléchargeant la liste
+        _, response = client.get('/discussions', params={'token': tokens[1], 'fields': 'local_id'})
+        _, response = client.post('/discussion/readState', params={'token': tokens[0], 'discussionId': response.json[0]['local_id']})
+        assert response.status == 200
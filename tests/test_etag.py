@@ -0,0 +1,22 @@
+"""Tests hors ligne de la validation des réponses par ETag.
+
+Utilisation : python -m pytest tests (nécessite pytest et sanic-testing)
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+from sanic_testing.reusable import ReusableClient
+
+def test_not_modified_matches_full_response():
+    with ReusableClient(server.app, port=18220) as client:
+        for encoding in ('gzip', 'identity'):
+            _, response = client.get('/infos', headers={'Accept-Encoding': encoding})
+            assert response.status == 200
+
+            _, notModified = client.get('/infos', headers={'Accept-Encoding': encoding, 'If-None-Match': response.headers['etag']})
+            assert notModified.status == 304
+            assert notModified.headers['etag'] == response.headers['etag']
+            assert not any(header in notModified.headers for header in server.ENTITY_HEADERS)
@@ -0,0 +1,24 @@
+"""Tests hors ligne de /metrics.
+
+Utilisation : python -m pytest tests (nécessite pytest et sanic-testing)
+"""
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+from sanic_testing.reusable import ReusableClient
+
+def test_metrics_requires_token(monkeypatch):
+    monkeypatch.setattr(server, 'METRICS_TOKEN', 'jeton-des-metriques')
+    monkeypatch.setattr(server, 'PROFILE_SECRET', 'secret-admin')
+
+    with ReusableClient(server.app, port=18210) as client:
+        for headers in ({}, {'Authorization': 'Bearer autre'}, {'X-Papillon-Admin': 'autre'}):
+            _, response = client.get('/metrics', headers=headers)
+            assert response.status == 403
+
+        for headers in ({'Authorization': 'Bearer jeton-des-metriques'}, {'X-Papillon-Admin': 'secret-admin'}):
+            _, response = client.get('/metrics', headers=headers)
+            assert response.status == 200 and 'papillon_requests_total' in response.text